@@ -0,0 +1,181 @@
+"""Headless batch analysis: run a list of questions against every EIN.
+
+    python batch_analysis.py -q "How efficient is the organization?" --eins all --output batch_results.db
+    python batch_analysis.py --queries questions.txt --mode batches --parquet results.parquet
+    python batch_analysis.py --queries questions.txt --stub
+
+Results are written to a SQLite table keyed on (ein, query_hash) after every chunk,
+so an interrupted run picks up where it stopped when started again with the same
+arguments. In ``batches`` mode the Message Batches API is used instead of live
+requests; the submitted batch id is recorded and resumed rather than resubmitted.
+"""
+import argparse
+import hashlib
+import sqlite3
+import time
+from datetime import datetime
+
+import pandas as pd
+from utils_app import MODEL, TaxAnalyzer
+from utils_db import DB_PATH, migrate
+from utils_engine import DEFAULT_CONCURRENCY, AnalysisEngine
+from utils_query import fetch_eins, fetch_filings
+
+BATCH_POLL_SECONDS = 30
+
+
+def query_hash(query):
+    return hashlib.sha256(query.strip().encode("utf-8")).hexdigest()[:16]
+
+
+def open_output(path):
+    conn = sqlite3.connect(path)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS batch_results (
+            ein TEXT, query_hash TEXT, query TEXT, answer TEXT, status TEXT,
+            model TEXT, created_at TEXT,
+            PRIMARY KEY (ein, query_hash)
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS batch_jobs (
+            batch_id TEXT PRIMARY KEY, custom_ids TEXT, status TEXT, created_at TEXT
+        )
+    """)
+    return conn
+
+
+def save_results(conn, rows):
+    """Checkpoint a chunk of (ein, query, answer, status) rows in one transaction"""
+    now = datetime.now().isoformat(timespec="seconds")
+    with conn:
+        conn.executemany(
+            "INSERT OR REPLACE INTO batch_results (ein, query_hash, query, answer, status, model, created_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [(ein, query_hash(query), query, answer, status, MODEL, now) for ein, query, answer, status in rows])
+
+
+def pending_jobs(conn, eins, queries):
+    done = set(conn.execute("SELECT ein, query_hash FROM batch_results WHERE status = 'ok'").fetchall())
+    return [(ein, query) for ein in eins for query in queries if (ein, query_hash(query)) not in done]
+
+
+def prepare_jobs(analyzer, df_x, jobs):
+    """{(ein, query): PreparedQuestion}, through the same router, response cache and prompt as the pages"""
+    return {(ein, query): analyzer.prepare(fetch_filings(ein=ein, complete_only=True, db_path=analyzer.db_path), df_x, query, ein)
+            for ein, query in jobs}
+
+
+def run_messages(analyzer, df_x, conn, jobs, chunk_size):
+    for start in range(0, len(jobs), chunk_size):
+        results = analyzer.answer_all(prepare_jobs(analyzer, df_x, jobs[start:start + chunk_size]))
+        save_results(conn, [(ein, query, answer, status) for (ein, query), (answer, status) in results.items()])
+        print(f"{min(start + chunk_size, len(jobs))}/{len(jobs)} analyses written")
+
+
+def run_batches(engine, analyzer, df_x, conn, jobs, chunk_size):
+    by_id = {f"{ein}-{query_hash(query)}": (ein, query) for ein, query in jobs}
+
+    # Resume batches submitted by an earlier, interrupted run before submitting new ones
+    open_batches = conn.execute("SELECT batch_id, custom_ids FROM batch_jobs WHERE status != 'ended'").fetchall()
+    submitted = [batch_id for batch_id, _ in open_batches]
+    in_flight = {custom_id for _, custom_ids in open_batches for custom_id in custom_ids.split()}
+    jobs = [(ein, query) for ein, query in jobs if f"{ein}-{query_hash(query)}" not in in_flight]
+
+    questions = {}
+    for start in range(0, len(jobs), chunk_size):
+        prepared = prepare_jobs(analyzer, df_x, jobs[start:start + chunk_size])
+        questions.update(prepared)
+        # Questions the router or the response cache answers are written straight away
+        save_results(conn, [(ein, query, question.answer, "ok")
+                            for (ein, query), question in prepared.items() if question.answer is not None])
+        requests = [{"custom_id": f"{ein}-{query_hash(query)}", "params": question.request}
+                    for (ein, query), question in prepared.items() if question.answer is None]
+        if not requests:
+            continue
+        batch = engine.create_batch(requests)
+        with conn:
+            conn.execute("INSERT INTO batch_jobs (batch_id, custom_ids, status, created_at) VALUES (?, ?, ?, ?)",
+                         (batch.id, " ".join(r["custom_id"] for r in requests), batch.processing_status,
+                          datetime.now().isoformat(timespec="seconds")))
+        submitted.append(batch.id)
+        print(f"Submitted batch {batch.id} with {len(requests)} requests")
+
+    for batch_id in submitted:
+        batch = engine.retrieve_batch(batch_id)
+        while batch.processing_status != "ended":
+            time.sleep(BATCH_POLL_SECONDS)
+            batch = engine.retrieve_batch(batch_id)
+
+        rows = []
+        for entry in engine.batch_results(batch_id):
+            if entry.custom_id not in by_id:
+                continue
+            ein, query = by_id[entry.custom_id]
+            if entry.result.type == "succeeded":
+                # Batches resumed from an earlier run are prepared again for their cache key
+                question = questions.get((ein, query)) or prepare_jobs(analyzer, df_x, [(ein, query)])[(ein, query)]
+                answer = analyzer.answer_from(question, entry.result.message)
+                rows.append((ein, query, answer, "ok") if answer is not None
+                            else (ein, query, "Unable to generate analysis", "empty"))
+            else:
+                rows.append((ein, query, f"Error analyzing records: {entry.result.type}", "error"))
+        save_results(conn, rows)
+        with conn:
+            conn.execute("UPDATE batch_jobs SET status = 'ended' WHERE batch_id = ?", (batch_id,))
+        print(f"Batch {batch_id}: {len(rows)} analyses written")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run a question set across every EIN in tax_form_basic_data")
+    parser.add_argument("-q", "--query", action="append", default=[], help="question to ask (repeatable)")
+    parser.add_argument("--queries", help="file with one question per line")
+    parser.add_argument("--eins", default="all", help="'all' or a comma-separated list of EINs")
+    parser.add_argument("--db", default=DB_PATH, help="filings database to analyze (tax_data.db)")
+    parser.add_argument("--output", default="batch_results.db", help="SQLite file for results and checkpoints")
+    parser.add_argument("--parquet", help="also export all results to this Parquet file")
+    parser.add_argument("--mode", choices=["messages", "batches"], default="messages")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY)
+    parser.add_argument("--chunk-size", type=int, default=50, help="analyses per checkpoint / per batch")
+    parser.add_argument("--base-url", help="Messages API base URL, e.g. a local stub")
+    parser.add_argument("--stub", action="store_true", help="start and use the local stub server")
+    args = parser.parse_args(argv)
+
+    queries = list(args.query)
+    if args.queries:
+        with open(args.queries, encoding="utf-8") as f:
+            queries += [line.strip() for line in f if line.strip()]
+    if not queries:
+        parser.error("no questions given; use -q or --queries")
+
+    migrate(args.db)
+    eins = fetch_eins(complete_only=True, db_path=args.db) if args.eins == "all" else [e.strip() for e in args.eins.split(",")]
+
+    base_url = args.base_url
+    if args.stub:
+        from utils_stub_server import start_stub_server
+        _, base_url = start_stub_server()
+    engine = AnalysisEngine(base_url=base_url, concurrency=args.concurrency,
+                            api_key="stub" if args.stub else None)
+    analyzer = TaxAnalyzer(db_path=args.db)
+    analyzer.engine = engine
+
+    conn = open_output(args.output)
+    try:
+        jobs = pending_jobs(conn, eins, queries)
+        print(f"{len(jobs)} of {len(eins) * len(queries)} analyses left to run")
+        df_x = fetch_filings(complete_only=True, db_path=args.db)
+        if args.mode == "batches":
+            run_batches(engine, analyzer, df_x, conn, jobs, args.chunk_size)
+        else:
+            run_messages(analyzer, df_x, conn, jobs, args.chunk_size)
+
+        if args.parquet:
+            pd.read_sql_query("SELECT * FROM batch_results", conn).to_parquet(args.parquet, index=False)
+            print(f"Results exported to {args.parquet}")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,345 @@
+"""Benchmarks for data loading, context building and end-to-end analysis.
+
+    python benchmark.py                                  # 1k, 100k and 1M filings
+    python benchmark.py --sizes 1000 100000 --repeat 5 --output before.json
+    python benchmark.py --sizes 1000 100000 --output after.json --compare before.json
+
+Synthetic ``tax_form_basic_data`` tables and ``parsed_results.csv`` files are
+generated from the real filings (rows resampled onto new EINs and years, amounts
+rescaled per organization) and kept in ``--data-dir`` for later runs. Each size is
+measured in a fresh process pointed at its dataset through TAX_DATA_DB, so the
+data cache, peer statistics and peak memory of one size never leak into the next.
+Model calls go to the local stub server. Results, including prompt sizes, are
+written as JSON; ``--compare`` prints the change in median time per benchmark.
+"""
+import argparse
+import json
+import os
+import platform
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_SIZES = [1_000, 100_000, 1_000_000]
+DEFAULT_DATA_DIR = os.path.join(BASE_DIR, "benchmark_data")
+DEFAULT_REPEAT = 3
+# Filings per synthetic organization, about the ratio in the real data
+FILINGS_PER_ORG = 8
+LATEST_YEAR = 2023
+SEED = 990
+
+QUERIES = {
+    'lookup': "How many volunteers and employees are there?",
+    'analysis': "How efficient is this organization in fundraising?",
+    'comparison': "Compare this organization's expenses with its peers",
+    'revenue': "Assess the reliability of revenue and the risk from dependence on a single source",
+    'revenue_sources': "Which organizations earn revenue from parking or restaurants?",
+}
+
+
+def _resample(df, rows, rng):
+    """``rows`` rows drawn from ``df`` with FILINGS_PER_ORG consecutive years per new EIN"""
+    sample = df.iloc[rng.integers(0, len(df), rows)].reset_index(drop=True)
+    position = np.arange(rows)
+    org = position // FILINGS_PER_ORG
+    sample['ein'] = pd.Series(900_000_000 + org).astype(str)
+
+    # Periods keep their month and day but end LATEST_YEAR, LATEST_YEAR - 1, ... per organization
+    end_year = pd.to_numeric(sample['tax_period_end'].astype(str).str[:4], errors='coerce')
+    offset = LATEST_YEAR - position % FILINGS_PER_ORG - end_year
+    for col in ('tax_period_begin', 'tax_period_end'):
+        sample[col] = _shift_dates(sample[col], offset)
+    if 'tax_year' in sample.columns:
+        sample['tax_year'] = LATEST_YEAR - position % FILINGS_PER_ORG
+
+    # Organizations differ in size, so rescale every amount by a per-organization factor
+    scale = rng.lognormal(0, 1, org.max() + 1)[org]
+    for col in sample.columns:
+        if col in ('ein', 'formation_year', 'tax_year') or col.startswith('tax_period'):
+            continue
+        values = pd.to_numeric(sample[col], errors='coerce')
+        if values.notna().any():
+            sample[col] = (values * scale).round(2).where(values.notna(), sample[col])
+    return sample
+
+
+def _shift_dates(dates, offset):
+    """Move 'YYYY-MM-DD' dates by ``offset`` years, leaving blanks and unparseable values alone"""
+    text = dates.astype(str)
+    year = pd.to_numeric(text.str[:4], errors='coerce')
+    valid = year.notna() & offset.notna()
+    shifted = (year + offset).where(valid, 0).astype(int).astype(str).str.zfill(4) + text.str[4:]
+    return shifted.where(valid, dates)
+
+
+def generate_dataset(rows, data_dir, source_db):
+    """Write filings_<rows>.db and parsed_results_<rows>.csv, reusing existing ones"""
+    from utils_db import FILINGS_TABLE, LINE_ITEMS_TABLE, REVENUE_TABLE, migrate
+    from utils_line_items import pivot_line_items
+    from utils_metrics import refresh_metrics
+    from utils_peer_stats import refresh_peer_stats
+    from utils_pipeline import run_pipeline
+    from utils_trends import refresh_trends
+
+    os.makedirs(data_dir, exist_ok=True)
+    db_path = os.path.join(data_dir, f"filings_{rows}.db")
+    csv_path = os.path.join(data_dir, f"parsed_results_{rows}.csv")
+    if os.path.exists(db_path) and os.path.exists(csv_path):
+        return db_path, csv_path
+
+    rng = np.random.default_rng(SEED)
+    migrate(source_db)
+    source = sqlite3.connect(f"file:{source_db}?mode=ro", uri=True)
+    try:
+        filings = pd.read_sql_query(f"SELECT * FROM {FILINGS_TABLE} WHERE tax_period_begin != ''", source)
+        # Exported wide, the way parsed_results.csv carries the repeating revenue groups
+        revenue = pd.read_sql_query(f"SELECT * FROM {REVENUE_TABLE}", source).merge(
+            pivot_line_items(pd.read_sql_query(f"SELECT * FROM {LINE_ITEMS_TABLE}", source)),
+            on=['ein', 'tax_year'], how='left')
+        # Start from a copy of the real database so schema, indexes and user_version match
+        partial = db_path + ".partial"
+        if os.path.exists(partial):
+            os.remove(partial)
+        target = sqlite3.connect(partial)
+        source.backup(target)
+    finally:
+        source.close()
+
+    try:
+        with target:
+            for table in (FILINGS_TABLE, REVENUE_TABLE, LINE_ITEMS_TABLE, 'filing_metrics', 'revenue_metrics',
+                          'peer_stats', 'peer_stats_state', 'revenue_trends', 'ingested_filings',
+                          'pipeline_sources'):
+                target.execute(f"DELETE FROM {table}")
+
+        sample = _resample(filings, rows, rng)
+        columns = list(sample.columns)
+        with target:
+            target.executemany(
+                f"INSERT INTO {FILINGS_TABLE} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+                sample.astype(object).where(sample.notna(), None).itertuples(index=False, name=None))
+        target.execute("VACUUM")
+    finally:
+        target.close()
+    os.replace(partial, db_path)
+
+    _resample(revenue, rows, rng).to_csv(csv_path, index=False)
+
+    run_pipeline([csv_path], db_path=db_path)
+    refresh_metrics(db_path)
+    refresh_peer_stats(db_path)
+    refresh_trends(db_path)
+    return db_path, csv_path
+
+
+def measure(fn, repeat, setup=None):
+    """Run ``fn`` ``repeat`` times; returns (timings in ms, result of the last run)"""
+    timings, result = [], None
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        result = fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    return {
+        'median_ms': round(float(np.median(timings)), 3),
+        'min_ms': round(min(timings), 3),
+        'max_ms': round(max(timings), 3),
+        'runs': repeat,
+    }, result
+
+
+def _prompt_size(text):
+    from utils_context import estimate_tokens
+
+    return {'chars': len(text), 'estimated_tokens': estimate_tokens(text)}
+
+
+def run_benchmarks(db_path, csv_path, repeat, stub_latency):
+    """Time every stage against the dataset the process was started on (TAX_DATA_DB)"""
+    from utils_app import TaxAnalyzer
+    from utils_cache import get_data_cache
+    from utils_db import get_db_data
+    from utils_directory import OrganizationDirectory
+    from utils_engine import AnalysisEngine
+    from utils_pipeline import run_pipeline
+    from utils_query import fetch_eins, fetch_filings
+    from utils_response_cache import ResponseCache
+    from utils_rev_app import RevenueReliabilityAnalyzer
+    from utils_storage import RevenueStore
+    from utils_stub_server import start_stub_server
+
+    workdir = tempfile.mkdtemp(prefix="benchmark_")
+    cache = get_data_cache()
+    results, prompts = {}, {}
+
+    def record(name, fn, setup=None, times=repeat):
+        results[name], value = measure(fn, times, setup)
+        return value
+
+    raw = record('get_db_data.cold', lambda: get_db_data(), setup=cache.invalidate)
+    record('get_db_data.warm', lambda: get_db_data())
+    # The typed frame the pages share (see utils_frame)
+    df_x = record('fetch_filings.cold', lambda: fetch_filings(), setup=cache.invalidate)
+    record('fetch_filings.warm', lambda: fetch_filings())
+    frame_mb = {'raw': round(raw.memory_usage(deep=True).sum() / 1024 ** 2, 2),
+                'typed': round(df_x.memory_usage(deep=True).sum() / 1024 ** 2, 2)}
+    eins = fetch_eins(complete_only=True)
+    ein = eins[len(eins) // 2]
+    record('fetch_eins', lambda: fetch_eins(complete_only=True), setup=cache.invalidate)
+    # The sidebar typeahead: index build once per database change, then a search per keystroke
+    directory = OrganizationDirectory(path=os.path.join(workdir, "org_directory.db"), source=db_path)
+    record('directory.build', directory.build, setup=cache.invalidate, times=1)
+    record('directory.search', lambda: directory.search("the"))
+    record('directory.search_ein', lambda: directory.search(ein[:3]))
+    df = record('ein_filter.sql', lambda: fetch_filings(ein=ein, complete_only=True), setup=cache.invalidate)
+    record('ein_filter.pandas', lambda: df_x[df_x['ein'] == ein])
+
+    _, base_url = start_stub_server(latency=stub_latency)
+    analyzer = TaxAnalyzer(db_path=db_path)
+    analyzer.engine = AnalysisEngine(api_key="stub", base_url=base_url)
+    analyzer.response_cache = ResponseCache(path=os.path.join(workdir, "response_cache.db"))
+    record('get_summary_stats', lambda: analyzer.get_summary_stats(df_x))
+
+    for label, (query, selected) in {
+        'general': (QUERIES['analysis'], "General Context"),
+        'selected': (QUERIES['analysis'], ein),
+        'comparison': (QUERIES['comparison'], ein),
+    }.items():
+        context = record(f'build_context.{label}',
+                         lambda: analyzer.build_context(df, df_x, query, selected))
+        prompts[f'tax_analyzer.{label}'] = _prompt_size(context)
+
+    def analyze(query, selected):
+        analyzer.conversation_history = []
+        return analyzer.analyze(df, df_x, query, selected)
+
+    clear_answers = lambda: analyzer.response_cache.clear()
+    record('analyze.fast_path', lambda: analyze(QUERIES['lookup'], ein))
+    record('analyze.model', lambda: analyze(QUERIES['analysis'], ein), setup=clear_answers)
+    record('analyze.cached', lambda: analyze(QUERIES['analysis'], ein))
+    record('analyze.general_model', lambda: analyze(QUERIES['analysis'], "General Context"), setup=clear_answers)
+
+    # Revenue side: CSV load, Parquet store, and the revenue analyzer over every organization
+    record('pipeline.load_csv', lambda: run_pipeline([csv_path], db_path=db_path, force=True), times=1)
+    store = RevenueStore(path=os.path.join(workdir, "revenue_store"), source=db_path)
+    record('revenue_store.build', store.build, times=1)
+    # The store keeps loaded frames in memory, so only the first (cold) read is timed
+    record('revenue_store.load_ein', lambda: store.load(eins=[ein]), times=1)
+    revenue = record('revenue_store.load_all', lambda: store.load(), times=1)
+    revenue_analyzer = RevenueReliabilityAnalyzer()
+    revenue_analyzer.engine = analyzer.engine
+    revenue_analyzer.response_cache = analyzer.response_cache
+
+    def analyze_revenue(query=QUERIES['revenue']):
+        revenue_analyzer.conversation_history = []
+        return revenue_analyzer.analyze(revenue, query)
+
+    record('revenue_analyzer.analyze', analyze_revenue, setup=clear_answers)
+    # Answered from the revenue description index, over every filing
+    record('revenue_analyzer.index_lookup', lambda: analyze_revenue(QUERIES['revenue_sources']))
+    prompts['revenue_analyzer'] = _prompt_size(revenue_analyzer.context_builder.build(revenue, QUERIES['revenue']))
+
+    peak_rss_mb = None
+    try:
+        import resource
+        # ru_maxrss is KiB on Linux, bytes on macOS
+        peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024 if sys.platform != "darwin" else 1024 ** 2)
+    except ImportError:
+        pass
+
+    return {
+        'filings': len(df_x),
+        'organizations': len(eins),
+        'revenue_rows': len(revenue),
+        'timings': results,
+        'prompts': prompts,
+        'frame_mb': frame_mb,
+        'peak_rss_mb': round(peak_rss_mb, 1) if peak_rss_mb is not None else None,
+    }
+
+
+def run_size(rows, data_dir, repeat, stub_latency):
+    from utils_db import DB_PATH
+
+    db_path, csv_path = generate_dataset(rows, data_dir, DB_PATH)
+    env = dict(os.environ, TAX_DATA_DB=db_path,
+               ANALYZER_SPANS_DB=os.path.join(data_dir, f"spans_{rows}.db"))
+    output = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--worker", csv_path,
+         "--repeat", str(repeat), "--stub-latency", str(stub_latency)],
+        env=env, cwd=BASE_DIR, capture_output=True, text=True)
+    if output.returncode != 0:
+        raise RuntimeError(f"Benchmark of {rows:,} rows failed:\n{output.stderr}")
+    return json.loads(output.stdout.strip().splitlines()[-1])
+
+
+def compare(previous, current):
+    """Print the change in median time for every benchmark both runs measured"""
+    for size, result in current['results'].items():
+        before = previous['results'].get(size)
+        if before is None:
+            continue
+        print(f"\n{int(size):,} rows        before ms     after ms    change")
+        for name, timing in result['timings'].items():
+            old = before['timings'].get(name)
+            if old is None:
+                continue
+            change = (timing['median_ms'] - old['median_ms']) / old['median_ms'] if old['median_ms'] else 0
+            print(f"  {name:<26}{old['median_ms']:>10,.1f}{timing['median_ms']:>13,.1f}{change:>+10.0%}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark data loading, context building and analysis")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="filing rows per dataset")
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT, help="runs per benchmark")
+    parser.add_argument("--data-dir", default=DEFAULT_DATA_DIR, help="where synthetic datasets are kept")
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--compare", help="earlier results JSON to compare against")
+    parser.add_argument("--stub-latency", type=float, default=0.0, help="seconds the stub waits before answering")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.worker:
+        from utils_db import DB_PATH
+        print(json.dumps(run_benchmarks(DB_PATH, args.worker, args.repeat, args.stub_latency)))
+        return
+
+    report = {
+        'created_at': datetime.now().isoformat(timespec="seconds"),
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'platform': platform.platform(),
+        'repeat': args.repeat,
+        'stub_latency': args.stub_latency,
+        'results': {},
+    }
+    for rows in args.sizes:
+        print(f"Benchmarking {rows:,} filings...")
+        result = run_size(rows, args.data_dir, args.repeat, args.stub_latency)
+        report['results'][str(rows)] = result
+        for name, timing in result['timings'].items():
+            print(f"  {name:<26}{timing['median_ms']:>12,.1f} ms")
+        for name, size in result['prompts'].items():
+            print(f"  {'prompt ' + name:<26}{size['chars']:>12,} chars")
+        for name, size in result['frame_mb'].items():
+            print(f"  {'filings frame ' + name:<26}{size:>12,.2f} MB")
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            compare(json.load(f), report)
+
+
+if __name__ == "__main__":
+    main()
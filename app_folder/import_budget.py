@@ -0,0 +1,91 @@
+"""Import-time budget for every page of the Streamlit app.
+
+    python import_budget.py                  # measure every page, exit 1 if one is over budget
+    python import_budget.py --runs 9 --json import_times.json
+
+A page's module-level imports are read from its source and run in a fresh
+interpreter, the way a cold container serves its first render. Streamlit itself
+is imported first and not counted, since the server has always loaded it by the
+time a page runs. The median of ``--runs`` runs is compared with the page's
+budget. Modules in LAZY_MODULES (the API client) must not be loaded by any page
+import at all; they belong behind first use.
+"""
+import argparse
+import ast
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Milliseconds on top of `import streamlit`, measured cold with headroom for slower machines
+PAGE_BUDGETS_MS = {
+    "app.py": 50,
+    "pages/Core_Financial_Health.py": 600,
+    "pages/Revenue_Reliability.py": 600,
+    "pages/Performance.py": 600,
+    "../app.py": 600,
+}
+LAZY_MODULES = ("anthropic",)
+
+_PROBE = """
+import json, sys, time
+sys.path.insert(0, {app_dir!r})
+import streamlit
+start = time.perf_counter()
+{imports}
+elapsed = (time.perf_counter() - start) * 1000
+print(json.dumps({{"ms": elapsed, "lazy_loaded": [m for m in {lazy!r} if m in sys.modules]}}))
+"""
+
+
+def page_imports(path):
+    """Source of the page's module-level import statements"""
+    with open(path, encoding="utf-8") as f:
+        tree = ast.parse(f.read(), filename=path)
+    return "\n".join(ast.unparse(node) for node in tree.body if isinstance(node, (ast.Import, ast.ImportFrom)))
+
+
+def measure_page(page, runs):
+    """Median import time of one page in ms and the lazy modules its imports loaded"""
+    probe = _PROBE.format(app_dir=BASE_DIR, imports=page_imports(os.path.join(BASE_DIR, page)) or "pass",
+                          lazy=LAZY_MODULES)
+    timings, lazy_loaded = [], set()
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, "-c", probe], cwd=BASE_DIR, capture_output=True, text=True)
+        if output.returncode != 0:
+            raise RuntimeError(f"Importing {page} failed:\n{output.stderr}")
+        result = json.loads(output.stdout.strip().splitlines()[-1])
+        timings.append(result["ms"])
+        lazy_loaded.update(result["lazy_loaded"])
+    return statistics.median(timings), sorted(lazy_loaded)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check the cold import time of every Streamlit page")
+    parser.add_argument("pages", nargs="*", default=list(PAGE_BUDGETS_MS), help="page scripts, relative to app_folder")
+    parser.add_argument("--runs", type=int, default=5, help="fresh interpreters per page")
+    parser.add_argument("--json", help="also write the measurements to this file")
+    args = parser.parse_args(argv)
+
+    results, failed = {}, False
+    for page in args.pages:
+        ms, lazy_loaded = measure_page(page, args.runs)
+        budget = PAGE_BUDGETS_MS.get(page)
+        over = (budget is not None and ms > budget) or bool(lazy_loaded)
+        failed |= over
+        results[page] = {"median_ms": round(ms, 1), "budget_ms": budget, "lazy_loaded": lazy_loaded}
+        status = "OVER" if over else "ok"
+        note = f"  loads {', '.join(lazy_loaded)} eagerly" if lazy_loaded else ""
+        print(f"{status:<5}{page:<34}{ms:>8,.0f} ms  (budget {budget if budget is not None else '-'} ms){note}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,19 +1,26 @@
 import sys
 import os
 
-# Add the parent directory to the Python path
-sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+# Add the parent directory to the Python path (pages re-run on every interaction, so only once)
+APP_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if APP_DIR not in sys.path:
+    sys.path.append(APP_DIR)
 
 from utils_app import *
+from utils_router import PATH_LABELS
+from utils_query import fetch_filings
+from utils_db import migrate
+from utils_directory import select_organization
 # from asdfgn import *
-from datetime import datetime
-import pandas as pd
+from utils_conversation import HISTORY_PAGE_SIZE, session_conversation
+import streamlit as st
 
 st.title("Core Financial Health Analysis")
+# Bring the schema up to date once per process; the reads below never write
+migrate()
 # Read from database
-df = get_db_data()
-df = df[df['tax_period_begin'] != '']
-df_x = df.copy()
+df = fetch_filings(complete_only=True)
+df_x = df
 
 with st.sidebar:
     # Add helpful information in a clean format
@@ -42,24 +49,21 @@ with st.sidebar:
     """)
 
     # Select Ein for Primary Context
-    ein_list = df['ein'].unique().tolist()
-    ein_list.insert(0, "General Context")
-    ein_selected = st.selectbox('*Select EIN*', ein_list)
+    ein_selected = select_organization("complete_filings", key="core_ein")
     if ein_selected != "General Context":
-        df = df[df['ein'] == ein_selected]
+        df = fetch_filings(ein=ein_selected, complete_only=True)
         if not df.empty:
             business_name = df['business_name'].unique()[0]
             st.success(f"Selected Business: **{business_name}**")
 
+    # Conversation memory of this browser session about the selected EIN, kept across reruns
+    conversation = session_conversation(st.session_state, "core_financial_health", ein_selected)
+
     # Add clear button for chat history
     if st.button("🗑️ Clear Chat History"):
-        st.session_state.chat_history = []
+        conversation.clear()
         st.rerun()
 
-# Initialize session state for chat history
-if 'chat_history' not in st.session_state:
-    st.session_state.chat_history = []
-
 # Streamlit Interface
 st.title("📊 Nonprofit Tax Record Analysis")
 
@@ -67,10 +71,7 @@ with st.expander("📋 Data Preview"):
     st.dataframe(df.head())
 
 try:
-    # Ensure 'total_revenue' column is numeric
-    df['total_revenue'] = pd.to_numeric(df['total_revenue'], errors='coerce')
-
-    # Display basic stats
+    # Display basic stats (the loader has already typed every column)
     col1, col2, col3 = st.columns(3)
     with col1:
         st.metric("Total Records", len(df))
@@ -85,32 +86,37 @@ try:
     st.markdown("")
 
     # Create analyzer
-    analyzer = TaxAnalyzer()
+    analyzer = TaxAnalyzer(conversation)
 
     # Query input
     query = st.text_input("💭 What would you like to know about the tax records?")
     send_button = st.button("Send")
 
     if send_button and query:
-        with st.spinner("Analyzing..."):
-            # Get analysis
-            analysis = analyzer.analyze(df, df_x, query, ein_selected)
-
-            # Add to chat history
-            timestamp = datetime.now().strftime("%H:%M")
-            st.session_state.chat_history.append({
-                "timestamp": timestamp,
-                "query": query,
-                "response": analysis
-            })
-
-    # Display chat history
+        # Render the answer while it streams in; once complete it moves into the history below
+        placeholder = st.empty()
+        analysis = ""
+        for delta in analyzer.analyze_stream(df, df_x, query, ein_selected):
+            analysis += delta
+            placeholder.markdown(analysis + "▌")
+        if analyzer.last_stored:
+            placeholder.empty()
+        else:
+            # Errors are not kept in the conversation, so leave them on screen
+            placeholder.markdown(analysis)
+
+    # Display chat history, one page at a time so long sessions render as fast as short ones
     st.markdown("### 💬 Conversation History")
-    for chat in reversed(st.session_state.chat_history):
+    history_pages = max(1, -(-len(conversation) // HISTORY_PAGE_SIZE))
+    history_page = 1
+    if history_pages > 1:
+        history_page = st.number_input(f"Page (1 = newest, of {history_pages})", min_value=1,
+                                       max_value=history_pages, value=1, step=1)
+    for chat in conversation.page(history_page - 1):
         # Query
         st.markdown(f"""
         <div style="padding: 10px; margin: 5px 0; border-radius: 5px; background-color: #f0f2f6;">
-            <span style="color: #666;">🕒 {chat['timestamp']}</span><br>
+            <span style="color: #666;">🕒 {chat['timestamp']} · {PATH_LABELS.get(chat.get('path'), '')}</span><br>
             <span style="color: #333;">❓ <b>Question:</b> {chat['query']}</span>
         </div>
         """, unsafe_allow_html=True)
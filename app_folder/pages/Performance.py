@@ -0,0 +1,96 @@
+import sys
+import os
+
+# Add the parent directory to the Python path (pages re-run on every interaction, so only once)
+APP_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if APP_DIR not in sys.path:
+    sys.path.append(APP_DIR)
+
+from datetime import datetime, timedelta
+import pandas as pd
+import streamlit as st
+from utils_instrument import load_spans
+from utils_router import PATH_LABELS
+
+WINDOWS = {"Last hour": timedelta(hours=1), "Last 24 hours": timedelta(days=1),
+           "Last 7 days": timedelta(days=7), "All recorded": None}
+ANALYZE_SPANS = ["tax_analyzer.analyze", "revenue_analyzer.analyze"]
+MODEL_SPANS = ["messages.stream", "messages.create"]
+
+st.title("Performance")
+
+with st.sidebar:
+    st.markdown("""
+    # PERFORMANCE
+    ## 📚 Guide
+
+    Latency, token usage and cache behaviour of the analyzers, recorded for
+    every question asked on the other pages.
+
+    - **analyze**: the whole answer, as the user waits for it
+    - **build_context**: assembling the data context for the prompt
+    - **get_db_data**: database reads (and whether the data cache served them)
+    - **messages.stream / messages.create**: the model call itself
+    - **prompt cache**: input tokens read from or written to the server-side
+      prompt cache (system prompt and data context of follow-up questions)
+    """)
+    window = st.selectbox("*Time window*", list(WINDOWS))
+
+since = None if WINDOWS[window] is None else (datetime.now() - WINDOWS[window]).isoformat(timespec="milliseconds")
+spans = load_spans(since)
+
+if spans.empty:
+    st.info("No analyzer calls recorded yet. Ask a question on one of the analysis pages first.")
+    st.stop()
+
+spans['started_at'] = pd.to_datetime(spans['started_at'])
+analyze = spans[spans['name'].isin(ANALYZE_SPANS)]
+model_calls = spans[spans['name'].isin(MODEL_SPANS)]
+reads = spans[spans['name'] == 'get_db_data']
+
+cache_read = model_calls['cache_read_input_tokens'].sum()
+cache_write = model_calls['cache_creation_input_tokens'].sum()
+prompt_tokens = model_calls['input_tokens'].sum() + cache_read + cache_write
+
+col1, col2, col3, col4, col5 = st.columns(5)
+col1.metric("Questions", f"{len(analyze):,}")
+col2.metric("p95 answer time", f"{analyze['duration_ms'].quantile(0.95) / 1000:,.2f} s" if not analyze.empty else "–")
+col3.metric("Tokens in / out", f"{prompt_tokens:,.0f} / {model_calls['output_tokens'].sum():,.0f}")
+col4.metric("Prompt cache reads", f"{cache_read / prompt_tokens:.0%}" if prompt_tokens else "–",
+            help=f"{cache_read:,.0f} input tokens read from the prompt cache, {cache_write:,.0f} written to it")
+col5.metric("Data cache hit rate", f"{reads['cache_hit'].mean():.0%}" if reads['cache_hit'].notna().any() else "–")
+
+st.subheader("Latency by operation (ms)")
+by_name = spans.groupby('name').agg(
+    calls=('duration_ms', 'size'),
+    p50=('duration_ms', 'median'),
+    p95=('duration_ms', lambda values: values.quantile(0.95)),
+    max=('duration_ms', 'max'),
+    errors=('outcome', lambda values: int((values == 'error').sum())),
+    avg_prompt_chars=('prompt_chars', 'mean'),
+)
+st.dataframe(by_name.round(1))
+
+if analyze['path'].notna().any():
+    st.subheader("How questions were answered")
+    paths = analyze['path'].map(PATH_LABELS).value_counts()
+    st.bar_chart(paths)
+
+st.subheader("Answer time over time (s)")
+chart = analyze.assign(seconds=analyze['duration_ms'] / 1000).pivot_table(
+    index='started_at', columns='name', values='seconds')
+st.line_chart(chart)
+
+if not model_calls.empty:
+    st.subheader("Model calls")
+    st.dataframe(model_calls[['started_at', 'name', 'duration_ms', 'input_tokens', 'cache_read_input_tokens',
+                              'cache_creation_input_tokens', 'output_tokens', 'prompt_chars', 'outcome']].head(50),
+                 hide_index=True)
+
+errors = spans[spans['outcome'] == 'error']
+st.subheader("Recent errors")
+if errors.empty:
+    st.success("No errors in this window.")
+else:
+    st.dataframe(errors[['started_at', 'name', 'error', 'trace_id']].head(50),
+                 hide_index=True)
@@ -1,19 +1,30 @@
 import sys
 import os
 
-# Add the parent directory to the Python path
-sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+# Add the parent directory to the Python path (pages re-run on every interaction, so only once)
+APP_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if APP_DIR not in sys.path:
+    sys.path.append(APP_DIR)
 
 from utils_rev_app import *
-from datetime import datetime
-import pandas as pd
+from utils_router import PATH_LABELS
+from utils_conversation import HISTORY_PAGE_SIZE, session_conversation
+from utils_directory import select_organization
+from utils_storage import get_revenue_store
+from utils_db import migrate
+from utils_trends import ensure_trends
+import streamlit as st
 
 st.title("Revenue Reliability Analysis")
 
-# Read from database
-df = pd.read_csv('parsed_results.csv')
-df = df[df['tax_period_begin'] != '']
-df_x = df.copy()
+# Bring the schema up to date once per process, and the stored revenue trends whenever the
+# revenue rows changed since they were computed; the reads below never write
+migrate()
+ensure_trends()
+
+# Read from the columnar revenue store (rebuilt from parsed_results.csv when it changes).
+# The typed frame is shared by all sessions; filtering below creates a new frame, never a modified one
+df = get_revenue_store().load()
 
 with st.sidebar:
     # Add helpful information in a clean format
@@ -42,24 +53,21 @@ with st.sidebar:
     """)
 
     # Select Ein for Primary Context
-    ein_list = df['ein'].unique().tolist()
-    ein_list.insert(0, "General Context")
-    ein_selected = st.selectbox('*Select EIN*', ein_list)
+    ein_selected = select_organization("revenue", key="revenue_ein")
     if ein_selected != "General Context":
         df = df[df['ein'] == ein_selected]
         if not df.empty:
             business_name = df['business_name'].unique()[0]
             st.success(f"Selected Business: **{business_name}**")
 
+    # Conversation memory of this browser session about the selected EIN, kept across reruns
+    conversation = session_conversation(st.session_state, "revenue_reliability", ein_selected)
+
     # Add clear button for chat history
     if st.button("🗑️ Clear Chat History"):
-        st.session_state.chat_history = []
+        conversation.clear()
         st.rerun()
 
-# Initialize session state for chat history
-if 'chat_history' not in st.session_state:
-    st.session_state.chat_history = []
-
 # Streamlit Interface
 st.title("📊 Nonprofit Tax Record Analysis")
 
@@ -67,10 +75,7 @@ with st.expander("📋 Data Preview"):
     st.dataframe(df.head())
 
 try:
-    # Ensure 'total_revenue' column is numeric
-    df['total_revenue'] = pd.to_numeric(df['total_revenue'], errors='coerce')
-
-    # Display basic stats
+    # Display basic stats (the loader has already typed every column)
     col1, col2, col3 = st.columns(3)
     with col1:
         st.metric("Total Records", len(df))
@@ -85,32 +90,37 @@ try:
     st.markdown("")
 
     # Create analyzer
-    analyzer = RevenueReliabilityAnalyzer()
+    analyzer = RevenueReliabilityAnalyzer(conversation)
 
     # Query input
     query = st.text_input("💭 What would you like to know about the tax records?")
     send_button = st.button("Send")
 
     if send_button and query:
-        with st.spinner("Analyzing..."):
-            # Get analysis
-            analysis = analyzer.analyze(df, query)
-
-            # Add to chat history
-            timestamp = datetime.now().strftime("%H:%M")
-            st.session_state.chat_history.append({
-                "timestamp": timestamp,
-                "query": query,
-                "response": analysis
-            })
-
-    # Display chat history
+        # Render the answer while it streams in; once complete it moves into the history below
+        placeholder = st.empty()
+        analysis = ""
+        for delta in analyzer.analyze_stream(df, query, ein_selected):
+            analysis += delta
+            placeholder.markdown(analysis + "▌")
+        if analyzer.last_stored:
+            placeholder.empty()
+        else:
+            # Errors are not kept in the conversation, so leave them on screen
+            placeholder.markdown(analysis)
+
+    # Display chat history, one page at a time so long sessions render as fast as short ones
     st.markdown("### 💬 Conversation History")
-    for chat in reversed(st.session_state.chat_history):
+    history_pages = max(1, -(-len(conversation) // HISTORY_PAGE_SIZE))
+    history_page = 1
+    if history_pages > 1:
+        history_page = st.number_input(f"Page (1 = newest, of {history_pages})", min_value=1,
+                                       max_value=history_pages, value=1, step=1)
+    for chat in conversation.page(history_page - 1):
         # Query
         st.markdown(f"""
         <div style="padding: 10px; margin: 5px 0; border-radius: 5px; background-color: #f0f2f6;">
-            <span style="color: #666;">🕒 {chat['timestamp']}</span><br>
+            <span style="color: #666;">🕒 {chat['timestamp']} · {PATH_LABELS.get(chat.get('path'), '')}</span><br>
             <span style="color: #333;">❓ <b>Question:</b> {chat['query']}</span>
         </div>
         """, unsafe_allow_html=True)
@@ -0,0 +1,23 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+
+# Spans from the tests must not land in the app's spans.db; read at import of utils_instrument
+os.environ.setdefault("ANALYZER_SPANS_DB", os.path.join(tempfile.mkdtemp(prefix="spans-"), "spans.db"))
+
+
+@pytest.fixture
+def stub():
+    """A fresh stub Messages API; tests adjust its attributes (latency, rate_limit_every, ...) directly"""
+    from utils_stub_server import start_stub_server
+
+    server, base_url = start_stub_server()
+    server.base_url = base_url
+    yield server
+    server.shutdown()
+    server.server_close()
@@ -0,0 +1,39 @@
+import shutil
+import sqlite3
+
+import utils_response_cache
+from batch_analysis import main
+from utils_db import DB_PATH
+from utils_query import fetch_eins
+from utils_response_cache import ResponseCache
+
+QUESTIONS = ["-q", "How efficient is fundraising?", "-q", "How many volunteers and employees are there?"]
+
+
+def results(path):
+    conn = sqlite3.connect(path)
+    try:
+        rows = conn.execute("SELECT ein, query, answer, status FROM batch_results ORDER BY ein, query").fetchall()
+        batches = conn.execute("SELECT COUNT(*) FROM batch_jobs").fetchone()[0]
+        return rows, batches
+    finally:
+        conn.close()
+
+
+def test_batch_runs_share_the_router_and_response_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(utils_response_cache, "_response_cache", ResponseCache(str(tmp_path / "answers.db")))
+    # main() migrates the database it is given, so it runs on a copy of the tracked one
+    db = shutil.copy(DB_PATH, tmp_path / "tax_data.db")
+    args = ["--stub", "--db", str(db), "--eins", ",".join(fetch_eins(complete_only=True, db_path=str(db))[:2]),
+            *QUESTIONS]
+
+    main(args + ["--output", str(tmp_path / "messages.db")])
+    main(args + ["--mode", "batches", "--output", str(tmp_path / "batches.db")])
+
+    live, _ = results(str(tmp_path / "messages.db"))
+    batched, submitted = results(str(tmp_path / "batches.db"))
+    assert len(live) == 4 and all(status == "ok" for *_, status in live)
+    # Lookups come from the router, analyses from the first run's cached answers: nothing is left to batch
+    assert batched == live
+    assert submitted == 0
+    assert any(answer.startswith("**") for _, _, answer, _ in live)
@@ -0,0 +1,183 @@
+import os
+import sqlite3
+
+import numpy as np
+import pandas as pd
+import pytest
+from utils_cache import DataCache
+from utils_frame import compact_frame
+
+
+@pytest.fixture
+def db(tmp_path):
+    path = str(tmp_path / "data.db")
+    conn = sqlite3.connect(path)
+    with conn:
+        conn.execute("CREATE TABLE t (x INTEGER)")
+        conn.execute("INSERT INTO t VALUES (1)")
+    conn.close()
+    return path
+
+
+def read(path):
+    conn = sqlite3.connect(path)
+    try:
+        return pd.read_sql_query("SELECT x FROM t ORDER BY x", conn)
+    finally:
+        conn.close()
+
+
+def write(path, statement, journal_mode="delete"):
+    conn = sqlite3.connect(path)
+    try:
+        conn.execute(f"PRAGMA journal_mode = {journal_mode}")
+        with conn:
+            conn.execute(statement)
+    finally:
+        conn.close()
+
+
+class Loader:
+    def __init__(self, path):
+        self.path = path
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return read(self.path)
+
+
+def test_unchanged_file_is_served_from_the_cache(db):
+    cache, loader = DataCache(), Loader(db)
+
+    first = cache.get(db, "q", loader)
+    second = cache.get(db, "q", loader)
+
+    assert loader.calls == 1
+    assert second['x'].tolist() == first['x'].tolist() == [1]
+    assert cache.stats()['hits'] == 1
+
+
+def test_write_invalidates(db):
+    cache, loader = DataCache(), Loader(db)
+    cache.get(db, "q", loader)
+
+    write(db, "INSERT INTO t VALUES (2)")
+
+    assert cache.get(db, "q", loader)['x'].tolist() == [1, 2]
+    assert loader.calls == 2
+
+
+def test_wal_commit_invalidates_before_a_checkpoint(db):
+    write(db, "INSERT INTO t VALUES (2)", journal_mode="wal")
+    cache, loader = DataCache(), Loader(db)
+    cache.get(db, "q", loader)
+
+    # Keep a connection open so the commit stays in the -wal file
+    holder = sqlite3.connect(db)
+    holder.execute("SELECT 1 FROM t").fetchall()
+    try:
+        write(db, "INSERT INTO t VALUES (3)", journal_mode="wal")
+        assert cache.get(db, "q", loader)['x'].tolist() == [1, 2, 3]
+    finally:
+        holder.close()
+
+
+def test_replaced_file_invalidates(db, tmp_path):
+    cache, loader = DataCache(), Loader(db)
+    cache.get(db, "q", loader)
+
+    replacement = str(tmp_path / "other.db")
+    write(replacement, "CREATE TABLE t (x INTEGER)")
+    write(replacement, "INSERT INTO t VALUES (9)")
+    os.replace(replacement, db)
+
+    assert cache.get(db, "q", loader)['x'].tolist() == [9]
+
+
+def test_entries_expire_after_ttl(db):
+    cache, loader = DataCache(ttl=0), Loader(db)
+
+    cache.get(db, "q", loader)
+    cache.get(db, "q", loader)
+
+    assert loader.calls == 2
+
+
+def test_least_recently_used_entries_are_evicted(db):
+    cache, loader = DataCache(max_entries=2), Loader(db)
+
+    for key in ("a", "b", "a", "c"):
+        cache.get(db, key, loader)
+    cache.get(db, "a", loader)
+    cache.get(db, "b", loader)
+
+    # "b" was the least recently used when "c" came in
+    assert loader.calls == 4
+    assert cache.stats()['entries'] == 2
+
+
+def test_invalidate_drops_only_that_database(db, tmp_path):
+    other = str(tmp_path / "other.db")
+    write(other, "CREATE TABLE t (x INTEGER)")
+    cache = DataCache()
+    loader, other_loader = Loader(db), Loader(other)
+    cache.get(db, "q", loader)
+    cache.get(other, "q", other_loader)
+
+    cache.invalidate(db)
+    cache.get(db, "q", loader)
+    cache.get(other, "q", other_loader)
+
+    assert (loader.calls, other_loader.calls) == (2, 1)
+
+
+def test_callers_cannot_change_the_cached_frame(db):
+    cache, loader = DataCache(), Loader(db)
+
+    frame = cache.get(db, "q", loader)
+    frame['y'] = 1
+    frame['x'] = 0
+
+    assert cache.get(db, "q", loader).columns.tolist() == ['x']
+    assert cache.get(db, "q", loader)['x'].tolist() == [1]
+
+
+def test_values_written_to_an_explicit_copy_stay_there(db):
+    cache, loader = DataCache(), Loader(db)
+
+    frame = cache.get(db, "q", loader).copy()
+    frame.loc[0, 'x'] = 5
+
+    assert cache.get(db, "q", loader)['x'].tolist() == [1]
+
+
+def test_compact_frame_shares_no_arrays_with_the_loaded_frame():
+    loaded = pd.DataFrame({'flag': [True, False], 'note': ['a', 'b']})
+
+    compact = compact_frame(loaded)
+
+    for col in loaded.columns:
+        assert not np.shares_memory(compact[col].to_numpy(), loaded[col].to_numpy())
+
+
+def test_evicted_keys_drop_their_locks(db):
+    cache = DataCache(max_entries=2)
+
+    for key in range(5):
+        cache.get(db, key, Loader(db))
+
+    assert len(cache._key_locks) == 2
+
+
+def test_a_replaced_file_closes_the_old_watcher(db, tmp_path):
+    cache = DataCache()
+    cache.get(db, "q", Loader(db))
+
+    replacement = str(tmp_path / "replacement.db")
+    write(replacement, "CREATE TABLE t (x INTEGER)")
+    os.replace(replacement, db)
+    cache.get(db, "q", Loader(db))
+
+    assert len(cache._watchers) == 1
+    assert next(iter(cache._watchers))[1] == os.stat(db).st_ino
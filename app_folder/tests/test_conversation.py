@@ -0,0 +1,45 @@
+import pandas as pd
+import pytest
+from utils_conversation import ConversationStore
+
+EIN = '111'
+FILINGS = pd.DataFrame({
+    'ein': [EIN], 'business_name': ['Harbor Arts'], 'tax_period_end': ['2022-12-31'],
+    'total_volunteers': [40], 'total_employees': [4],
+})
+QUESTION = "How many volunteers and employees are there?"
+
+
+@pytest.fixture
+def conversation(tmp_path):
+    store = ConversationStore(path=str(tmp_path / "conversations.db"), max_turns=2)
+    return store.conversation("session", "core_financial_health", EIN)
+
+
+def ask(analyzer, df=FILINGS):
+    return "".join(analyzer.analyze_stream(df, FILINGS, QUESTION, EIN))
+
+
+def test_every_answer_is_reported_stored_once_the_history_is_full(conversation):
+    from utils_app import TaxAnalyzer
+
+    analyzer = TaxAnalyzer(conversation)
+    for _ in range(4):
+        ask(analyzer)
+        assert analyzer.last_stored
+
+    # The count stopped growing at max_turns, so it cannot tell whether the turn was stored
+    assert len(conversation) == 2
+
+
+def test_errors_are_not_stored(conversation):
+    from utils_app import TaxAnalyzer
+
+    analyzer = TaxAnalyzer(conversation)
+    ask(analyzer)
+
+    answer = ask(analyzer, df=None)
+
+    assert answer.startswith("Error analyzing records")
+    assert not analyzer.last_stored
+    assert len(conversation) == 1
@@ -0,0 +1,128 @@
+import time
+
+import pytest
+from utils_engine import AnalysisEngine, text_block
+
+REQUEST = {
+    "model": "claude-sonnet-4-6",
+    "system": [text_block("You are analyzing nonprofit tax records.")],
+    "messages": [{"role": "user", "content": [text_block("Question: How efficient is fundraising?")]}],
+    "max_tokens": 100,
+}
+
+
+def make_engine(stub, **options):
+    options = {"max_retries": 3, "base_delay": 0.0, **options}
+    return AnalysisEngine(api_key="test", base_url=stub.base_url, **options)
+
+
+def requests_served(stub):
+    # The stub numbers every Messages request, rejected ones included
+    return next(stub.request_counter) - 1
+
+
+@pytest.mark.parametrize("status_every", ["rate_limit_every", "overloaded_every"])
+def test_create_retries_after_the_suggested_delay(stub, status_every):
+    # Every second request is rejected (429 or 529): the first call goes through, the second is retried once
+    setattr(stub, status_every, 2)
+    stub.retry_after = "0.3"
+    engine = make_engine(stub)
+
+    first = engine.create(**REQUEST)
+    started = time.perf_counter()
+    second = engine.create(**REQUEST)
+
+    # base_delay is 0, so any wait comes from the retry-after header
+    assert time.perf_counter() - started >= 0.3
+    assert second.content[0].text == first.content[0].text
+    assert requests_served(stub) == 3
+
+
+def test_retry_after_is_capped_by_max_delay(stub):
+    stub.rate_limit_every = 2
+    stub.retry_after = "60"
+    engine = make_engine(stub, max_delay=0.1)
+
+    engine.create(**REQUEST)
+    started = time.perf_counter()
+    engine.create(**REQUEST)
+
+    assert time.perf_counter() - started < 5
+
+
+def test_create_gives_up_after_max_retries(stub):
+    from anthropic import RateLimitError
+
+    stub.rate_limit_every = 1
+    engine = make_engine(stub, max_retries=2)
+
+    with pytest.raises(RateLimitError):
+        engine.create(**REQUEST)
+    assert requests_served(stub) == 3
+
+
+def test_run_many_respects_the_concurrency_limit(stub):
+    stub.latency = 0.2
+    engine = make_engine(stub, concurrency=2)
+
+    responses = engine.run_many([REQUEST] * 6)
+
+    assert len(responses) == 6
+    assert not any(isinstance(response, Exception) for response in responses)
+    assert stub.peak_in_flight == 2
+
+
+def test_run_many_returns_failures_in_place(stub):
+    stub.rate_limit_every = 1
+    engine = make_engine(stub, max_retries=0)
+
+    responses = engine.run_many([REQUEST] * 2)
+
+    assert all(isinstance(response, Exception) for response in responses)
+
+
+def test_stream_text_yields_the_answer_in_pieces(stub):
+    engine = make_engine(stub)
+    expected = engine.create(**REQUEST).content[0].text
+
+    deltas = list(engine.stream_text(**REQUEST))
+
+    assert len(deltas) > 1
+    assert "".join(deltas) == expected
+
+
+def test_stream_text_retries_before_the_first_delta(stub):
+    stub.overloaded_every = 2
+    engine = make_engine(stub)
+    expected = engine.create(**REQUEST).content[0].text
+
+    assert "".join(engine.stream_text(**REQUEST)) == expected
+    assert requests_served(stub) == 3
+
+
+def test_stream_text_raises_once_retries_are_exhausted(stub):
+    from anthropic import APIStatusError
+
+    stub.overloaded_every = 1
+    engine = make_engine(stub, max_retries=1)
+
+    with pytest.raises(APIStatusError) as error:
+        list(engine.stream_text(**REQUEST))
+    assert error.value.status_code == 529
+    assert requests_served(stub) == 2
+
+
+def test_closing_stream_text_early_cancels_the_stream(stub):
+    # Slow enough that the rest of the answer would hold the only slot for seconds
+    stub.chunk_delay = 0.5
+    engine = make_engine(stub, concurrency=1)
+
+    deltas = engine.stream_text(**REQUEST)
+    next(deltas)
+    deltas.close()
+
+    stub.chunk_delay = 0.0
+    started = time.perf_counter()
+    engine._submit(engine.acreate(**REQUEST)).result(timeout=5)
+    assert time.perf_counter() - started < 1
+    assert engine._semaphore._value == 1
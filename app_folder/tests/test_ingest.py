@@ -0,0 +1,76 @@
+import sqlite3
+import zipfile
+
+import pytest
+import utils_ingest
+from utils_db import FILINGS_TABLE, migrate
+from utils_ingest import chunk_sources, ingest
+
+RETURN = """<Return xmlns="http://www.irs.gov/efile"><ReturnHeader>
+<TaxPeriodBeginDt>2022-01-01</TaxPeriodBeginDt><TaxPeriodEndDt>2022-12-31</TaxPeriodEndDt>
+<Filer><EIN>{ein}</EIN><BusinessName><BusinessNameLine1Txt>Harbor Arts</BusinessNameLine1Txt></BusinessName></Filer>
+</ReturnHeader><ReturnData><IRS990><CYTotalRevenueAmt>1000</CYTotalRevenueAmt>
+<TotalFunctionalExpensesGrp><TotalAmt>800</TotalAmt></TotalFunctionalExpensesGrp></IRS990></ReturnData></Return>"""
+NOT_A_990 = """<Return><ReturnHeader><Filer><EIN>333</EIN></Filer></ReturnHeader></Return>"""
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    # Metrics and peer statistics are rebuilt elsewhere; these tests only look at the load itself
+    monkeypatch.setattr(utils_ingest, "refresh_metrics", lambda db_path: None)
+    monkeypatch.setattr(utils_ingest, "refresh_peer_stats", lambda db_path: None)
+    path = str(tmp_path / "tax.db")
+    conn = sqlite3.connect(path)
+    with conn:
+        conn.execute(f"CREATE TABLE {FILINGS_TABLE} ({', '.join(utils_ingest.FILING_COLUMNS)})")
+    conn.close()
+    migrate(path)
+    return path
+
+
+def archive(path, members):
+    with zipfile.ZipFile(path, "w") as zf:
+        for name, text in members.items():
+            zf.writestr(name, text)
+    return str(path)
+
+
+def test_chunks_hold_one_archive_each():
+    sources = [("a.zip", "1.xml"), ("b.zip", "2.xml"), ("a.zip", "3.xml"), "4.xml", ("a.zip", "5.xml")]
+
+    assert chunk_sources(sources, size=2) == [("a.zip", ["1.xml", "3.xml"]), ("b.zip", ["2.xml"]),
+                                              (None, ["4.xml"]), ("a.zip", ["5.xml"])]
+
+
+def test_malformed_returns_are_retried_and_rejected_ones_are_not(db, tmp_path, capsys):
+    members = {"111_public.xml": RETURN.format(ein="111"), "333_public.xml": NOT_A_990,
+               "222_public.xml": RETURN.format(ein="222")[:200]}
+    path = archive(tmp_path / "2022.zip", members)
+
+    assert ingest([path], db_path=db, workers=1) == {'parsed': 1, 'skipped': 0, 'rejected': 1, 'failed': 1}
+    assert "Could not parse 222" in capsys.readouterr().out
+
+    # The archive is downloaded again with the truncated return complete
+    members["222_public.xml"] = RETURN.format(ein="222")
+    archive(tmp_path / "2022.zip", members)
+    assert ingest([path], db_path=db, workers=1) == {'parsed': 1, 'skipped': 2, 'rejected': 0, 'failed': 0}
+
+    conn = sqlite3.connect(db)
+    assert [row[0] for row in conn.execute(f"SELECT ein FROM {FILINGS_TABLE} ORDER BY ein")] == ['111', '222']
+    conn.close()
+
+
+def test_a_corrupt_zip_member_fails_only_that_return(db, tmp_path, capsys):
+    members = {"111_public.xml": RETURN.format(ein="111"), "222_public.xml": RETURN.format(ein="222")}
+    path = tmp_path / "2022.zip"
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_STORED) as zf:
+        for name, text in members.items():
+            zf.writestr(name, text)
+    # Still well-formed XML, but no longer matching the member's CRC
+    data = path.read_bytes()
+    corrupt = data.rindex(b"<EIN>222</EIN>")
+    path.write_bytes(data[:corrupt] + b"<EIN>223</EIN>" + data[corrupt + 14:])
+
+    assert ingest([str(path)], db_path=db, workers=1) == {'parsed': 1, 'skipped': 0, 'rejected': 0, 'failed': 1}
+    out = capsys.readouterr().out
+    assert "Could not parse 222" in out and "BadZipFile" in out
@@ -0,0 +1,204 @@
+import sqlite3
+
+import pandas as pd
+import pytest
+from utils_db import FILINGS_TABLE, LINE_ITEMS_TABLE, MIGRATIONS, REVENUE_TABLE, migrate, table_columns
+from utils_descriptions import search_descriptions
+from utils_line_items import LINE_ITEM_FIELDS, load_line_items, pivot_line_items, replace_line_items
+from utils_pipeline import dedupe_filings
+from utils_query import fetch_filings
+
+FILINGS = [
+    ('111', 'Harbor Arts', '2020-01-01', '2020-12-31', 100.0),
+    ('111', 'Harbor Arts', '2021-01-01', '2021-12-31', 120.0),
+    ('222', 'Valley Clinic', '2021-01-01', '2021-12-31', 900.0),
+]
+
+
+def make_db(path, filings=FILINGS, version=0):
+    """A filings database as it looked before any migration, then upgraded to ``version``"""
+    conn = sqlite3.connect(path)
+    try:
+        with conn:
+            conn.execute(f"CREATE TABLE {FILINGS_TABLE} (ein TEXT, business_name TEXT, tax_period_begin TEXT, "
+                         "tax_period_end TEXT, total_revenue REAL)")
+            conn.executemany(f"INSERT INTO {FILINGS_TABLE} VALUES (?, ?, ?, ?, ?)", filings)
+        for target, statements in enumerate(MIGRATIONS[:version], start=1):
+            with conn:
+                for statement in statements:
+                    conn.execute(statement)
+                conn.execute(f"PRAGMA user_version = {target}")
+    finally:
+        conn.close()
+    return path
+
+
+def user_version(path):
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute("PRAGMA user_version").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def query_plan(path, sql, params):
+    conn = sqlite3.connect(path)
+    try:
+        return " ".join(row[-1] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params))
+    finally:
+        conn.close()
+
+
+def test_migrate_upgrades_to_the_latest_version(tmp_path):
+    db = make_db(str(tmp_path / "tax.db"))
+
+    migrate(db)
+
+    assert user_version(db) == len(MIGRATIONS)
+
+
+def test_ein_lookups_are_filtered_by_an_index(tmp_path):
+    db = make_db(str(tmp_path / "tax.db"))
+    migrate(db)
+
+    filings = fetch_filings(ein='111', columns=['ein', 'tax_period_end'], db_path=db)
+
+    assert filings['tax_period_end'].dt.year.tolist() == [2021, 2020]
+    plan = query_plan(db, f"SELECT * FROM {FILINGS_TABLE} WHERE ein = ? ORDER BY tax_period_end DESC", ('111',))
+    assert "USING INDEX" in plan and "TEMP B-TREE" not in plan
+
+
+def test_reads_do_not_migrate(tmp_path):
+    db = make_db(str(tmp_path / "tax.db"))
+
+    fetch_filings(ein='111', db_path=db)
+
+    assert user_version(db) == 0
+
+
+def test_duplicate_filings_stop_the_migration_without_deleting_anything(tmp_path, capsys):
+    duplicate = ('111', 'Harbor Arts (amended)', '2021-01-01', '2021-12-31', 125.0)
+    db = make_db(str(tmp_path / "tax.db"), FILINGS + [duplicate])
+
+    migrate(db)
+
+    assert user_version(db) == 2
+    assert "duplicate filings" in capsys.readouterr().out
+    conn = sqlite3.connect(db)
+    assert conn.execute(f"SELECT COUNT(*) FROM {FILINGS_TABLE}").fetchone()[0] == 4
+    conn.close()
+
+
+def test_dedupe_keeps_the_latest_row_and_lets_the_migration_finish(tmp_path, capsys):
+    duplicate = ('111', 'Harbor Arts (amended)', '2021-01-01', '2021-12-31', 125.0)
+    db = make_db(str(tmp_path / "tax.db"), FILINGS + [duplicate])
+
+    assert dedupe_filings(db) == 1
+    assert "Removing duplicate filing 111 2021-12-31" in capsys.readouterr().out
+    migrate(db)
+
+    assert user_version(db) == len(MIGRATIONS)
+    kept = fetch_filings(ein='111', period='2021-12-31', db_path=db)
+    assert kept['business_name'].tolist() == ['Harbor Arts (amended)']
+    assert dedupe_filings(db) == 0
+
+
+def test_a_failed_migration_leaves_nothing_behind_and_can_be_retried(tmp_path, capsys):
+    db = make_db(str(tmp_path / "tax.db"), version=6)
+    conn = sqlite3.connect(db)
+    with conn:
+        conn.execute(f"INSERT INTO {REVENUE_TABLE} (ein, tax_year, business_name, ProgramServiceRevenueGrp_1_Desc) "
+                     "VALUES ('111', 2021, 'Harbor Arts', 'Parking garage')")
+        # A line item already stored under the same key makes migration 7 fail partway
+        conn.execute(f"CREATE TABLE {LINE_ITEMS_TABLE} (ein TEXT, tax_year INTEGER, line_group TEXT, seq INTEGER, "
+                     "field TEXT, description TEXT, amount REAL, PRIMARY KEY (ein, tax_year, line_group, seq, field))")
+        conn.execute(f"INSERT INTO {LINE_ITEMS_TABLE} VALUES "
+                     "('111', 2021, 'ProgramServiceRevenueGrp', 1, 'TotalRevenueColumnAmt', 'Parking garage', NULL)")
+    conn.close()
+
+    migrate(db)
+
+    assert user_version(db) == 6
+    assert f"UNIQUE constraint failed: {LINE_ITEMS_TABLE}" in capsys.readouterr().out
+    conn = sqlite3.connect(db)
+    tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    assert f"{REVENUE_TABLE}_v7" not in tables
+    with conn:
+        conn.execute(f"DELETE FROM {LINE_ITEMS_TABLE}")
+    conn.close()
+
+    migrate(db)
+
+    assert user_version(db) == len(MIGRATIONS)
+
+
+def test_wide_revenue_lines_move_to_line_items(tmp_path):
+    db = make_db(str(tmp_path / "tax.db"), version=6)
+    wide = {
+        'ProgramServiceRevenueGrp_1_Desc': 'Parking garage', 'ProgramServiceRevenueGrp_1_TotalRevenueColumnAmt': 500.0,
+        'ProgramServiceRevenueGrp_2_Desc': 'Tuition', 'ProgramServiceRevenueGrp_2_TotalRevenueColumnAmt': 300.0,
+        'OtherRevenueMiscGrp_1_Desc': 'Gift shop sales', 'OtherRevenueMiscGrp_1_TotalRevenueColumnAmt': None,
+        'RentalIncomeOrLossGrp_1_RealAmt': 100.0,
+    }
+    conn = sqlite3.connect(db)
+    with conn:
+        conn.execute(f"INSERT INTO {REVENUE_TABLE} (ein, tax_year, business_name, total_revenue, "
+                     f"{', '.join(wide)}) VALUES (?, ?, ?, ?, {', '.join('?' * len(wide))})",
+                     ('111', 2021, 'Harbor Arts', 900.0, *wide.values()))
+    conn.close()
+
+    migrate(db)
+
+    columns = table_columns(REVENUE_TABLE, db_path=db)
+    assert 'total_revenue' in columns
+    assert not any(column.startswith('ProgramServiceRevenueGrp') for column in columns)
+
+    items = load_line_items(['111'], [2021], db_path=db)
+    assert len(items) == 4
+    restored = pivot_line_items(items).iloc[0]
+    for column, value in wide.items():
+        if value is None:
+            assert pd.isna(restored[column])
+        else:
+            assert restored[column] == value
+
+    hits = search_descriptions(['parking'], db_path=db)
+    assert hits[['ein', 'description', 'amount']].values.tolist() == [['111', 'Parking garage', 500.0]]
+    assert search_descriptions(['gift'], db_path=db)['line_group'].tolist() == ['OtherRevenueMiscGrp']
+
+
+def test_line_items_table_has_one_row_per_line_and_field(tmp_path):
+    db = make_db(str(tmp_path / "tax.db"))
+    migrate(db)
+
+    insert = f"INSERT INTO {LINE_ITEMS_TABLE} ({', '.join(LINE_ITEM_FIELDS)}) VALUES (?, ?, ?, ?, ?, ?, ?)"
+    conn = sqlite3.connect(db)
+    with conn:
+        conn.execute(insert, ('111', 2021, 'RentalIncomeOrLossGrp', 1, 'RealAmt', None, 10))
+        with pytest.raises(sqlite3.IntegrityError):
+            conn.execute(insert, ('111', 2021, 'RentalIncomeOrLossGrp', 1, 'RealAmt', None, 20))
+    conn.close()
+
+
+def test_description_search_follows_rewritten_line_items_without_a_rebuild(tmp_path):
+    db = make_db(str(tmp_path / "tax.db"))
+    migrate(db)
+    revenue = pd.DataFrame({'ein': ['111', '222'], 'tax_year': [2021, 2021]})
+    items = pd.DataFrame([
+        ('111', 2021, 'ProgramServiceRevenueGrp', 1, 'TotalRevenueColumnAmt', 'Parking garage', 500.0),
+        ('222', 2021, 'ProgramServiceRevenueGrp', 1, 'TotalRevenueColumnAmt', 'Clinic fees', 900.0),
+    ], columns=LINE_ITEM_FIELDS)
+    conn = sqlite3.connect(db)
+    with conn:
+        conn.execute(f"INSERT INTO {REVENUE_TABLE} (ein, tax_year, business_name) VALUES ('111', 2021, 'Harbor Arts'), "
+                     "('222', 2021, 'Valley Clinic')")
+        replace_line_items(conn, revenue, items)
+    # Rewriting the first filing frees its line's slot; VACUUM may then renumber what is left
+    with conn:
+        replace_line_items(conn, revenue.iloc[:1], items.iloc[:1].assign(description='Gift shop', amount=50.0))
+    conn.execute("VACUUM")
+    conn.close()
+
+    assert search_descriptions(['parking'], db_path=db).empty
+    assert search_descriptions(['gift'], db_path=db)[['ein', 'amount']].values.tolist() == [['111', 50.0]]
+    assert search_descriptions(['clinic'], db_path=db)[['ein', 'amount']].values.tolist() == [['222', 900.0]]
@@ -0,0 +1,29 @@
+import sqlite3
+
+from utils_db import FILINGS_TABLE, migrate
+from utils_peer_stats import PEER_METRICS, get_peer_stats, refresh_peer_stats
+
+
+def test_amending_a_filing_rebuilds_its_year(tmp_path):
+    db = str(tmp_path / "tax.db")
+    conn = sqlite3.connect(db)
+    with conn:
+        conn.execute(f"CREATE TABLE {FILINGS_TABLE} (ein TEXT, tax_period_begin TEXT, tax_period_end TEXT, "
+                     f"{', '.join(f'{metric} REAL' for metric in PEER_METRICS)})")
+        for ein, expenses in (('111', 100.0), ('222', 300.0)):
+            conn.execute(f"INSERT INTO {FILINGS_TABLE} (ein, tax_period_begin, tax_period_end, total_revenue, "
+                         "total_expenses) VALUES (?, '2022-01-01', '2022-12-31', 1000.0, ?)", (ein, expenses))
+    conn.close()
+    migrate(db)
+
+    assert refresh_peer_stats(db) == ['2022']
+    assert refresh_peer_stats(db) == []
+
+    # Same filings, same rowids, same revenue: only an expense amount changes
+    conn = sqlite3.connect(db)
+    with conn:
+        conn.execute(f"UPDATE {FILINGS_TABLE} SET total_expenses = total_expenses * 100")
+    conn.close()
+
+    assert refresh_peer_stats(db) == ['2022']
+    assert get_peer_stats('2022', db_path=db)['total_expenses']['mean'] == 20000.0
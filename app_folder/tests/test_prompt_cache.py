@@ -0,0 +1,42 @@
+import pytest
+from utils_engine import AnalysisEngine, MIN_CACHE_TOKENS
+
+# A selected organization's data context is typically 1,000-2,000 characters: too short to cache
+SHORT_CONTEXT = "Most Recent Data for Harbor Arts:\n- total_revenue: $1,250,000.00\n" * 10
+LONG_CONTEXT = "Most Recent Data for Harbor Arts:\n- total_revenue: $1,250,000.00\n" * 100
+
+
+@pytest.fixture(params=["utils_app", "utils_rev_app"])
+def analyzer(request):
+    module = __import__(request.param)
+    return module.TaxAnalyzer if request.param == "utils_app" else module.RevenueReliabilityAnalyzer
+
+
+def breakpoints(request):
+    blocks = request["system"] + request["messages"][0]["content"]
+    return [i for i, block in enumerate(blocks) if "cache_control" in block]
+
+
+def test_short_prompts_carry_no_cache_breakpoint(analyzer):
+    request = analyzer._request(SHORT_CONTEXT, "How efficient is fundraising?")
+
+    assert breakpoints(request) == []
+
+
+def test_long_prompts_cache_system_prompt_and_data_as_one_prefix(analyzer):
+    request = analyzer._request(LONG_CONTEXT, "How efficient is fundraising?", history="Q: earlier\nA: answer")
+
+    # One breakpoint, after the data block (system prompt first); history and question follow it
+    assert breakpoints(request) == [len(request["system"])]
+
+
+def test_follow_up_questions_read_the_cached_prefix(stub, analyzer):
+    engine = AnalysisEngine(api_key="test", base_url=stub.base_url, base_delay=0.0)
+
+    first = engine.create(**analyzer._request(LONG_CONTEXT, "How efficient is fundraising?"))
+    second = engine.create(**analyzer._request(LONG_CONTEXT, "What drives admin costs?", history="Q: a\nA: b"))
+
+    assert first.usage.cache_creation_input_tokens >= MIN_CACHE_TOKENS
+    assert first.usage.cache_read_input_tokens == 0
+    assert second.usage.cache_read_input_tokens == first.usage.cache_creation_input_tokens
+    assert second.usage.input_tokens < first.usage.input_tokens + first.usage.cache_creation_input_tokens
@@ -0,0 +1,10 @@
+from utils_response_cache import ResponseCache
+
+
+def test_follow_ups_are_keyed_on_the_conversation_before_them():
+    key = ResponseCache.make_key("model", "system", "Why?", "records")
+
+    assert ResponseCache.make_key("model", "system", "why", "records", history="") == key
+    first = ResponseCache.make_key("model", "system", "Why?", "records", history="Q: revenue?\nA: up 10%")
+    second = ResponseCache.make_key("model", "system", "Why?", "records", history="Q: expenses?\nA: down 5%")
+    assert len({key, first, second}) == 3
@@ -0,0 +1,36 @@
+import pandas as pd
+from utils_retrieval import FilingIndex
+
+FILINGS = pd.DataFrame({
+    'ein': ['111', '111', '222'],
+    'tax_period_end': ['2021-12-31', '2022-12-31', '2022-12-31'],
+    'business_name': ['Harbor Arts', 'Harbor Arts', 'Valley Clinic'],
+    'government_grants': [100.0, 120.0, 900.0],
+})
+
+
+def test_replace_drops_filings_the_source_no_longer_has(tmp_path):
+    index = FilingIndex(str(tmp_path / "index.db"))
+    index.index_frame("rag", FILINGS)
+
+    assert index.index_frame("rag", FILINGS.iloc[:2], replace=True) == 0
+    assert index.search("clinic", source="rag").empty
+    assert len(index.search("harbor", source="rag")) == 2
+
+
+def test_without_replace_other_filings_are_kept(tmp_path):
+    index = FilingIndex(str(tmp_path / "index.db"))
+    index.index_frame("rag", FILINGS)
+
+    index.index_frame("rag", FILINGS.iloc[2:])
+
+    assert len(index.search("harbor", source="rag")) == 2
+
+
+def test_search_within_a_frame_only_returns_its_filings(tmp_path):
+    index = FilingIndex(str(tmp_path / "index.db"))
+    index.index_frame("rag", FILINGS)
+
+    hits = index.search("grants", source="rag", within=FILINGS.iloc[1:])
+
+    assert sorted(zip(hits['ein'], hits['tax_period_end'])) == [('111', '2022-12-31'), ('222', '2022-12-31')]
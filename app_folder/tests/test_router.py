@@ -0,0 +1,84 @@
+import sqlite3
+
+import pandas as pd
+import pytest
+from utils_db import FILINGS_TABLE, migrate
+from utils_router import GENERAL_CONTEXT, QueryRouter
+
+EIN = '111'
+FILINGS = pd.DataFrame({
+    'ein': ['111', '111', '111', '222', '333'],
+    'business_name': ['Harbor Arts', 'Harbor Arts', 'Harbor Arts', 'Valley Clinic', 'Hill School'],
+    'tax_period_end': ['2022-12-31', '2019-12-31', '2018-12-31', '2022-12-31', '2022-12-31'],
+    'total_revenue': [300.0, 200.0, 100.0, 900.0, 600.0],
+    'total_expenses': [250.0, 180.0, 90.0, 800.0, 500.0],
+    'fundraising_expenses': [25.0, 18.0, 9.0, 80.0, 50.0],
+    'total_volunteers': [40, 30, 20, 10, 5],
+    'total_employees': [4, 3, 2, 50, 12],
+})
+
+
+@pytest.fixture
+def router(tmp_path):
+    # An empty revenue description index, so revenue-source questions find nothing
+    db = str(tmp_path / "tax.db")
+    conn = sqlite3.connect(db)
+    with conn:
+        conn.execute(f"CREATE TABLE {FILINGS_TABLE} (ein TEXT, tax_period_begin TEXT, tax_period_end TEXT, "
+                     "total_revenue REAL)")
+    conn.close()
+    migrate(db)
+    return QueryRouter(db_path=db)
+
+
+def selected(router, query):
+    return router.route(query, FILINGS[FILINGS['ein'] == EIN], FILINGS, EIN)
+
+
+def general(router, query):
+    return router.route(query, FILINGS, FILINGS, GENERAL_CONTEXT)
+
+
+@pytest.mark.parametrize("query", [
+    "How did revenue change between 2018 and 2022?",
+    "revenue in 2019 vs 2020",
+    "Did total expenses go up from 2017 to 2018?",
+    "What is the net income?",
+    "Is revenue growing?",
+    "How much revenue comes from government grants?",
+    "What percentage of expenses are fundraising expenses?",
+    "What was the total revenue in 2018 and 2022?",
+    "What was the highest revenue?",
+])
+def test_questions_a_lookup_cannot_answer_go_to_the_model(router, query):
+    assert selected(router, query) is None
+
+
+@pytest.mark.parametrize("query", [
+    "What's the average revenue growth?",
+    "What is the average revenue per employee?",
+    "How many organizations have revenue over 1 million?",
+    "What is the highest and lowest revenue?",
+    "Average revenue in 2019 vs 2022",
+])
+def test_questions_an_aggregate_cannot_answer_go_to_the_model(router, query):
+    assert general(router, query) is None
+
+
+def test_lookup_of_several_fields(router):
+    answer = selected(router, "How many volunteers and employees are there?")
+
+    assert "period ending" in answer and "2022" in answer
+    assert "Total volunteers: 40" in answer and "Total employees: 4" in answer
+
+
+def test_lookup_of_a_named_year(router):
+    answer = selected(router, "What was the total revenue in 2019?")
+
+    assert "2019" in answer and "$200.00" in answer
+
+
+def test_aggregate_over_latest_filings(router):
+    assert "$600.00" in general(router, "What's the average total revenue?")
+    assert "Valley Clinic" in general(router, "Which organization has the highest revenue?")
+    assert "3 organizations" in general(router, "How many organizations are there?")
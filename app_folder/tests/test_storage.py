@@ -0,0 +1,64 @@
+import os
+import sqlite3
+
+import pytest
+from utils_db import FILINGS_TABLE, REVENUE_TABLE, migrate
+from utils_storage import POINTER, RevenueStore, revenue_fingerprint
+
+
+def execute(db, sql, params=()):
+    conn = sqlite3.connect(db)
+    with conn:
+        conn.execute(sql, params)
+    conn.close()
+
+
+@pytest.fixture
+def db(tmp_path):
+    path = str(tmp_path / "tax.db")
+    execute(path, f"CREATE TABLE {FILINGS_TABLE} (ein TEXT, business_name TEXT, tax_period_begin TEXT, "
+                  "tax_period_end TEXT, total_revenue REAL)")
+    migrate(path)
+    execute(path, f"INSERT INTO {REVENUE_TABLE} (ein, tax_year, business_name, total_revenue) "
+                  "VALUES ('111', 2021, 'Harbor Arts', 900.0)")
+    return path
+
+
+def versions(store):
+    return sorted(name for name in os.listdir(store.path) if name != POINTER)
+
+
+def test_filings_writes_do_not_change_the_revenue_fingerprint(db):
+    before = revenue_fingerprint(db)
+
+    execute(db, f"INSERT INTO {FILINGS_TABLE} VALUES ('222', 'Valley Clinic', '2021-01-01', '2021-12-31', 5.0)")
+    assert revenue_fingerprint(db) == before
+
+    execute(db, f"UPDATE {REVENUE_TABLE} SET total_revenue = 950.0")
+    assert revenue_fingerprint(db) != before
+
+
+def test_an_amended_amount_changes_the_revenue_fingerprint(db):
+    before = revenue_fingerprint(db)
+
+    # Same rows, same rowids, same total revenue
+    execute(db, f"UPDATE {REVENUE_TABLE} SET government_grants = 120.0")
+
+    assert revenue_fingerprint(db) != before
+
+
+def test_rebuild_swaps_the_pointer_and_keeps_the_replaced_version(db, tmp_path):
+    store = RevenueStore(path=str(tmp_path / "store"), source=db)
+    assert store.load()['total_revenue'].tolist() == [900.0]
+    first = versions(store)
+
+    execute(db, f"INSERT INTO {REVENUE_TABLE} (ein, tax_year, business_name, total_revenue) "
+                "VALUES ('222', 2021, 'Valley Clinic', 400.0)")
+    assert sorted(store.load()['total_revenue'].tolist()) == [400.0, 900.0]
+    second = versions(store)
+    assert len(second) == 2 and second[0] == first[0]
+
+    store.build()
+    # Only the version the pointer last named survives the next swap
+    assert versions(store)[0] == second[1]
+    assert len(versions(store)) == 2
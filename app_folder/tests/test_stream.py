@@ -0,0 +1,54 @@
+import random
+
+import pytest
+from utils_stream import IncrementalReplacer, clean_stream, clean_text
+
+CLEANUPS = [("$,", "$"), ("  ", " "), (" .", ".")]
+
+TEXTS = [
+    "Revenue was $,1,250,000 in 2022 .  Expenses  rose to $,980,000 .",
+    "Program spending  ratio: 82% .   Admin ratio:  9%",
+    "$,$,  . . ..  $",
+    "No cleanup needed here",
+    "",
+]
+
+
+def split_at(text, cuts):
+    bounds = [0, *sorted(cuts), len(text)]
+    return [text[start:end] for start, end in zip(bounds, bounds[1:])]
+
+
+@pytest.mark.parametrize("text", TEXTS)
+def test_every_single_split_matches_cleaning_the_whole_text(text):
+    expected = clean_text(text, CLEANUPS)
+    for cut in range(len(text) + 1):
+        assert "".join(clean_stream(split_at(text, [cut]), CLEANUPS)) == expected
+
+
+@pytest.mark.parametrize("text", TEXTS)
+def test_random_splits_match_cleaning_the_whole_text(text):
+    rng = random.Random(0)
+    expected = clean_text(text, CLEANUPS)
+    for _ in range(200):
+        cuts = rng.sample(range(len(text) + 1), k=min(len(text), rng.randint(1, 8)))
+        assert "".join(clean_stream(split_at(text, cuts), CLEANUPS)) == expected
+
+
+def test_character_by_character():
+    text = TEXTS[0]
+    assert "".join(clean_stream(text, CLEANUPS)) == clean_text(text, CLEANUPS)
+
+
+def test_text_is_released_as_soon_as_it_is_safe():
+    replacer = IncrementalReplacer(CLEANUPS)
+
+    assert replacer.feed("Revenue was $") == "Revenue was"
+    # The trailing " ." could still become part of a cleanup, so it is held back
+    assert replacer.feed(",1,000 .") == " $1,000"
+    assert replacer.feed("  ") == ""
+    assert replacer.flush() == ". "
+
+
+def test_stream_yields_no_empty_deltas():
+    assert "" not in list(clean_stream(["a", " ", " ", "b", "$", ""], CLEANUPS))
@@ -0,0 +1,175 @@
+import sqlite3
+
+import numpy as np
+import pandas as pd
+import pytest
+from utils_db import FILINGS_TABLE, REVENUE_TABLE, migrate
+from utils_trends import (cagr, coefficient_of_variation, compute_trends, concentration_risk, get_revenue_trends,
+                          ensure_trends, holt_forecast, linear_forecast, refresh_trends, yearly_matrices)
+
+YEARS = np.arange(2016, 2024)
+NAN = np.nan
+SERIES = np.array([
+    [100, 110, 121, 133.1, NAN, NAN, NAN, NAN],
+    [NAN, 50, NAN, 80, 70, 95, 90, 120],
+    [10, 10, 10, 10, 10, 10, 10, 10],
+    [NAN, NAN, NAN, NAN, NAN, NAN, 5, NAN],
+    [-20, 40, 60, NAN, NAN, NAN, NAN, NAN],
+])
+
+
+def observed_rows():
+    for values in SERIES:
+        mask = ~np.isnan(values)
+        yield YEARS[mask].astype(float), values[mask]
+
+
+def test_yearly_matrices_scatter_rows_and_keep_the_latest_duplicate():
+    df = pd.DataFrame({
+        'ein': ['1', '2', '1', '1'],
+        'tax_year': ['2020', '2021', '2022', '2020'],
+        'total_revenue': [1.0, 2.0, 3.0, 4.0],
+    })
+
+    eins, years, values = yearly_matrices(df, ['total_revenue'], 'tax_year')
+
+    assert eins.tolist() == ['1', '2']
+    assert years.tolist() == [2020, 2021, 2022]
+    np.testing.assert_array_equal(values[0], [[4.0, NAN, 3.0], [NAN, 2.0, NAN]])
+
+
+def test_cagr_matches_first_and_last_observation():
+    expected = []
+    for x, y in observed_rows():
+        valid = len(y) >= 2 and y[0] > 0 and y[-1] > 0
+        expected.append((y[-1] / y[0]) ** (1 / (x[-1] - x[0])) - 1 if valid else NAN)
+
+    np.testing.assert_allclose(cagr(SERIES, YEARS), expected)
+    assert cagr(SERIES, YEARS)[0] == pytest.approx(0.10)
+
+
+def test_coefficient_of_variation_matches_numpy():
+    expected = [np.std(y, ddof=1) / abs(np.mean(y)) if len(y) >= 2 else NAN for _, y in observed_rows()]
+
+    np.testing.assert_allclose(coefficient_of_variation(SERIES), expected)
+
+
+def test_linear_forecast_matches_a_least_squares_fit():
+    slope, forecast, low, high = linear_forecast(SERIES, YEARS, horizon=2)
+
+    for i, (x, y) in enumerate(observed_rows()):
+        if len(y) < 2:
+            assert np.isnan(slope[i])
+            continue
+        fitted_slope, intercept = np.polyfit(x, y, 1)
+        assert slope[i] == pytest.approx(fitted_slope)
+        if len(y) < 3:
+            assert np.isnan(forecast[i])
+            continue
+        assert forecast[i] == pytest.approx(intercept + fitted_slope * (x[-1] + 2))
+        assert low[i] <= forecast[i] <= high[i]
+
+
+def test_linear_forecast_interval_of_a_perfect_line_is_a_point():
+    values = np.array([[1.0, 2.0, 3.0, 4.0]])
+    _, forecast, low, high = linear_forecast(values, np.arange(2020, 2024))
+
+    np.testing.assert_allclose([forecast[0], low[0], high[0]], [5.0, 5.0, 5.0])
+
+
+def test_holt_forecast_continues_a_linear_series_across_gaps():
+    values = np.array([[100.0, NAN, 120.0, 130.0, 140.0, NAN, 160.0]])
+
+    forecast, low, high = holt_forecast(values, horizon=1)
+
+    assert forecast[0] == pytest.approx(170.0)
+    assert low[0] == pytest.approx(170.0) and high[0] == pytest.approx(170.0)
+
+
+def test_holt_forecast_needs_three_points():
+    forecast, low, high = holt_forecast(SERIES)
+
+    assert np.isnan(forecast[3]) and np.isnan(low[3]) and np.isnan(high[3])
+    assert not np.isnan(forecast[:3]).any()
+
+
+def test_compute_trends_keeps_series_with_two_or_more_years():
+    rows = [{'ein': str(i), 'tax_year': year, 'total_revenue': value}
+            for i, values in enumerate(SERIES) for year, value in zip(YEARS, values) if not np.isnan(value)]
+
+    trends = compute_trends(pd.DataFrame(rows), {'total_revenue': 'total_revenue'})
+
+    assert sorted(trends['ein']) == ['0', '1', '2', '4']
+    first = trends.set_index('ein').loc['0']
+    assert (first['years'], first['first_year'], first['last_year']) == (4, 2016, 2019)
+    assert first['forecast_year'] == 2020
+    assert first['last_value'] == pytest.approx(133.1)
+
+
+def test_compute_trends_derives_the_year_from_the_period_end():
+    df = pd.DataFrame({'ein': ['1', '1'], 'tax_period_end': ['2020-12-31', '2021-12-31'],
+                       'total_revenue': [100.0, 200.0]})
+
+    trends = compute_trends(df)
+
+    assert trends['cagr'].tolist() == pytest.approx([1.0])
+
+
+def test_concentration_risk_levels_and_change():
+    metrics = pd.DataFrame({
+        'ein': ['1', '1', '2', '3'],
+        'tax_year': [2021, 2022, 2022, 2022],
+        'revenue_hhi': [0.30, 0.60, 0.30, 0.10],
+        'largest_source': ['grants', 'grants', 'sales', 'dues'],
+        'largest_source_share': [0.5, 0.75, 0.4, 0.2],
+    })
+
+    risk = concentration_risk(metrics).set_index('ein')
+
+    assert risk['risk'].to_dict() == {'1': 'high', '2': 'moderate', '3': 'low'}
+    assert risk.loc['1', 'hhi_change'] == pytest.approx(0.30)
+
+
+def make_revenue_db(db, rows):
+    conn = sqlite3.connect(db)
+    with conn:
+        conn.execute(f"CREATE TABLE {FILINGS_TABLE} (ein TEXT, business_name TEXT, tax_period_begin TEXT, "
+                     "tax_period_end TEXT, total_revenue REAL)")
+    conn.close()
+    migrate(db)
+    conn = sqlite3.connect(db)
+    with conn:
+        conn.executemany(f"INSERT INTO {REVENUE_TABLE} (ein, tax_year, total_revenue) VALUES (?, ?, ?)", rows)
+    conn.close()
+
+
+def test_refresh_trends_stores_what_compute_trends_returns(tmp_path):
+    db = str(tmp_path / "tax.db")
+    rows = [('111', 2020, 100.0), ('111', 2021, 110.0), ('111', 2022, 121.0), ('222', 2022, 50.0)]
+    make_revenue_db(db, rows)
+
+    assert refresh_trends(db) == 1
+    stored = get_revenue_trends(['111', '222'], db_path=db)
+
+    expected = compute_trends(pd.DataFrame(rows, columns=['ein', 'tax_year', 'total_revenue']))
+    assert stored['ein'].tolist() == ['111']
+    assert stored['cagr'].tolist() == pytest.approx(expected['cagr'].tolist())
+    assert stored['holt_forecast'].tolist() == pytest.approx(expected['holt_forecast'].tolist())
+
+
+def test_ensure_trends_fills_missing_trends_and_refreshes_them_after_a_write(tmp_path):
+    db = str(tmp_path / "tax.db")
+    make_revenue_db(db, [('111', 2020, 100.0), ('111', 2021, 110.0), ('111', 2022, 121.0)])
+
+    assert ensure_trends(db) == 1
+    assert ensure_trends(db) is None
+    before = get_revenue_trends(['111'], db_path=db)['last_value'].tolist()
+
+    conn = sqlite3.connect(db)
+    with conn:
+        conn.execute(f"UPDATE {REVENUE_TABLE} SET total_revenue = 130.0 WHERE ein = '111' AND tax_year = 2022")
+    conn.close()
+
+    assert ensure_trends(db) == 1
+    assert before == [121.0]
+    assert get_revenue_trends(['111'], db_path=db)['last_value'].tolist() == [130.0]
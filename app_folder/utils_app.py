@@ -1,169 +1,312 @@
-import os
-import sqlite3
-import streamlit as st
 import pandas as pd
 import numpy as np
 from dotenv import load_dotenv
-from anthropic import Anthropic
-from datetime import datetime
+from utils_engine import MODEL, build_request, get_engine
+from utils_frame import format_date
+from utils_instrument import get_instrumentation
+from utils_stream import clean_stream, clean_text
+from utils_response_cache import file_fingerprint, get_response_cache
+from utils_db import DB_PATH
+from utils_metrics import format_metrics, get_filing_metrics
+from utils_query import fetch_filings
+from utils_router import CACHE_PATH, FAST_PATH, LLM_PATH, QueryRouter
+from utils_summary import SummaryEngine
+from utils_peer_stats import PEER_METRICS, get_peer_stats, latest_stats_year, revenue_bucket
 
 load_dotenv()
 
+# Formatting fixes applied to every answer, also while it streams
+ANSWER_CLEANUPS = [("$,", "$"), ("  ", " "), (" .", ".")]
+CACHE_SOURCE = "tax_analyzer"
+# Years of derived metrics shown for the selected organization
+METRIC_YEARS = 5
+# The slice of the precomputed peer statistics a "compare" prompt carries
+COMPARISON_METRICS = PEER_METRICS[:5]
+COMPARISON_STATS = ('mean', 'median', 'std')
 
-def get_db_data(query=None):
-    """Retrieve data from SQLite database with improved error handling"""
-    try:
-        conn = sqlite3.connect("tax_data.db")
-        if query is None:
-            query = """
-            SELECT *
-            FROM tax_form_basic_data
-            ORDER BY tax_period_end DESC
-            """
-        df = pd.read_sql_query(query, conn)
-        conn.close()
-        return df
-    except sqlite3.Error as e:
-        print(f"Database error: {e}")
-        return pd.DataFrame()
-    finally:
-        if 'conn' in locals():
-            conn.close()
+# System message focused on efficiency analysis
+SYSTEM_MESSAGE = """You are analyzing nonprofit tax records with a focus on program efficiency. For each analysis:
+                1. Interpret and compare the program efficiency ratios given under Derived Metrics
+                   (already computed from the filings; do not recalculate them):
+                   - Program spending ratio (program expenses / total expenses)
+                   - Administrative expense ratio
+                   - Fundraising efficiency
+                2. Compare against peer organizations when relevant
+                3. Provide specific data-backed insights
+                4. Suggest potential areas for improvement
+                5. Keep responses concise and focused on key metrics"""
+
+
+class PreparedQuestion:
+    """A question on its way to an answer (see ``TaxAnalyzer.prepare``).
+
+    ``answer`` is set when the router or the response cache answered it; otherwise
+    ``request`` is the Messages request to send. ``cache_key`` / ``data_version`` say
+    where a model answer is cached (unset for the router's answers).
+    """
+
+    def __init__(self, query, path, answer=None, request=None, cache_key=None, data_version=None, prompt_chars=None):
+        self.query = query
+        self.path = path
+        self.answer = answer
+        self.request = request
+        self.cache_key = cache_key
+        self.data_version = data_version
+        self.prompt_chars = prompt_chars
 
 
 class TaxAnalyzer:
-    def __init__(self):
-        self.client = Anthropic(api_key=os.getenv("ANTHROPIC_API_KEY"))
+    def __init__(self, conversation=None, db_path=DB_PATH):
+        self._engine = None
+        # Filings database the metrics, peer statistics and cache versions are read from
+        self.db_path = db_path
+        # A stored Conversation (see utils_conversation) survives reruns; without one,
+        # history is kept on this instance
+        self.conversation = conversation
         self.conversation_history = []
+        self.response_cache = get_response_cache()
+        self.router = QueryRouter(db_path)
+        self.instrumentation = get_instrumentation()
+        # Which path served the latest answer: FAST_PATH, CACHE_PATH or LLM_PATH
+        self.last_path = None
+        # Whether the latest answer was kept in the history; errors are not
+        self.last_stored = False
+
+    @property
+    def engine(self):
+        # Built on first model call, so answers from the router or the caches never load the API client
+        if self._engine is None:
+            self._engine = get_engine()
+        return self._engine
+
+    @engine.setter
+    def engine(self, engine):
+        self._engine = engine
 
     def get_summary_stats(self, df, columns_of_interest=None):
         """Get summary statistics for specified columns"""
         if columns_of_interest is None:
-            columns_of_interest = [
-                'total_revenue', 'total_expenses', 'program_service_expenses',
-                'admin_expenses', 'fundraising_expenses', 'total_assets',
-                'total_liabilities', 'net_assets'
-            ]
-
-        stats = {}
-        for col in columns_of_interest:
-            if col in df.columns:
-                stats[col] = {
-                    'mean': df[col].mean(),
-                    'median': df[col].median(),
-                    'std': df[col].std()
-                }
-        return stats
+            columns_of_interest = PEER_METRICS
+
+        # Unknown column names raise here rather than being skipped
+        return SummaryEngine(columns_of_interest).to_dict(df)
+
+    @staticmethod
+    def _format_peer_stats(stats):
+        text = ""
+        for metric in COMPARISON_METRICS:
+            values = stats.get(metric)
+            if not values:
+                continue
+            text += f"\n{metric}:\n"
+            for stat_name in COMPARISON_STATS:
+                value = values.get(stat_name)
+                if pd.notnull(value):
+                    text += f"- {stat_name}: ${value:,.2f}\n"
+        return text
 
     def analyze(self, df: pd.DataFrame, df_x: pd.DataFrame, query: str, ein_selected: str) -> str:
+        """Run the analysis and return the complete answer"""
+        return "".join(self.analyze_stream(df, df_x, query, ein_selected))
+
+    def build_context(self, df: pd.DataFrame, df_x: pd.DataFrame, query: str, ein_selected: str) -> str:
+        """Data context for one question, without the conversation (see ``_history_context``)"""
+        with self.instrumentation.span("tax_analyzer.build_context") as span:
+            context = self._build_context(df, df_x, query, ein_selected)
+            span.set(prompt_chars=len(context))
+        return context
+
+    def _build_context(self, df, df_x, query, ein_selected):
+        keywords = ["peer", "compare"]
+        needs_comparison = any(keyword in query.lower() for keyword in keywords)
+
+        # Start with minimal context
+        context = "Analysis Context:\n\n"
+        context += "Dataset Overview:\n"
+        context += f"Total Organizations: {df_x['business_name'].nunique()}\n"
+        context += f"Date Range: {format_date(df_x['tax_period_begin'].min())} to {format_date(df_x['tax_period_end'].max())}\n\n"
+
+        if needs_comparison:
+            # Peer statistics are precomputed per tax year and revenue bucket, so this is a lookup
+            latest_year = latest_stats_year(self.db_path)
+            stats = get_peer_stats(latest_year, db_path=self.db_path)
+
+            context += f"Industry Statistics (Most Recent Year, {latest_year}):\n"
+            context += self._format_peer_stats(stats)
+
+            # Add selected organization's metrics if available
+            if ein_selected != "General Context" and latest_year is not None:
+                selected_data = df[df['tax_period_end'].astype(str).str.startswith(latest_year)]
+                if not selected_data.empty:
+                    context += "\nSelected Organization Metrics:\n"
+                    for col in COMPARISON_METRICS:
+                        if col in selected_data.columns:
+                            value = pd.to_numeric(selected_data[col].iloc[0], errors='coerce')
+                            if pd.notnull(value):
+                                context += f"- {col}: ${value:,.2f}\n"
+
+                    # Compare against organizations of a similar size as well
+                    bucket = revenue_bucket(selected_data['total_revenue'].iloc[0])
+                    bucket_stats = get_peer_stats(latest_year, bucket, db_path=self.db_path) if bucket else {}
+                    if bucket_stats:
+                        context += f"\nPeers With Similar Revenue ({bucket}):\n"
+                        context += self._format_peer_stats(bucket_stats)
+        else:
+            # For non-comparison queries, only include relevant data for the selected EIN
+            if ein_selected != "General Context":
+                selected_df = df[df['ein'] == ein_selected]
+                if not selected_df.empty:
+                    # Get most recent record
+                    latest_record = selected_df.loc[selected_df['tax_period_end'].idxmax()]
+                    context += f"\nMost Recent Data for {latest_record['business_name']}:\n"
+
+                    # Include only the most relevant fields
+                    relevant_fields = [
+                        'business_name', 'tax_period_end', 'total_revenue',
+                        'total_expenses', 'program_services_expenses', 'management_and_general_expenses',
+                        'fundraising_expenses', 'total_assets_eoy', 'total_liabilities_eoy',
+                        'net_assets_eoy', 'total_employees', 'total_volunteers'
+                    ]
+
+                    for field in relevant_fields:
+                        if field in latest_record.index and pd.notnull(latest_record[field]):
+                            value = latest_record[field]
+                            if isinstance(value, pd.Timestamp):
+                                formatted_value = format_date(value)
+                            elif isinstance(value, (int, float, np.number)):
+                                formatted_value = f"${value:,.2f}" if any(term in field.lower() for term in
+                                                                          ['revenue', 'expenses', 'assets',
+                                                                           'liabilities']) else f"{value:,}"
+                            else:
+                                formatted_value = value
+                            context += f"- {field}: {formatted_value}\n"
+
+        # Ratios, growth and reserves are computed at load time; the model only interprets them
+        if ein_selected != "General Context":
+            metrics = get_filing_metrics([ein_selected], db_path=self.db_path).drop(columns='ein', errors='ignore')
+            metrics_text = format_metrics(metrics, max_rows=METRIC_YEARS)
+            if metrics_text:
+                context += f"\nDerived Metrics (ratios as fractions, newest first):\n{metrics_text}"
+        return context
+
+    def _history_context(self):
+        """Earlier exchanges for the prompt: the stored conversation's summary and latest turns"""
+        if self.conversation is not None:
+            return self.conversation.context()
+
+        # Add only the last 2 relevant conversation items
+        context = ""
+        if self.conversation_history:
+            context += "\nRecent Conversation Context:\n"
+            for q, a in self.conversation_history[-2:]:
+                context += f"\nQ: {q}\nA: {a}\n"
+        return context
+
+    def _remember(self, query, answer):
+        self.last_stored = True
+        if self.conversation is not None:
+            self.conversation.append(query, answer, self.last_path)
+            return
+        self.conversation_history.append((query, answer))
+        if len(self.conversation_history) > 10:
+            self.conversation_history.pop(0)
+
+    @staticmethod
+    def _request(context: str, query: str, history: str = "") -> dict:
+        # Follow-up questions about the same EIN share the cached system prompt and data prefix
+        return build_request(SYSTEM_MESSAGE, f"Based on the following tax records:\n\n{context}", query, history)
+
+    def prepare(self, df: pd.DataFrame, df_x: pd.DataFrame, query: str, ein_selected: str) -> PreparedQuestion:
+        """Answer a question from the data or the response cache, or build the model request for it.
+
+        The interactive and batch paths both start here, so they share the router, the
+        response cache and the prompt. A LLM_PATH question carries the request to send;
+        pass the model's response to ``answer_from`` to clean and cache it.
+        """
+        # Field lookups and simple aggregates are answered from the data, without a model call
+        answer = self.router.route(query, df, df_x, ein_selected)
+        if answer is not None:
+            return PreparedQuestion(query, FAST_PATH, answer=answer)
+
+        context = self.build_context(df, df_x, query, ein_selected)
+        history = self._history_context()
+
+        # The same question about the same data after the same conversation is answered from the response cache
+        cache_key = self.response_cache.make_key(MODEL, SYSTEM_MESSAGE, query, context, history)
+        data_version = file_fingerprint(self.db_path)
+        prompt_chars = len(context) + len(history)
+        answer = self.response_cache.get(cache_key, CACHE_SOURCE, data_version)
+        if answer is not None:
+            return PreparedQuestion(query, CACHE_PATH, answer=answer, cache_key=cache_key, data_version=data_version,
+                                    prompt_chars=prompt_chars)
+        return PreparedQuestion(query, LLM_PATH, request=self._request(context, query, history),
+                                cache_key=cache_key, data_version=data_version, prompt_chars=prompt_chars)
+
+    def answer_from(self, prepared: PreparedQuestion, message) -> str:
+        """Cleaned answer of a model response to ``prepared.request``, stored in the response cache; None if empty"""
+        if not message.content:
+            return None
+        return self._store_answer(prepared, clean_text(message.content[0].text, ANSWER_CLEANUPS))
+
+    def _store_answer(self, prepared, answer):
+        if not answer:
+            return None
+        self.response_cache.put(prepared.cache_key, CACHE_SOURCE, prepared.data_version, answer)
+        return answer
+
+    def analyze_stream(self, df: pd.DataFrame, df_x: pd.DataFrame, query: str, ein_selected: str):
+        """Yield the analysis as cleaned text deltas while the model is still generating it"""
+        self.last_stored = False
+        span = self.instrumentation.start("tax_analyzer.analyze", ein=ein_selected, query_chars=len(query))
         try:
-            keywords = ["peer", "compare"]
-            needs_comparison = any(keyword in query.lower() for keyword in keywords)
-
-            # Start with minimal context
-            context = "Analysis Context:\n\n"
-            context += f"Dataset Overview:\n"
-            context += f"Total Organizations: {df_x['business_name'].nunique()}\n"
-            context += f"Date Range: {df_x['tax_period_begin'].min()} to {df_x['tax_period_end'].max()}\n\n"
-
-            if needs_comparison:
-                # Get most recent year's data for comparison
-                latest_year = df_x['tax_period_end'].max()
-                recent_data = df_x[df_x['tax_period_end'] == latest_year]
-
-                # Calculate and include only relevant summary stats
-                relevant_columns = [
-                    'total_revenue', 'total_expenses', 'program_service_expenses',
-                    'admin_expenses', 'fundraising_expenses'
-                ]
-                stats = self.get_summary_stats(recent_data, relevant_columns)
-
-                context += "Industry Statistics (Most Recent Year):\n"
-                for metric, values in stats.items():
-                    context += f"\n{metric}:\n"
-                    for stat_name, value in values.items():
-                        if pd.notnull(value):
-                            formatted_value = f"${value:,.2f}" if any(term in metric.lower() for term in
-                                                                      ['revenue', 'expenses', 'assets',
-                                                                       'liabilities']) else f"{value:,.2f}"
-                            context += f"- {stat_name}: {formatted_value}\n"
-
-                # Add selected organization's metrics if available
-                if ein_selected != "General Context":
-                    selected_data = df[df['tax_period_end'] == latest_year]
-                    if not selected_data.empty:
-                        context += "\nSelected Organization Metrics:\n"
-                        for col in relevant_columns:
-                            if col in selected_data.columns:
-                                value = selected_data[col].iloc[0]
-                                if pd.notnull(value):
-                                    formatted_value = f"${value:,.2f}" if any(term in col.lower() for term in
-                                                                              ['revenue', 'expenses', 'assets',
-                                                                               'liabilities']) else f"{value:,.2f}"
-                                    context += f"- {col}: {formatted_value}\n"
+            prepared = self.prepare(df, df_x, query, ein_selected)
+            self.last_path = prepared.path
+            span.set(path=prepared.path)
+            if prepared.prompt_chars is not None:
+                span.set(prompt_chars=prepared.prompt_chars)
+
+            answer = prepared.answer
+            if answer is None:
+                parts = []
+                for delta in clean_stream(self.engine.stream_text(**prepared.request), ANSWER_CLEANUPS):
+                    parts.append(delta)
+                    yield delta
+
+                answer = self._store_answer(prepared, "".join(parts))
+                if answer is None:
+                    answer = "Unable to generate analysis"
+                    yield answer
             else:
-                # For non-comparison queries, only include relevant data for the selected EIN
-                if ein_selected != "General Context":
-                    selected_df = df[df['ein'] == ein_selected].copy()
-                    if not selected_df.empty:
-                        # Get most recent record
-                        latest_record = selected_df.loc[selected_df['tax_period_end'].idxmax()]
-                        context += f"\nMost Recent Data for {latest_record['business_name']}:\n"
-
-                        # Include only the most relevant fields
-                        relevant_fields = [
-                            'business_name', 'tax_period_end', 'total_revenue',
-                            'total_expenses', 'program_service_expenses', 'admin_expenses',
-                            'fundraising_expenses', 'total_assets', 'total_liabilities',
-                            'net_assets', 'employee_count', 'volunteer_count'
-                        ]
-
-                        for field in relevant_fields:
-                            if field in latest_record.index and pd.notnull(latest_record[field]):
-                                value = latest_record[field]
-                                if isinstance(value, (int, float)):
-                                    formatted_value = f"${value:,.2f}" if any(term in field.lower() for term in
-                                                                              ['revenue', 'expenses', 'assets',
-                                                                               'liabilities']) else f"{value:,}"
-                                else:
-                                    formatted_value = value
-                                context += f"- {field}: {formatted_value}\n"
-
-            # Add only the last 2 relevant conversation items
-            if self.conversation_history:
-                context += "\nRecent Conversation Context:\n"
-                for q, a in self.conversation_history[-2:]:
-                    context += f"\nQ: {q}\nA: {a}\n"
-
-            # System message focused on efficiency analysis
-            system_message = """You are analyzing nonprofit tax records with a focus on program efficiency. For each analysis:
-                1. Calculate and compare program efficiency ratios:
-                   - Program spending ratio (program expenses / total expenses)
-                   - Administrative expense ratio
-                   - Fundraising efficiency
-                2. Compare against peer organizations when relevant
-                3. Provide specific data-backed insights
-                4. Suggest potential areas for improvement
-                5. Keep responses concise and focused on key metrics"""
+                yield answer
 
-            response = self.client.messages.create(
-                model="claude-3-sonnet-20240229",
-                system=system_message,
-                messages=[{
-                    "role": "user",
-                    "content": f"Based on the following tax records:\n\n{context}\n\nQuestion: {query}"
-                }],
-                max_tokens=1500
-            )
+            self._remember(query, answer)
 
-            answer = response.content[0].text if response.content else "Unable to generate analysis"
-            answer = answer.replace("$,", "$").replace("  ", " ").replace(" .", ".")
+        except Exception as e:
+            span.fail(e)
+            yield f"Error analyzing records: {str(e)}"
+        finally:
+            span.finish()
 
-            self.conversation_history.append((query, answer))
-            if len(self.conversation_history) > 10:
-                self.conversation_history.pop(0)
+    def analyze_many(self, df_x: pd.DataFrame, query: str, eins) -> dict:
+        """Ask the same question about several EINs concurrently; returns {ein: answer}"""
+        with self.instrumentation.span("tax_analyzer.analyze_many", rows=len(eins)):
+            prepared = {ein: self.prepare(fetch_filings(ein=ein, complete_only=True, db_path=self.db_path), df_x, query, ein)
+                        for ein in eins}
+            return {ein: answer for ein, (answer, _) in self.answer_all(prepared).items()}
 
-            return answer
+    def answer_all(self, prepared: dict) -> dict:
+        """Answer {key: PreparedQuestion} with concurrent model calls; returns {key: (answer, status)}.
 
-        except Exception as e:
-            return f"Error analyzing records: {str(e)}"
\ No newline at end of file
+        Status is 'ok', 'empty' or 'error'. Questions already answered by the router or
+        the cache are returned as they are; only LLM_PATH ones reach the model.
+        """
+        results = {key: (question.answer, "ok") for key, question in prepared.items() if question.answer is not None}
+        pending = [(key, question) for key, question in prepared.items() if question.answer is None]
+        responses = self.engine.run_many([question.request for _, question in pending]) if pending else []
+        for (key, question), response in zip(pending, responses):
+            if isinstance(response, Exception):
+                results[key] = (f"Error analyzing records: {str(response)}", "error")
+                continue
+            answer = self.answer_from(question, response)
+            results[key] = (answer, "ok") if answer is not None else ("Unable to generate analysis", "empty")
+        return {key: results[key] for key in prepared}
\ No newline at end of file
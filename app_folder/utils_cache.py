@@ -0,0 +1,167 @@
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+DEFAULT_TTL_SECONDS = 300
+DEFAULT_MAX_ENTRIES = 32
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+
+class _CacheEntry:
+    def __init__(self, signature, value, size):
+        self.signature = signature
+        self.value = value
+        self.size = size
+        self.loaded_at = time.monotonic()
+
+
+class DataCache:
+    """Process-wide cache of DataFrames loaded from SQLite files.
+
+    Entries are keyed on the database path plus a caller supplied key (usually the
+    SQL text and parameters) and are only served while the file's identity, mtime
+    and PRAGMA data_version are unchanged. Entries also expire after ``ttl`` seconds
+    and the least recently used ones are evicted once ``max_entries`` or
+    ``max_bytes`` is exceeded. Callers receive shallow copies: filtering, selecting
+    and adding, replacing or dropping columns leave the shared frame alone, but
+    writing values in place (``.loc``/``.iloc`` assignment) reaches it unless
+    pandas copy-on-write is on, so callers that do must ``.copy()`` first.
+    """
+
+    def __init__(self, ttl=DEFAULT_TTL_SECONDS, max_entries=DEFAULT_MAX_ENTRIES, max_bytes=DEFAULT_MAX_BYTES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self._key_locks = {}
+        self._watchers = {}
+        self.hits = 0
+        self.misses = 0
+
+    def db_signature(self, db_path):
+        """Return a tuple that changes whenever the database file changes, or None if it is missing"""
+        db_path = os.path.abspath(db_path)
+        try:
+            stat = os.stat(db_path)
+        except FileNotFoundError:
+            return None
+
+        signature = (stat.st_dev, stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        try:
+            wal = os.stat(db_path + "-wal")
+            signature += (wal.st_mtime_ns, wal.st_size)
+        except FileNotFoundError:
+            pass
+        return signature + (self._data_version(db_path, stat.st_ino),)
+
+    def _data_version(self, db_path, inode):
+        # data_version only moves on a long-lived connection when *other* connections
+        # commit, which catches WAL writes that have not touched the main file yet.
+        with self._lock:
+            watcher = self._watchers.get((db_path, inode))
+            if watcher is None:
+                # The file was replaced: connections to its old inode would only keep the old file open
+                for key in [key for key in self._watchers if key[0] == db_path]:
+                    self._watchers.pop(key).close()
+                watcher = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True, check_same_thread=False)
+                self._watchers[(db_path, inode)] = watcher
+            return watcher.execute("PRAGMA data_version").fetchone()[0]
+
+    def get(self, db_path, key, loader):
+        """Return the cached value for ``key`` or call ``loader()`` and cache its result"""
+        db_path = os.path.abspath(db_path)
+        cache_key = (db_path, key)
+
+        with self._lock:
+            key_lock = self._key_locks.setdefault(cache_key, threading.Lock())
+
+        # One loader per key at a time; concurrent sessions wait for the same result
+        with key_lock:
+            signature = self.db_signature(db_path)
+            with self._lock:
+                entry = self._entries.get(cache_key)
+                if entry is not None and entry.signature == signature \
+                        and time.monotonic() - entry.loaded_at < self.ttl:
+                    self._entries.move_to_end(cache_key)
+                    self.hits += 1
+                    return _shallow_copy(entry.value)
+                self.misses += 1
+
+            value = loader()
+            entry = _CacheEntry(signature, value, _size_of(value))
+            with self._lock:
+                self._discard(cache_key)
+                self._entries[cache_key] = entry
+                self._total_bytes += entry.size
+                self._evict()
+            return _shallow_copy(value)
+
+    def invalidate(self, db_path=None):
+        """Drop every entry, or only the ones loaded from ``db_path``"""
+        with self._lock:
+            if db_path is None:
+                keys = list(self._entries)
+            else:
+                db_path = os.path.abspath(db_path)
+                keys = [key for key in self._entries if key[0] == db_path]
+            for key in keys:
+                self._discard(key)
+            self._prune_key_locks()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._total_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+            }
+
+    def _discard(self, cache_key):
+        entry = self._entries.pop(cache_key, None)
+        if entry is not None:
+            self._total_bytes -= entry.size
+
+    def _evict(self):
+        now = time.monotonic()
+        for key in [k for k, e in self._entries.items() if now - e.loaded_at >= self.ttl]:
+            self._discard(key)
+        # Always keep the newest entry, even if it alone exceeds max_bytes
+        while len(self._entries) > 1 and (len(self._entries) > self.max_entries
+                                          or self._total_bytes > self.max_bytes):
+            self._discard(next(iter(self._entries)))
+        self._prune_key_locks()
+
+    def _prune_key_locks(self):
+        # A key's lock goes with its entry, unless a loader is still holding it
+        for key in [k for k, lock in self._key_locks.items() if k not in self._entries and not lock.locked()]:
+            del self._key_locks[key]
+
+
+def _size_of(value):
+    if hasattr(value, 'memory_usage'):
+        return int(value.memory_usage(deep=True).sum())
+    return 0
+
+
+def _shallow_copy(value):
+    if hasattr(value, 'copy'):
+        return value.copy(deep=False)
+    return value
+
+
+_data_cache = None
+_data_cache_lock = threading.Lock()
+
+
+def get_data_cache():
+    """Return the cache shared by every session and page in this process"""
+    global _data_cache
+    with _data_cache_lock:
+        if _data_cache is None:
+            _data_cache = DataCache()
+        return _data_cache
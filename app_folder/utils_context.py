@@ -0,0 +1,105 @@
+import re
+import pandas as pd
+
+DEFAULT_TOKEN_BUDGET = 6000
+
+# Rough size of a token in characters for English text and CSV numbers
+CHARS_PER_TOKEN = 4
+
+KEY_COLUMNS = ('ein', 'business_name', 'tax_period_end')
+PERIOD_COLUMN = 'tax_period_end'
+
+
+def estimate_tokens(text):
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def _words(text):
+    """Lower-case word stems of a query or a snake_case/CamelCase column name"""
+    text = re.sub(r"([a-z])([A-Z])", r"\1 \2", text)
+    return {word.rstrip('s') for word in re.findall(r"[a-z]+", text.lower()) if len(word) > 2}
+
+
+class ContextBuilder:
+    """Turns a DataFrame into a compact prompt block that fits a token budget.
+
+    Empty and all-zero columns are dropped, columns are narrowed to the ones the
+    query mentions (identifying columns are always kept) and rows are written as
+    CSV, newest first. When the rows do not fit, per-year totals are emitted
+    together with as many of the most recent rows as the remaining budget allows.
+    """
+
+    def __init__(self, token_budget=DEFAULT_TOKEN_BUDGET, key_columns=KEY_COLUMNS, period_column=PERIOD_COLUMN):
+        self.token_budget = token_budget
+        self.key_columns = list(key_columns)
+        self.period_column = period_column
+
+    def drop_empty_columns(self, df):
+        keep = []
+        for col in df.columns:
+            values = df[col]
+            if col in self.key_columns:
+                keep.append(col)
+            elif pd.api.types.is_numeric_dtype(values):
+                if values.fillna(0).ne(0).any():
+                    keep.append(col)
+            elif (values.notna() & values.astype(str).str.strip().ne('')).any():
+                keep.append(col)
+        return df[keep]
+
+    def select_columns(self, df, query):
+        """Identifying columns plus those whose names share a word with the query"""
+        query_words = _words(query)
+        column_words = {col: _words(col) for col in df.columns if col not in self.key_columns}
+
+        # Words found in most column names ("total", "amt") say nothing about relevance
+        counts = {}
+        for words in column_words.values():
+            for word in words:
+                counts[word] = counts.get(word, 0) + 1
+        generic = {word for word, count in counts.items() if count > max(2, len(column_words) // 2)}
+
+        matched = [col for col, words in column_words.items() if words & (query_words - generic)]
+        if not matched:
+            return df
+        return df[[col for col in df.columns if col in self.key_columns or col in matched]]
+
+    def build(self, df, query=""):
+        df = self.select_columns(self.drop_empty_columns(df), query)
+        if self.period_column in df.columns:
+            df = df.sort_values(self.period_column, ascending=False)
+
+        text = df.to_csv(index=False)
+        if estimate_tokens(text) <= self.token_budget:
+            return f"{len(df)} records (CSV):\n{text}"
+
+        yearly = self.yearly_totals(df)
+        summary = f"Per-year totals across {len(df)} records (CSV):\n{yearly.to_csv(index=False)}"
+        while len(yearly) > 1 and estimate_tokens(summary) > self.token_budget:
+            yearly = yearly.head(len(yearly) // 2)
+            summary = f"Per-year totals, most recent {len(yearly)} years (CSV):\n{yearly.to_csv(index=False)}"
+        budget = self.token_budget - estimate_tokens(summary)
+
+        # Largest number of most recent rows that still fits, found by bisection
+        low, high = 0, len(df)
+        while low < high:
+            mid = (low + high + 1) // 2
+            if estimate_tokens(df.head(mid).to_csv(index=False)) <= budget:
+                low = mid
+            else:
+                high = mid - 1
+        if low == 0:
+            return summary
+        return f"{summary}\nMost recent {low} of {len(df)} records (CSV):\n{df.head(low).to_csv(index=False)}"
+
+    def yearly_totals(self, df):
+        if self.period_column not in df.columns:
+            return pd.DataFrame()
+        numeric = df.drop(columns=[col for col in self.key_columns if col in df.columns])
+        numeric = numeric.select_dtypes(exclude=['datetime'])
+        numeric = numeric.apply(pd.to_numeric, errors='coerce').dropna(axis=1, how='all')
+        year = df[self.period_column].astype(str).str[:4].rename('year')
+        year = year.where(year.str.isdigit())
+        totals = numeric.groupby(year).sum()
+        totals.insert(0, 'records', year.value_counts())
+        return totals.sort_index(ascending=False).reset_index()
@@ -0,0 +1,216 @@
+import os
+import re
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+
+from utils_context import estimate_tokens
+
+CONVERSATION_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "conversations.db")
+# Exchanges kept verbatim per conversation; older ones only live on in the summary
+DEFAULT_MAX_TURNS = 50
+# Latest exchanges sent to the model word for word, the rest as the rolling summary
+RECENT_TURNS = 2
+SUMMARY_TOKEN_BUDGET = 400
+# Characters of an answer kept in its summary line
+SUMMARY_ANSWER_CHARS = 240
+# Conversations untouched this long are deleted
+DEFAULT_TTL_SECONDS = 7 * 24 * 3600
+HISTORY_PAGE_SIZE = 10
+
+SESSION_KEY = "conversation_session_id"
+OMITTED = re.compile(r"- \((\d+) earlier exchanges omitted\)$")
+
+
+def summary_line(query, answer):
+    """One compressed line for an exchange: the question and the opening of the answer"""
+    answer = re.sub(r"\s+", " ", re.sub(r"[*#>`|]", "", answer)).strip()
+    if len(answer) > SUMMARY_ANSWER_CHARS:
+        answer = answer[:SUMMARY_ANSWER_CHARS].rsplit(" ", 1)[0] + " ..."
+    return f"- Q: {' '.join(query.split())} -> {answer}"
+
+
+def fit_summary(lines, budget=SUMMARY_TOKEN_BUDGET):
+    """Keep the newest summary lines that fit ``budget`` tokens, noting how many were dropped"""
+    omitted = OMITTED.match(lines[0]) if lines else None
+    if omitted:
+        lines = lines[1:]
+    kept, used = [], 0
+    for line in reversed(lines):
+        used += estimate_tokens(line)
+        if used > budget:
+            break
+        kept.append(line)
+    kept.reverse()
+    dropped = len(lines) - len(kept) + (int(omitted.group(1)) if omitted else 0)
+    if dropped:
+        kept.insert(0, f"- ({dropped} earlier exchanges omitted)")
+    return kept
+
+
+class ConversationStore:
+    """On-disk conversation memory, one conversation per (session, scope, EIN).
+
+    Streamlit builds a new analyzer on every rerun, so conversations live here
+    instead of on the analyzer. Each conversation keeps its last ``max_turns``
+    exchanges verbatim for display; for the prompt, only the latest
+    ``RECENT_TURNS`` are sent in full and every earlier exchange is folded into a
+    rolling summary (one compressed line each) capped at
+    ``SUMMARY_TOKEN_BUDGET`` tokens, so the prompt stays the same size however long
+    the session runs. Conversations idle for ``ttl`` seconds are deleted.
+    """
+
+    def __init__(self, path=CONVERSATION_PATH, max_turns=DEFAULT_MAX_TURNS, ttl=DEFAULT_TTL_SECONDS):
+        self.path = path
+        self.max_turns = max_turns
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS conversation_turns (
+                    session_id TEXT, scope TEXT, ein TEXT, seq INTEGER,
+                    query TEXT, response TEXT, path TEXT, timestamp TEXT,
+                    PRIMARY KEY (session_id, scope, ein, seq)
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS conversation_summaries (
+                    session_id TEXT, scope TEXT, ein TEXT,
+                    summary TEXT, summarized_through INTEGER, updated_at REAL,
+                    PRIMARY KEY (session_id, scope, ein)
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_conversation_summaries_updated "
+                         "ON conversation_summaries (updated_at)")
+            self._expire(conn)
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=10)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _expire(self, conn):
+        cutoff = time.time() - self.ttl
+        conn.execute("""
+            DELETE FROM conversation_turns WHERE (session_id, scope, ein) IN (
+                SELECT session_id, scope, ein FROM conversation_summaries WHERE updated_at <= ?
+            )
+        """, (cutoff,))
+        conn.execute("DELETE FROM conversation_summaries WHERE updated_at <= ?", (cutoff,))
+
+    def conversation(self, session_id, scope, ein):
+        return Conversation(self, session_id, scope, str(ein))
+
+    def append(self, key, query, response, path=None):
+        """Store one exchange, fold whatever left the recent window into the summary and trim"""
+        now = time.time()
+        with self._lock, self._connect() as conn:
+            seq = conn.execute("SELECT COALESCE(MAX(seq), 0) + 1 FROM conversation_turns "
+                               "WHERE session_id = ? AND scope = ? AND ein = ?", key).fetchone()[0]
+            conn.execute("INSERT INTO conversation_turns (session_id, scope, ein, seq, query, response, path, timestamp) "
+                         "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                         (*key, seq, query, response, path, datetime.now().strftime("%H:%M")))
+
+            row = conn.execute("SELECT summary, summarized_through FROM conversation_summaries "
+                               "WHERE session_id = ? AND scope = ? AND ein = ?", key).fetchone()
+            summary, through = row if row is not None else ("", 0)
+            folded = conn.execute("SELECT seq, query, response FROM conversation_turns "
+                                  "WHERE session_id = ? AND scope = ? AND ein = ? AND seq > ? AND seq <= ? "
+                                  "ORDER BY seq", (*key, through, seq - RECENT_TURNS)).fetchall()
+            if folded:
+                lines = summary.splitlines() + [summary_line(q, a) for _, q, a in folded]
+                summary, through = "\n".join(fit_summary(lines)), folded[-1][0]
+            conn.execute("INSERT OR REPLACE INTO conversation_summaries "
+                         "(session_id, scope, ein, summary, summarized_through, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+                         (*key, summary, through, now))
+            conn.execute("DELETE FROM conversation_turns WHERE session_id = ? AND scope = ? AND ein = ? AND seq <= ?",
+                         (*key, seq - self.max_turns))
+
+    def summary(self, key):
+        with self._connect() as conn:
+            row = conn.execute("SELECT summary FROM conversation_summaries "
+                               "WHERE session_id = ? AND scope = ? AND ein = ?", key).fetchone()
+        return row[0] if row is not None else ""
+
+    def turns(self, key, limit, offset=0):
+        """Stored exchanges newest first, as dicts with timestamp, query, response and path"""
+        with self._connect() as conn:
+            rows = conn.execute("SELECT timestamp, query, response, path FROM conversation_turns "
+                                "WHERE session_id = ? AND scope = ? AND ein = ? ORDER BY seq DESC LIMIT ? OFFSET ?",
+                                (*key, limit, offset)).fetchall()
+        return [dict(zip(('timestamp', 'query', 'response', 'path'), row)) for row in rows]
+
+    def count(self, key):
+        with self._connect() as conn:
+            return conn.execute("SELECT COUNT(*) FROM conversation_turns "
+                                "WHERE session_id = ? AND scope = ? AND ein = ?", key).fetchone()[0]
+
+    def clear(self, key):
+        with self._lock, self._connect() as conn:
+            conn.execute("DELETE FROM conversation_turns WHERE session_id = ? AND scope = ? AND ein = ?", key)
+            conn.execute("DELETE FROM conversation_summaries WHERE session_id = ? AND scope = ? AND ein = ?", key)
+
+
+class Conversation:
+    """One conversation of a ``ConversationStore``, as seen by an analyzer and a page"""
+
+    def __init__(self, store, session_id, scope, ein):
+        self.store = store
+        self.key = (session_id, scope, ein)
+
+    def append(self, query, response, path=None):
+        self.store.append(self.key, query, response, path)
+
+    def recent(self, n=RECENT_TURNS):
+        """Latest ``n`` exchanges as (query, answer) pairs, oldest first"""
+        return [(turn['query'], turn['response']) for turn in reversed(self.store.turns(self.key, n))]
+
+    def context(self):
+        """Prompt block with the rolling summary of earlier exchanges and the latest ones verbatim"""
+        context = ""
+        summary = self.store.summary(self.key)
+        if summary:
+            context += f"\nEarlier Conversation (summary):\n{summary}\n"
+        recent = self.recent()
+        if recent:
+            context += "\nRecent Conversation Context:\n"
+            for q, a in recent:
+                context += f"\nQ: {q}\nA: {a}\n"
+        return context
+
+    def page(self, page, page_size=HISTORY_PAGE_SIZE):
+        """Exchanges on history page ``page`` (0 is the newest), newest first"""
+        return self.store.turns(self.key, page_size, page * page_size)
+
+    def clear(self):
+        self.store.clear(self.key)
+
+    def __len__(self):
+        return self.store.count(self.key)
+
+
+_conversation_store = None
+_conversation_store_lock = threading.Lock()
+
+
+def get_conversation_store():
+    """Return the conversation store shared by every session in this process"""
+    global _conversation_store
+    with _conversation_store_lock:
+        if _conversation_store is None:
+            _conversation_store = ConversationStore()
+        return _conversation_store
+
+
+def session_conversation(session_state, scope, ein):
+    """The conversation of this browser session (a Streamlit ``st.session_state``) about ``ein``"""
+    if SESSION_KEY not in session_state:
+        session_state[SESSION_KEY] = uuid.uuid4().hex
+    return get_conversation_store().conversation(session_state[SESSION_KEY], scope, ein)
@@ -0,0 +1,323 @@
+import os
+import sqlite3
+import pandas as pd
+from utils_cache import get_data_cache
+from utils_instrument import get_instrumentation
+
+# The one canonical store; every page and tool reads this file, wherever it is started from.
+# TAX_DATA_DB points the whole app at another copy, e.g. a synthetic benchmark dataset
+DB_PATH = os.getenv("TAX_DATA_DB") or os.path.join(os.path.dirname(os.path.abspath(__file__)), "tax_data.db")
+FILINGS_TABLE = "tax_form_basic_data"
+REVENUE_TABLE = "tax_form_revenue_data"
+
+# Canonical Part VIII revenue columns (the names used by parsed_results.csv). The repeating
+# groups in LINE_ITEM_GROUPS are not among them; they are stored one row per line in LINE_ITEMS_TABLE
+REVENUE_TEXT_COLUMNS = ['ein', 'business_name']
+REVENUE_DATE_COLUMNS = ['tax_period_end', 'tax_period_begin']
+REVENUE_AMOUNT_COLUMNS = [
+    'membership_dues', 'fundraising_amt', 'government_grants', 'other_contributions',
+    'non_cash_contributions', 'total_contributions', 'fundraising_gross_income',
+    'fundraising_direct_expenses', 'gross_sales_of_inventory', 'cost_of_goods_sold',
+    'total_program_service_revenue', 'total_revenue', 'other_revenue_total',
+    'InvestmentIncomeGrp_1_TotalRevenueColumnAmt', 'IncmFromInvestBondProceedsGrp_1_TotalRevenueColumnAmt',
+    'RoyaltiesRevenueGrp_1_TotalRevenueColumnAmt', 'NetRentalIncomeOrLossGrp_1_TotalRevenueColumnAmt',
+    'GrossAmountSalesAssetsGrp_1_SecuritiesAmt', 'LessCostOthBasisSalesExpnssGrp_1_SecuritiesAmt',
+    'GainOrLossGrp_1_SecuritiesAmt', 'NetGainOrLossInvestmentsGrp_1_TotalRevenueColumnAmt',
+    'NetIncomeFromGamingGrp_1_TotalRevenueColumnAmt', 'NetIncmFromFundraisingEvtGrp_1_TotalRevenueColumnAmt',
+    'MiscellaneousRevenueGrp_1_TotalRevenueColumnAmt',
+]
+
+# Repeating Part VIII groups as group -> (description field, amount fields). Exports flatten them
+# into {group}_{seq}_{field} columns, as many lines as their widest filer has
+LINE_ITEM_GROUPS = {
+    'ProgramServiceRevenueGrp': ('Desc', ('TotalRevenueColumnAmt',)),
+    'OtherRevenueMiscGrp': ('Desc', ('TotalRevenueColumnAmt',)),
+    'RentalIncomeOrLossGrp': (None, ('RealAmt', 'PersonalAmt')),
+}
+LINE_ITEMS_TABLE = "revenue_line_items"
+
+# The lines the revenue table held as fixed columns until migration 7, as (group, seq, field)
+_WIDE_LINES = [(group, seq, field)
+               for group, lines in (('ProgramServiceRevenueGrp', 4), ('OtherRevenueMiscGrp', 3),
+                                    ('RentalIncomeOrLossGrp', 1))
+               for seq in range(1, lines + 1) for field in LINE_ITEM_GROUPS[group][1]]
+
+
+def _wide_description(group, seq):
+    return f"{group}_{seq}_{LINE_ITEM_GROUPS[group][0]}" if LINE_ITEM_GROUPS[group][0] else None
+
+
+_WIDE_TEXT_COLUMNS = [_wide_description(group, seq) for group, seq, _ in _WIDE_LINES if _wide_description(group, seq)]
+_WIDE_AMOUNT_COLUMNS = [f"{group}_{seq}_{field}" for group, seq, field in _WIDE_LINES]
+
+
+def _revenue_table(name, text_columns, amount_columns):
+    return f"""CREATE TABLE {name} (
+            ein TEXT NOT NULL, tax_year INTEGER NOT NULL,
+            {", ".join(f"{col} TEXT" for col in text_columns + REVENUE_DATE_COLUMNS)},
+            {", ".join(f"{col} REAL" for col in amount_columns)},
+            PRIMARY KEY (ein, tax_year)
+        )"""
+
+
+def _select_wide_lines(select, described_only=False):
+    """UNION ALL of ``select`` over every wide line; ``select`` formats group, seq, field, description and amount"""
+    statements = []
+    for group, seq, field in _WIDE_LINES:
+        description = _wide_description(group, seq)
+        if described_only and description is None:
+            continue
+        amount = f"{group}_{seq}_{field}"
+        has_description = f"TRIM(COALESCE({description}, '')) != ''" if description else "0"
+        where = has_description if described_only else f"({amount} IS NOT NULL OR {has_description})"
+        statements.append(select.format(group=group, seq=seq, field=field, description=description or "NULL",
+                                        amount=amount) + f" FROM {REVENUE_TABLE} WHERE {where}")
+    return " UNION ALL ".join(statements)
+
+def _version_triggers(table):
+    """Triggers bumping ``table``'s row in table_versions on every insert, update and delete"""
+    return [f"""CREATE TRIGGER IF NOT EXISTS {table}_version_{event.lower()} AFTER {event} ON {table}
+            BEGIN UPDATE table_versions SET version = version + 1 WHERE name = '{table}'; END"""
+            for event in ('INSERT', 'UPDATE', 'DELETE')]
+
+
+def _description_triggers():
+    """Triggers keeping the external-content revenue_descriptions index in step with every line item write"""
+    insert = "INSERT INTO revenue_descriptions (rowid, description) VALUES (new.id, new.description);"
+    delete = ("INSERT INTO revenue_descriptions (revenue_descriptions, rowid, description) "
+              "VALUES ('delete', old.id, old.description);")
+    return [f"CREATE TRIGGER {LINE_ITEMS_TABLE}_fts_{event.lower()} AFTER {event} ON {LINE_ITEMS_TABLE} BEGIN {body} END"
+            for event, body in (('INSERT', insert), ('DELETE', delete), ('UPDATE', delete + " " + insert))]
+
+
+# Each entry upgrades the schema by one PRAGMA user_version step, in one transaction
+MIGRATIONS = [
+    # 1: per-EIN history lookups and latest-period scans
+    [
+        f"CREATE INDEX IF NOT EXISTS idx_{FILINGS_TABLE}_ein_period ON {FILINGS_TABLE} (ein, tax_period_end)",
+        f"CREATE INDEX IF NOT EXISTS idx_{FILINGS_TABLE}_period ON {FILINGS_TABLE} (tax_period_end)",
+    ],
+    # 2: materialized peer statistics per tax year, revenue bucket and metric
+    [
+        """CREATE TABLE IF NOT EXISTS peer_stats (
+            year TEXT, size_bucket TEXT, metric TEXT, count INTEGER,
+            mean REAL, median REAL, std REAL, p25 REAL, p75 REAL, p90 REAL,
+            PRIMARY KEY (year, size_bucket, metric)
+        )""",
+        """CREATE TABLE IF NOT EXISTS peer_stats_state (
+            year TEXT PRIMARY KEY, filings INTEGER, max_rowid INTEGER, revenue_total REAL
+        )""",
+    ],
+    # 3: one filing per (ein, tax_period_end) so sources can be upserted, a canonical
+    #    revenue table keyed on (ein, tax_year), and per-source load state. Fails while
+    #    duplicate filings remain; utils_pipeline.dedupe_filings removes them (and says which)
+    [
+        f"""CREATE UNIQUE INDEX IF NOT EXISTS ux_{FILINGS_TABLE}_ein_period
+            ON {FILINGS_TABLE} (ein, tax_period_end) WHERE tax_period_end != ''""",
+        # The old revenue table only ever held empty placeholder rows
+        f"DROP TABLE IF EXISTS {REVENUE_TABLE}",
+        _revenue_table(REVENUE_TABLE, REVENUE_TEXT_COLUMNS[1:] + _WIDE_TEXT_COLUMNS,
+                       REVENUE_AMOUNT_COLUMNS + _WIDE_AMOUNT_COLUMNS),
+        """CREATE TABLE IF NOT EXISTS pipeline_sources (
+            source TEXT PRIMARY KEY, fingerprint TEXT, rows INTEGER, loaded_at TEXT
+        )""",
+    ],
+    # 4: e-file object ids already loaded from Form 990 XML
+    [
+        """CREATE TABLE IF NOT EXISTS ingested_filings (
+            object_id TEXT PRIMARY KEY, ein TEXT, tax_period_end TEXT, source TEXT, ingested_at TEXT
+        )""",
+    ],
+    # 5: derived metrics, recomputed after every load
+    [
+        """CREATE TABLE IF NOT EXISTS filing_metrics (
+            ein TEXT, tax_period_end TEXT,
+            program_spending_ratio REAL, admin_ratio REAL, fundraising_ratio REAL,
+            fundraising_cost_per_dollar REAL, operating_margin REAL, revenue_growth REAL,
+            expense_growth REAL, net_assets_growth REAL, liabilities_to_assets REAL, months_of_reserves REAL,
+            PRIMARY KEY (ein, tax_period_end)
+        )""",
+        """CREATE TABLE IF NOT EXISTS revenue_metrics (
+            ein TEXT, tax_year INTEGER,
+            revenue_hhi REAL, largest_source TEXT, largest_source_share REAL, government_share REAL,
+            contributions_share REAL, program_revenue_share REAL, investment_share REAL, revenue_growth REAL,
+            PRIMARY KEY (ein, tax_year)
+        )""",
+    ],
+    # 6: full-text index over the program-service and other-revenue line descriptions
+    [
+        """CREATE VIRTUAL TABLE IF NOT EXISTS revenue_descriptions USING fts5(
+            description, ein UNINDEXED, tax_year UNINDEXED, line UNINDEXED, amount UNINDEXED,
+            tokenize = 'porter unicode61'
+        )""",
+        "INSERT INTO revenue_descriptions (description, ein, tax_year, line, amount) " + _select_wide_lines(
+            "SELECT {description}, ein, tax_year, '{group}_{seq}', {amount}", described_only=True),
+    ],
+    # 7: repeating revenue groups move from fixed wide columns to one row per line item, and the
+    #    description index reads its text from there
+    [
+        f"""CREATE TABLE IF NOT EXISTS {LINE_ITEMS_TABLE} (
+            ein TEXT NOT NULL, tax_year INTEGER NOT NULL, line_group TEXT NOT NULL, seq INTEGER NOT NULL,
+            field TEXT NOT NULL, description TEXT, amount REAL,
+            PRIMARY KEY (ein, tax_year, line_group, seq, field)
+        )""",
+        f"CREATE INDEX IF NOT EXISTS idx_{LINE_ITEMS_TABLE}_group_year ON {LINE_ITEMS_TABLE} (line_group, tax_year)",
+        f"INSERT INTO {LINE_ITEMS_TABLE} (ein, tax_year, line_group, seq, field, description, amount) "
+        + _select_wide_lines("SELECT ein, tax_year, '{group}', {seq}, '{field}', {description}, {amount}"),
+        # Left behind by databases that failed this step before migrations ran in a transaction
+        f"DROP TABLE IF EXISTS {REVENUE_TABLE}_v7",
+        _revenue_table(f"{REVENUE_TABLE}_v7", REVENUE_TEXT_COLUMNS[1:], REVENUE_AMOUNT_COLUMNS),
+        f"""INSERT INTO {REVENUE_TABLE}_v7 SELECT
+            {", ".join(['ein', 'tax_year'] + REVENUE_TEXT_COLUMNS[1:] + REVENUE_DATE_COLUMNS + REVENUE_AMOUNT_COLUMNS)}
+            FROM {REVENUE_TABLE}""",
+        f"DROP TABLE {REVENUE_TABLE}",
+        f"ALTER TABLE {REVENUE_TABLE}_v7 RENAME TO {REVENUE_TABLE}",
+        "DROP TABLE revenue_descriptions",
+        f"""CREATE VIRTUAL TABLE revenue_descriptions USING fts5(
+            description, content = '{LINE_ITEMS_TABLE}', tokenize = 'porter unicode61'
+        )""",
+        "INSERT INTO revenue_descriptions (revenue_descriptions) VALUES ('rebuild')",
+    ],
+    # 8: revenue trends and forecasts per EIN and series, recomputed after every load
+    [
+        """CREATE TABLE IF NOT EXISTS revenue_trends (
+            ein TEXT, series TEXT, years INTEGER, first_year INTEGER, last_year INTEGER, last_value REAL,
+            cagr REAL, cv REAL, slope REAL, forecast_year INTEGER,
+            linear_forecast REAL, linear_low REAL, linear_high REAL,
+            holt_forecast REAL, holt_low REAL, holt_high REAL,
+            PRIMARY KEY (ein, series)
+        )""",
+    ],
+    # 9: peer_stats_state also fingerprints every aggregated metric, so amended filings rebuild their year
+    [
+        "ALTER TABLE peer_stats_state ADD COLUMN metric_totals TEXT",
+    ],
+    # 10: a version per revenue table, bumped by triggers on every write (loads and hand edits alike),
+    #     which the Parquet revenue store is keyed on
+    [
+        "CREATE TABLE IF NOT EXISTS table_versions (name TEXT PRIMARY KEY, version INTEGER NOT NULL)",
+        f"INSERT OR IGNORE INTO table_versions (name, version) VALUES ('{REVENUE_TABLE}', 0), ('{LINE_ITEMS_TABLE}', 0)",
+        *_version_triggers(REVENUE_TABLE),
+        *_version_triggers(LINE_ITEMS_TABLE),
+    ],
+    # 11: line items get an explicit id for the description index to point at. The implicit rowid of
+    #     the old table could be renumbered (VACUUM), leaving the index pointing at other lines;
+    #     triggers now also keep the index in step with every write
+    [
+        f"DROP TABLE IF EXISTS {LINE_ITEMS_TABLE}_v11",
+        f"""CREATE TABLE {LINE_ITEMS_TABLE}_v11 (
+            id INTEGER PRIMARY KEY,
+            ein TEXT NOT NULL, tax_year INTEGER NOT NULL, line_group TEXT NOT NULL, seq INTEGER NOT NULL,
+            field TEXT NOT NULL, description TEXT, amount REAL,
+            UNIQUE (ein, tax_year, line_group, seq, field)
+        )""",
+        f"INSERT INTO {LINE_ITEMS_TABLE}_v11 (ein, tax_year, line_group, seq, field, description, amount) "
+        f"SELECT ein, tax_year, line_group, seq, field, description, amount FROM {LINE_ITEMS_TABLE}",
+        "DROP TABLE revenue_descriptions",
+        f"DROP TABLE {LINE_ITEMS_TABLE}",
+        f"ALTER TABLE {LINE_ITEMS_TABLE}_v11 RENAME TO {LINE_ITEMS_TABLE}",
+        f"CREATE INDEX idx_{LINE_ITEMS_TABLE}_group_year ON {LINE_ITEMS_TABLE} (line_group, tax_year)",
+        *_version_triggers(LINE_ITEMS_TABLE),
+        f"""CREATE VIRTUAL TABLE revenue_descriptions USING fts5(
+            description, content = '{LINE_ITEMS_TABLE}', content_rowid = 'id', tokenize = 'porter unicode61'
+        )""",
+        *_description_triggers(),
+        "INSERT INTO revenue_descriptions (revenue_descriptions) VALUES ('rebuild')",
+    ],
+    # 12: the revenue table version revenue_trends was computed from, so stale or never-computed
+    #     trends are refreshed at startup (see utils_trends.ensure_trends)
+    [
+        "CREATE TABLE IF NOT EXISTS revenue_trends_state (revenue_version INTEGER)",
+    ],
+]
+
+# The migration that adds the unique (ein, tax_period_end) index, and so fails on duplicate filings
+UNIQUE_FILINGS_MIGRATION = 3
+
+_migrated = set()
+
+
+def _read_sql(db_path, query, params):
+    conn = sqlite3.connect(f"file:{os.path.abspath(db_path)}?mode=ro", uri=True)
+    try:
+        return pd.read_sql_query(query, conn, params=params)
+    finally:
+        conn.close()
+
+
+def _table_name(query):
+    words = query.split()
+    lowered = [word.lower() for word in words]
+    return words[lowered.index('from') + 1] if 'from' in lowered[:-1] else None
+
+
+def get_db_data(query=None, params=None, db_path=DB_PATH, transform=None):
+    """Retrieve data from SQLite database, served from the shared cache until the file changes.
+
+    ``transform`` (e.g. ``utils_frame.compact_frame``) is applied once per load, before caching.
+    """
+    if query is None:
+        query = """
+        SELECT *
+        FROM tax_form_basic_data
+        ORDER BY tax_period_end DESC
+        """
+    loaded = []
+
+    def load():
+        loaded.append(True)
+        df = _read_sql(db_path, query, params)
+        return transform(df) if transform is not None else df
+
+    try:
+        with get_instrumentation().span("get_db_data", table=_table_name(query)) as span:
+            key = (query, tuple(params) if params is not None else None, getattr(transform, '__name__', None))
+            df = get_data_cache().get(db_path, key, load)
+            span.set(rows=len(df), cache_hit=not loaded)
+        return df
+    except (sqlite3.Error, pd.errors.DatabaseError) as e:
+        print(f"Database error: {e}")
+        return pd.DataFrame()
+
+
+def migrate(db_path=DB_PATH):
+    """Bring the database schema up to date; safe to call on every start"""
+    db_path = os.path.abspath(db_path)
+    if db_path in _migrated:
+        return
+    if not os.path.exists(db_path):
+        print(f"Database error: {db_path} does not exist")
+        return
+
+    try:
+        conn = sqlite3.connect(db_path)
+        try:
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            for target, statements in enumerate(MIGRATIONS[version:], start=version + 1):
+                # sqlite3 commits DDL as it runs unless a transaction is open, so open one: a step
+                # that fails partway leaves nothing behind and is retried whole on the next call
+                with conn:
+                    conn.execute("BEGIN IMMEDIATE")
+                    for statement in statements:
+                        conn.execute(statement)
+                    conn.execute(f"PRAGMA user_version = {target}")
+        finally:
+            conn.close()
+        _migrated.add(db_path)
+    except sqlite3.IntegrityError as e:
+        # The message names the table and key that conflicted; nothing is deleted here
+        message = f"Database migration {target} failed and was rolled back: {e}"
+        if target == UNIQUE_FILINGS_MIGRATION:
+            # The explicit load commands remove duplicate filings and retry
+            message += (f". {db_path} holds duplicate filings for the same (ein, tax_period_end); "
+                        "run `python utils_pipeline.py` to remove them")
+        print(message)
+    except sqlite3.Error as e:
+        # A read-only deployment still works, just without the indexes
+        print(f"Database migration skipped: {e}")
+
+
+def table_columns(table=FILINGS_TABLE, db_path=DB_PATH):
+    """Column names of ``table``, in schema order"""
+    info = get_db_data(f"PRAGMA table_info({table})", db_path=db_path)
+    return info['name'].tolist() if not info.empty else []
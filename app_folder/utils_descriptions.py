@@ -0,0 +1,97 @@
+import re
+import sqlite3
+
+import pandas as pd
+from utils_db import DB_PATH, LINE_ITEMS_TABLE, REVENUE_TABLE, get_db_data, migrate
+from utils_retrieval import STOPWORDS
+
+DEFAULT_LIMIT = 200
+
+LINE_LABELS = {
+    'ProgramServiceRevenueGrp': "program service revenue",
+    'OtherRevenueMiscGrp': "other revenue",
+}
+
+# "earn revenue from parking", "income from restaurants", "revenue sources such as photo rentals"
+REVENUE_SUBJECT = re.compile(
+    r"\b(revenues?|income|earn\w*|proceeds|sales)\s+(\w+\s+){0,2}?(from|through|via|such as|like|including)\s+"
+    r"(?P<subject>[^?.!]+)")
+# Words of the question that name what is asked about, not what the revenue comes from
+SUBJECT_STOPWORDS = STOPWORDS | {
+    'activities', 'charities', 'each', 'etc', 'kind', 'kinds', 'nonprofits', 'org', 'organisations',
+    'organizations', 'orgs', 'other', 'revenue', 'revenues', 'sources', 'things', 'year', 'years',
+}
+
+
+def description_terms(query):
+    """Words naming a revenue source in ``query`` ("parking", "restaurants"), or [] if it asks about none"""
+    match = REVENUE_SUBJECT.search(query.lower())
+    if match is None:
+        return []
+    words = re.findall(r"[a-z][a-z0-9]*", match.group('subject'))
+    return list(dict.fromkeys(word for word in words if word not in SUBJECT_STOPWORDS))
+
+
+def line_label(group):
+    """'OtherRevenueMiscGrp' -> 'other revenue'"""
+    return LINE_LABELS.get(group, group)
+
+
+def refresh_descriptions(db_path=DB_PATH):
+    """Rebuild the revenue_descriptions index from the line items; returns the number of described lines.
+
+    Triggers keep the index in step with every line item write; the pipeline still
+    rebuilds it after a load. The index holds no text of its own (it reads
+    revenue_line_items), so a rebuild is one pass over the line items.
+    """
+    migrate(db_path)
+    conn = sqlite3.connect(db_path)
+    try:
+        with conn:
+            conn.execute("INSERT INTO revenue_descriptions (revenue_descriptions) VALUES ('rebuild')")
+            return conn.execute(f"SELECT COUNT(description) FROM {LINE_ITEMS_TABLE}").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def search_descriptions(terms, eins=None, year=None, limit=DEFAULT_LIMIT, db_path=DB_PATH):
+    """Revenue lines whose description matches any of ``terms``, best match first.
+
+    Returns ein, business_name, tax_year, tax_period_end, line_group, seq, description,
+    amount and score (BM25, higher is better; ties go to the larger amount). The match runs
+    in the FTS5 index over every filing, so only matching lines are read.
+    """
+    terms = [re.sub(r'"', '', term) for term in terms]
+    terms = [term for term in terms if term]
+    if not terms:
+        return pd.DataFrame()
+
+    query = f"""
+        SELECT i.ein, r.business_name, i.tax_year, r.tax_period_end, i.line_group, i.seq, i.description,
+               i.amount, -bm25(revenue_descriptions) AS score
+        FROM revenue_descriptions
+        JOIN {LINE_ITEMS_TABLE} i ON i.id = revenue_descriptions.rowid
+        JOIN {REVENUE_TABLE} r ON r.ein = i.ein AND r.tax_year = i.tax_year
+        WHERE revenue_descriptions MATCH ?
+    """
+    params = [" OR ".join(f'"{term}"' for term in terms)]
+    if eins is not None:
+        query += f" AND i.ein IN ({', '.join('?' * len(eins))})"
+        params += [str(ein) for ein in eins]
+    if year is not None:
+        query += " AND i.tax_year = ?"
+        params.append(int(year))
+    query += " ORDER BY score DESC, i.amount DESC LIMIT ?"
+    params.append(limit)
+    return get_db_data(query, params, db_path=db_path)
+
+
+if __name__ == "__main__":
+    import sys
+
+    # python utils_descriptions.py                 -> rebuild the index
+    # python utils_descriptions.py parking garage  -> search it
+    if sys.argv[1:]:
+        print(search_descriptions(sys.argv[1:]).to_string(index=False))
+    else:
+        print(f"{refresh_descriptions()} revenue lines indexed")
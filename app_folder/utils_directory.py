@@ -0,0 +1,174 @@
+import os
+import re
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+from utils_db import DB_PATH, FILINGS_TABLE, REVENUE_TABLE, get_db_data
+from utils_response_cache import file_fingerprint
+from utils_router import GENERAL_CONTEXT
+
+DIRECTORY_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "org_directory.db")
+DEFAULT_LIMIT = 20
+
+# Organizations each page can select: the Core page works on complete filings, the Revenue page on the revenue table
+SCOPES = {
+    'complete_filings': f"SELECT ein, business_name, tax_period_end FROM {FILINGS_TABLE} WHERE tax_period_begin != ''",
+    'filings': f"SELECT ein, business_name, tax_period_end FROM {FILINGS_TABLE}",
+    'revenue': f"SELECT ein, business_name, tax_period_end FROM {REVENUE_TABLE}",
+}
+
+
+def prefix_expression(text):
+    """FTS5 expression for typeahead: every typed word must start a word of the name, or the digits an EIN"""
+    if re.fullmatch(r"[\d\s-]+", text or "") and re.search(r"\d", text):
+        # "13-1624..." is an EIN prefix, not two words
+        digits = re.sub(r"\D", "", text)
+        return f'ein : "{digits}"*'
+    words = re.findall(r"\w+", (text or "").lower())
+    return " ".join(f'"{word}"*' for word in words)
+
+
+class OrganizationDirectory:
+    """Typeahead index of the organizations in the database, by EIN and business name.
+
+    One row per organization and scope, with its latest business name, is kept in
+    a separate SQLite file next to the database and rebuilt whenever the database
+    file changes. Searches run against an FTS5 table with prefix indexes, so
+    matching the first letters of a name or the first digits of an EIN takes a
+    few milliseconds however many organizations there are, and only the top
+    matches are handed to the page.
+    """
+
+    def __init__(self, path=DIRECTORY_PATH, source=DB_PATH):
+        self.path = path
+        self.source = os.path.abspath(source)
+        self._lock = threading.Lock()
+        self._version = None
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS directory (
+                    id INTEGER PRIMARY KEY, scope TEXT, ein TEXT, business_name TEXT,
+                    filings INTEGER, latest_period TEXT, UNIQUE (scope, ein)
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_directory_scope_name ON directory (scope, business_name)")
+            conn.execute("""
+                CREATE VIRTUAL TABLE IF NOT EXISTS directory_fts USING fts5(
+                    ein, business_name, content = 'directory', content_rowid = 'id',
+                    tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3 4'
+                )
+            """)
+            conn.execute("CREATE TABLE IF NOT EXISTS directory_state (source TEXT PRIMARY KEY, version TEXT)")
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def build(self):
+        """Rewrite the directory from the database"""
+        version = file_fingerprint(self.source)
+        rows = []
+        for scope, query in SCOPES.items():
+            df = get_db_data(query, db_path=self.source)
+            if df.empty:
+                continue
+            df = df.assign(ein=df['ein'].astype(str), business_name=df['business_name'].fillna('').astype(str))
+            organizations = df.sort_values('tax_period_end').groupby('ein', sort=False).agg(
+                business_name=('business_name', 'last'), filings=('ein', 'size'),
+                latest_period=('tax_period_end', 'last')).reset_index()
+            rows += [(scope, row.ein, row.business_name, int(row.filings), str(row.latest_period))
+                     for row in organizations.itertuples(index=False)]
+
+        with self._connect() as conn:
+            conn.execute("DELETE FROM directory")
+            conn.executemany("INSERT INTO directory (scope, ein, business_name, filings, latest_period) "
+                             "VALUES (?, ?, ?, ?, ?)", rows)
+            conn.execute("INSERT INTO directory_fts (directory_fts) VALUES ('rebuild')")
+            conn.execute("INSERT OR REPLACE INTO directory_state (source, version) VALUES (?, ?)",
+                         (self.source, version))
+        return version
+
+    def _refresh(self):
+        """Rebuild first if the database changed since the directory was written"""
+        version = file_fingerprint(self.source)
+        with self._lock:
+            if version == self._version:
+                return
+            with self._connect() as conn:
+                row = conn.execute("SELECT version FROM directory_state WHERE source = ?", (self.source,)).fetchone()
+            if row is None or row[0] != version:
+                version = self.build()
+            self._version = version
+
+    def search(self, text, scope='filings', limit=DEFAULT_LIMIT):
+        """Top ``limit`` organizations of ``scope`` matching ``text``, as (ein, business_name) pairs.
+
+        An empty ``text`` lists organizations alphabetically.
+        """
+        if scope not in SCOPES:
+            raise ValueError(f"scope must be one of {', '.join(SCOPES)}")
+        self._refresh()
+        expression = prefix_expression(text)
+        with self._connect() as conn:
+            if not expression:
+                return conn.execute("SELECT ein, business_name FROM directory WHERE scope = ? "
+                                    "ORDER BY business_name, ein LIMIT ?", (scope, limit)).fetchall()
+            return conn.execute("""
+                SELECT d.ein, d.business_name FROM directory_fts JOIN directory d ON d.id = directory_fts.rowid
+                WHERE directory_fts MATCH ? AND d.scope = ?
+                ORDER BY bm25(directory_fts), d.business_name, d.ein LIMIT ?
+            """, (expression, scope, limit)).fetchall()
+
+    def name(self, ein, scope='filings'):
+        self._refresh()
+        with self._connect() as conn:
+            row = conn.execute("SELECT business_name FROM directory WHERE scope = ? AND ein = ?",
+                               (scope, str(ein))).fetchone()
+        return row[0] if row is not None else None
+
+    def count(self, scope='filings'):
+        self._refresh()
+        with self._connect() as conn:
+            return conn.execute("SELECT COUNT(*) FROM directory WHERE scope = ?", (scope,)).fetchone()[0]
+
+
+_organization_directory = None
+_organization_directory_lock = threading.Lock()
+
+
+def get_organization_directory():
+    """Return the organization directory shared by every session in this process"""
+    global _organization_directory
+    with _organization_directory_lock:
+        if _organization_directory is None:
+            _organization_directory = OrganizationDirectory()
+        return _organization_directory
+
+
+def select_organization(scope, key):
+    """Sidebar typeahead: a search box and a selectbox of its top matches; returns the EIN or GENERAL_CONTEXT"""
+    # Imported here so the search API stays usable from headless runs and the benchmark without streamlit
+    import streamlit as st
+
+    directory = get_organization_directory()
+    text = st.text_input("*Search organizations*", key=f"{key}_search", placeholder="Name or EIN")
+    matches = dict(directory.search(text, scope))
+    if not text:
+        st.caption(f"{directory.count(scope):,} organizations; type a name or EIN to search")
+    elif not matches:
+        st.caption("No organization matches")
+
+    # Keep the current choice selectable while the search text changes
+    selected = st.session_state.get(key, GENERAL_CONTEXT)
+    names = dict(matches)
+    if selected != GENERAL_CONTEXT and selected not in names:
+        names = {selected: directory.name(selected, scope) or "", **names}
+    options = [GENERAL_CONTEXT, *names]
+    return st.selectbox('*Select EIN*', options, index=options.index(selected) if selected in options else 0,
+                        key=key, format_func=lambda ein: ein if ein == GENERAL_CONTEXT else f"{names[ein]} ({ein})")
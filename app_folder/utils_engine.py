@@ -0,0 +1,254 @@
+import asyncio
+import os
+import queue
+import random
+import threading
+import time
+
+from utils_instrument import current_trace, get_instrumentation, in_trace
+
+# Model used by every analyzer (utils_app, utils_rev_app and the root RAG app)
+MODEL = "claude-sonnet-4-6"
+
+DEFAULT_CONCURRENCY = 4
+DEFAULT_MAX_RETRIES = 5
+DEFAULT_BASE_DELAY = 1.0
+DEFAULT_MAX_DELAY = 30.0
+
+# Shortest prompt prefix the API caches for Sonnet and Opus models; a cache breakpoint on a shorter one is ignored
+MIN_CACHE_TOKENS = 1024
+# Rough characters per token, for sizing a prompt before it is sent
+CHARS_PER_TOKEN = 4
+
+# Rate limited, overloaded or transient server errors are worth retrying
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504, 529}
+
+_END = object()
+
+
+def _retry_delay(error, attempt, base_delay, max_delay):
+    """Server-suggested delay when there is one, otherwise exponential backoff with full jitter"""
+    response = getattr(error, 'response', None)
+    if response is not None:
+        try:
+            return min(max_delay, float(response.headers.get('retry-after')))
+        except (TypeError, ValueError):
+            pass
+    return random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+
+
+def _api_errors():
+    # anthropic takes over a second to import, so it is only loaded once an engine is built
+    from anthropic import APIConnectionError, APIStatusError
+
+    return APIConnectionError, APIStatusError
+
+
+def _is_retryable(error):
+    connection_error, status_error = _api_errors()
+    if isinstance(error, connection_error):
+        return True
+    return isinstance(error, status_error) and error.status_code in RETRYABLE_STATUS
+
+
+def _prompt_chars(request):
+    """Characters of system prompt and message text sent with a request"""
+    system = request.get('system') or ""
+    chars = len(system) if isinstance(system, str) else sum(len(block.get('text', "")) for block in system)
+    for message in request.get('messages', []):
+        content = message.get('content', "")
+        chars += len(content) if isinstance(content, str) else sum(len(block.get('text', "")) for block in content)
+    return chars
+
+
+def text_block(text, cache=False):
+    """Text content block; ``cache`` adds a breakpoint so the prompt up to and including it can be cached"""
+    block = {'type': 'text', 'text': text}
+    if cache:
+        block['cache_control'] = {'type': 'ephemeral'}
+    return block
+
+
+def cacheable(*texts):
+    """True if a prompt prefix made of ``texts`` is likely long enough to be cached"""
+    return sum(len(text) for text in texts) // CHARS_PER_TOKEN >= MIN_CACHE_TOKENS
+
+
+def build_request(system, data, query, history="", max_tokens=1500, model=MODEL):
+    """messages.create request shared by the analyzers, ordered from most to least stable.
+
+    The system prompt and ``data`` form one prefix, cached when it is long enough: follow-up
+    questions about the same data then only pay for ``history`` and the question.
+    """
+    content = [text_block(data, cache=cacheable(system, data))]
+    if history:
+        content.append(text_block(history))
+    content.append(text_block(f"Question: {query}"))
+    return {
+        "model": model,
+        "system": [text_block(system)],
+        "messages": [{"role": "user", "content": content}],
+        "max_tokens": max_tokens,
+    }
+
+
+def _usage(message):
+    usage = getattr(message, 'usage', None)
+    if usage is None:
+        return {}
+    # input_tokens only counts what came after the last cache hit; cached prefix tokens are reported apart
+    return {'input_tokens': usage.input_tokens, 'output_tokens': usage.output_tokens,
+            'cache_read_input_tokens': getattr(usage, 'cache_read_input_tokens', None) or 0,
+            'cache_creation_input_tokens': getattr(usage, 'cache_creation_input_tokens', None) or 0,
+            'stop_reason': getattr(message, 'stop_reason', None)}
+
+
+class AnalysisEngine:
+    """Shared AsyncAnthropic client driven by a background event loop.
+
+    All requests in the process go through one client and connection pool, at
+    most ``concurrency`` at a time, and are retried with backoff on rate limits
+    and transient errors. Synchronous callers such as the Streamlit pages use
+    ``create``/``stream_text``; ``run_many`` fans several requests out
+    concurrently and ``create_batch``/``retrieve_batch``/``batch_results`` use
+    the Message Batches API. ``base_url`` (or ANTHROPIC_BASE_URL) can point the
+    engine at a local stub server.
+    """
+
+    def __init__(self, api_key=None, base_url=None, concurrency=DEFAULT_CONCURRENCY,
+                 max_retries=DEFAULT_MAX_RETRIES, base_delay=DEFAULT_BASE_DELAY, max_delay=DEFAULT_MAX_DELAY):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        from anthropic import AsyncAnthropic
+
+        self._api_errors = _api_errors()
+        # Retries are handled here so they also respect the concurrency limit
+        self.client = AsyncAnthropic(
+            api_key=api_key or os.getenv("ANTHROPIC_API_KEY"),
+            base_url=base_url or os.getenv("ANTHROPIC_BASE_URL"),
+            max_retries=0,
+        )
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="analysis-engine", daemon=True)
+        self._thread.start()
+
+    def _submit(self, coroutine):
+        # Spans recorded on the loop thread join the caller's trace
+        return asyncio.run_coroutine_threadsafe(in_trace(current_trace(), coroutine), self._loop)
+
+    def _run(self, coroutine):
+        return self._submit(coroutine).result()
+
+    async def acreate(self, **request):
+        """messages.create with the concurrency limit and retries applied"""
+        with get_instrumentation().span("messages.create", model=request.get('model'),
+                                        prompt_chars=_prompt_chars(request)) as span:
+            for attempt in range(self.max_retries + 1):
+                try:
+                    async with self._semaphore:
+                        response = await self.client.messages.create(**request)
+                    span.set(attempts=attempt + 1, **_usage(response))
+                    return response
+                except self._api_errors as e:
+                    if attempt == self.max_retries or not _is_retryable(e):
+                        span.set(attempts=attempt + 1)
+                        raise
+                    await asyncio.sleep(_retry_delay(e, attempt, self.base_delay, self.max_delay))
+
+    def create(self, **request):
+        return self._run(self.acreate(**request))
+
+    def run_many(self, requests):
+        """Run several messages.create requests concurrently.
+
+        Returns results in request order; a request that failed after all retries
+        yields its exception instead of a response.
+        """
+        async def gather():
+            return await asyncio.gather(*(self.acreate(**request) for request in requests),
+                                        return_exceptions=True)
+        return self._run(gather())
+
+    def create_batch(self, requests):
+        """Submit a Message Batch of {custom_id, params} requests; returns the batch"""
+        return self._run(self.client.messages.batches.create(requests=requests))
+
+    def retrieve_batch(self, batch_id):
+        return self._run(self.client.messages.batches.retrieve(batch_id))
+
+    def batch_results(self, batch_id):
+        """Result entries of an ended batch, each with its custom_id"""
+        async def collect():
+            return [entry async for entry in await self.client.messages.batches.results(batch_id)]
+        return self._run(collect())
+
+    async def _produce_stream(self, request, deltas):
+        span = get_instrumentation().start("messages.stream", model=request.get('model'),
+                                           prompt_chars=_prompt_chars(request))
+        submitted = time.perf_counter()
+        try:
+            for attempt in range(self.max_retries + 1):
+                started = False
+                try:
+                    async with self._semaphore:
+                        async with self.client.messages.stream(**request) as stream:
+                            async for text in stream.text_stream:
+                                if not started:
+                                    span.set(first_token_ms=round((time.perf_counter() - submitted) * 1000, 1))
+                                started = True
+                                deltas.put(text)
+                            span.set(attempts=attempt + 1, **_usage(await stream.get_final_message()))
+                    break
+                except self._api_errors as e:
+                    # Text already shown cannot be taken back, so only retry before the first delta
+                    if started or attempt == self.max_retries or not _is_retryable(e):
+                        raise
+                    await asyncio.sleep(_retry_delay(e, attempt, self.base_delay, self.max_delay))
+        except asyncio.CancelledError:
+            span.set(cancelled=True)
+            raise
+        except Exception as e:
+            span.fail(e)
+            deltas.put(e)
+        finally:
+            span.finish()
+            deltas.put(_END)
+
+    def stream_text(self, **request):
+        """Yield text deltas of a streamed messages request as they arrive.
+
+        Closing the generator early (a Streamlit rerun or stop does) cancels the
+        upstream stream, so it stops generating tokens and frees its slot.
+        """
+        deltas = queue.Queue()
+        future = self._submit(self._produce_stream(request, deltas))
+        try:
+            while True:
+                item = deltas.get()
+                if item is _END:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            future.cancel()
+            while True:
+                try:
+                    deltas.get_nowait()
+                except queue.Empty:
+                    break
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_engine():
+    """Return the analysis engine shared by every session and page in this process"""
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = AnalysisEngine()
+        return _engine
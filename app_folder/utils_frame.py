@@ -0,0 +1,72 @@
+import numpy as np
+import pandas as pd
+
+DATE_COLUMNS = ('tax_period_begin', 'tax_period_end')
+CATEGORY_COLUMNS = ('ein', 'business_name')
+# Other text columns become categoricals when they repeat at least this much (rows per distinct value)
+CATEGORY_MIN_REPEAT = 2
+
+
+def compact_numbers(values):
+    """Smallest integer type that holds ``values`` exactly when they are whole and complete, else float64.
+
+    Amounts are never narrowed to float32: sums and means over them would come back
+    with float32 precision.
+    """
+    array = values.to_numpy()
+    if np.isfinite(array).all() and np.array_equal(array, np.floor(array)):
+        for dtype in (np.int8, np.int16, np.int32, np.int64):
+            bounds = np.iinfo(dtype)
+            if not len(array) or (array.min() >= bounds.min and array.max() <= bounds.max):
+                return values.astype(dtype)
+    return values.astype('float64')
+
+
+def compact_column(values, name):
+    if name in DATE_COLUMNS:
+        return pd.to_datetime(values, errors='coerce')
+    if name in CATEGORY_COLUMNS:
+        return values.astype(str).astype('category')
+    if isinstance(values.dtype, pd.CategoricalDtype) or pd.api.types.is_datetime64_any_dtype(values):
+        return values
+    if pd.api.types.is_bool_dtype(values):
+        return values
+    if pd.api.types.is_numeric_dtype(values):
+        return compact_numbers(values.astype('float64'))
+
+    # SQLite hands back TEXT columns as objects: numbers stored as text ('' for missing) are parsed,
+    # anything else stays text. Only the distinct values that failed to parse are inspected
+    numbers = pd.to_numeric(values, errors='coerce')
+    failed = pd.unique(values[numbers.isna() & values.notna()])
+    blanks = [value for value in failed if not str(value).strip()]
+    if len(blanks) == len(failed):
+        return compact_numbers(numbers.astype('float64'))
+
+    text = values.mask(values.isin(blanks)) if blanks else values
+    distinct = pd.unique(text.dropna())
+    if len(values) < CATEGORY_MIN_REPEAT * len(distinct):
+        return values
+    if not all(isinstance(value, str) for value in distinct):
+        # Some flags mix 'true'/'false' with 0/1; categories must all be one type
+        text = text.map(str, na_action='ignore')
+    return text.astype('category')
+
+
+def compact_frame(df):
+    """Typed copy of a freshly loaded frame: parsed dates, categorical EINs and names, downcast numbers.
+
+    Built once per load by the caching loaders (``fetch_filings``, ``RevenueStore.load``),
+    which then only hand out shallow copies of it; sessions filter and select from
+    that one frame instead of copying or re-coercing it. Columns that need no
+    conversion are copied as well, so the result shares no arrays with ``df``.
+    """
+    return pd.DataFrame({col: compact_column(df[col], col) for col in df.columns}, index=df.index, copy=True)
+
+
+def format_date(value):
+    """``YYYY-MM-DD`` for a parsed date, '' for a missing one and ``str(value)`` for anything else"""
+    if value is None or (not isinstance(value, str) and pd.isnull(value)):
+        return ""
+    if hasattr(value, 'strftime'):
+        return value.strftime('%Y-%m-%d')
+    return str(value)
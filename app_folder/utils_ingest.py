@@ -0,0 +1,269 @@
+import os
+import re
+import sqlite3
+import zipfile
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from xml.etree.ElementTree import ParseError, iterparse
+
+import pandas as pd
+from utils_db import DB_PATH, FILINGS_TABLE, migrate
+from utils_metrics import refresh_metrics
+from utils_peer_stats import refresh_peer_stats
+from utils_pipeline import dedupe_filings, upsert
+
+# Errors that fail one return, not the ingest: malformed XML, a truncated or corrupt zip member,
+# a file that cannot be read, text in the wrong encoding
+RETURN_ERRORS = (ParseError, zipfile.BadZipFile, zlib.error, EOFError, OSError, UnicodeDecodeError)
+
+BATCH_SIZE = 5000
+# Returns handed to a worker at a time; a zip archive is opened once per chunk, not once per return
+CHUNK_SIZE = 64
+DEFAULT_WORKERS = max(1, (os.cpu_count() or 2) - 1)
+
+# tax_form_basic_data column -> element path below <Return>, namespace stripped
+FILING_FIELDS = {
+    'ein': 'ReturnHeader/Filer/EIN',
+    'business_name': 'ReturnHeader/Filer/BusinessName/BusinessNameLine1Txt',
+    'formation_year': 'ReturnData/IRS990/FormationYr',
+    'group_return_for_affiliates': 'ReturnData/IRS990/GroupReturnForAffiliatesInd',
+    'voting_members_governing_body': 'ReturnData/IRS990/VotingMembersGoverningBodyCnt',
+    'voting_members_independent': 'ReturnData/IRS990/VotingMembersIndependentCnt',
+    'total_volunteers': 'ReturnData/IRS990/TotalVolunteersCnt',
+    'total_employees': 'ReturnData/IRS990/TotalEmployeeCnt',
+    'indiv_rcvd_greater_than_100k': 'ReturnData/IRS990/IndivRcvdGreaterThan100KCnt',
+    'contrct_rcvd_greater_than_100k': 'ReturnData/IRS990/CntrctRcvdGreaterThan100KCnt',
+    'total_comp_greater_than_150k': 'ReturnData/IRS990/TotalCompGreaterThan150KInd',
+    'executive_compensation': 'ReturnData/IRS990/TotalReportableCompFromOrgAmt',
+    'tot_reportable_comp_rltd_org': 'ReturnData/IRS990/TotReportableCompRltdOrgAmt',
+    'other_compensations': 'ReturnData/IRS990/TotalOtherCompensationAmt',
+    'compensation_from_other_srcs': 'ReturnData/IRS990/CompensationFromOtherSrcsInd',
+    'total_contributions': 'ReturnData/IRS990/TotalContributionsAmt',
+    'program_service_revenue': 'ReturnData/IRS990/TotalProgramServiceRevenueAmt',
+    'other_revenue': 'ReturnData/IRS990/OtherRevenueTotalAmt',
+    'total_revenue': 'ReturnData/IRS990/CYTotalRevenueAmt',
+    'related_or_exempt_func_income': 'ReturnData/IRS990/TotalRevenueGrp/RelatedOrExemptFuncIncomeAmt',
+    'unrelated_business_revenue': 'ReturnData/IRS990/TotalRevenueGrp/UnrelatedBusinessRevenueAmt',
+    'exclusion_amount': 'ReturnData/IRS990/TotalRevenueGrp/ExclusionAmt',
+    'investment_income': 'ReturnData/IRS990/InvestmentIncomeGrp/TotalRevenueColumnAmt',
+    'bond_proceeds': 'ReturnData/IRS990/IncmFromInvestBondProceedsGrp/TotalRevenueColumnAmt',
+    'royalties': 'ReturnData/IRS990/RoyaltiesRevenueGrp/TotalRevenueColumnAmt',
+    'rental_property_income': 'ReturnData/IRS990/NetRentalIncomeOrLossGrp/TotalRevenueColumnAmt',
+    'net_fundraising': 'ReturnData/IRS990/NetIncmFromFundraisingEvtGrp/TotalRevenueColumnAmt',
+    'sales_of_assets': 'ReturnData/IRS990/NetGainOrLossInvestmentsGrp/TotalRevenueColumnAmt',
+    'net_inventory_sales': 'ReturnData/IRS990/NetIncomeOrLossGrp/TotalRevenueColumnAmt',
+    'other_salaries_and_wages': 'ReturnData/IRS990/OtherSalariesAndWagesGrp/TotalAmt',
+    'professional_fundraising_fees': 'ReturnData/IRS990/FeesForServicesProfFundraising/TotalAmt',
+    'fundraising_expenses': 'ReturnData/IRS990/TotalFunctionalExpensesGrp/FundraisingAmt',
+    'program_services_expenses': 'ReturnData/IRS990/TotalFunctionalExpensesGrp/ProgramServicesAmt',
+    'management_and_general_expenses': 'ReturnData/IRS990/TotalFunctionalExpensesGrp/ManagementAndGeneralAmt',
+    'total_expenses': 'ReturnData/IRS990/TotalFunctionalExpensesGrp/TotalAmt',
+    'net_assets_boy': 'ReturnData/IRS990/NetAssetsOrFundBalancesBOYAmt',
+    'net_assets_eoy': 'ReturnData/IRS990/NetAssetsOrFundBalancesEOYAmt',
+    'total_assets_boy': 'ReturnData/IRS990/TotalAssetsBOYAmt',
+    'total_assets_eoy': 'ReturnData/IRS990/TotalAssetsEOYAmt',
+    'total_liabilities_boy': 'ReturnData/IRS990/TotalLiabilitiesBOYAmt',
+    'total_liabilities_eoy': 'ReturnData/IRS990/TotalLiabilitiesEOYAmt',
+    'total_gross_ubi': 'ReturnData/IRS990/TotalGrossUBIAmt',
+    'website': 'ReturnData/IRS990/WebsiteAddressTxt',
+    'tax_period_begin': 'ReturnHeader/TaxPeriodBeginDt',
+    'tax_period_end': 'ReturnHeader/TaxPeriodEndDt',
+}
+PATH_TO_COLUMN = {path: col for col, path in FILING_FIELDS.items()}
+FILING_COLUMNS = list(FILING_FIELDS) + ['operating_margin', 'program_efficiency']
+
+
+def object_id(name):
+    """E-file object id from a file name such as '201943199349301234_public.xml'"""
+    return re.sub(r"_public$", "", os.path.splitext(os.path.basename(name))[0])
+
+
+def _convert(path, text):
+    text = text.strip()
+    if path.endswith(("Amt", "Cnt", "Yr")):
+        try:
+            value = float(text)
+        except ValueError:
+            return None
+        return int(value) if path.endswith(("Cnt", "Yr")) else value
+    if path.endswith("Ind"):
+        return "true" if text.lower() in ("x", "1", "true") else "false"
+    return text
+
+
+def _ratio(numerator, denominator):
+    if numerator is None or not denominator:
+        return None
+    return numerator / denominator
+
+
+def parse_chunk(chunk):
+    """Parse 990 XML returns into tax_form_basic_data rows.
+
+    ``chunk`` is (zip path, members) or (None, file paths); the archive is opened
+    once for the whole chunk. Elements are cleared as soon as they are read, so
+    memory stays flat however large a return is. Returns [(object_id, row, error)]:
+    row is None for returns that are not a Form 990, and error describes a return
+    that could not be read (malformed XML, a corrupt zip member or file, see
+    RETURN_ERRORS), which is reported but not recorded, so the return is tried
+    again on the next run. One bad return never fails the rest of the chunk.
+    """
+    archive, names = chunk
+    results = []
+    try:
+        zf = zipfile.ZipFile(archive) if archive is not None else None
+    except (zipfile.BadZipFile, OSError) as e:
+        return [(object_id(name), None, f"{type(e).__name__}: {e}") for name in names]
+    try:
+        for name in names:
+            try:
+                if zf is not None:
+                    with zf.open(name) as f:
+                        results.append((object_id(name), _parse(f), None))
+                else:
+                    with open(name, "rb") as f:
+                        results.append((object_id(name), _parse(f), None))
+            except ParseError as e:
+                results.append((object_id(name), None, str(e)))
+            except RETURN_ERRORS as e:
+                results.append((object_id(name), None, f"{type(e).__name__}: {e}"))
+    finally:
+        if zf is not None:
+            zf.close()
+    return results
+
+
+def chunk_sources(sources, size=CHUNK_SIZE):
+    """Group discover() sources into parse_chunk arguments of at most ``size`` returns per archive"""
+    chunks, open_chunks = [], {}
+    for source in sources:
+        archive, name = source if isinstance(source, tuple) else (None, source)
+        names = open_chunks.get(archive)
+        if names is None or len(names) >= size:
+            names = open_chunks[archive] = []
+            chunks.append((archive, names))
+        names.append(name)
+    return chunks
+
+
+def _parse(f):
+    row, stack = {}, []
+    for event, elem in iterparse(f, events=("start", "end")):
+        tag = elem.tag.rsplit("}", 1)[-1]
+        if event == "start":
+            stack.append(tag)
+            continue
+        path = "/".join(stack[1:])
+        column = PATH_TO_COLUMN.get(path)
+        if column is not None and column not in row and elem.text:
+            row[column] = _convert(path, elem.text)
+        stack.pop()
+        elem.clear()
+    if 'ein' not in row or 'tax_period_end' not in row or 'total_revenue' not in row:
+        return None
+
+    row = {col: row.get(col) for col in FILING_FIELDS}
+    if row['total_revenue'] is not None and row['total_expenses'] is not None:
+        row['operating_margin'] = _ratio(row['total_revenue'] - row['total_expenses'], row['total_revenue'])
+    else:
+        row['operating_margin'] = None
+    row['program_efficiency'] = _ratio(row['program_services_expenses'], row['total_expenses'])
+    return row
+
+
+def discover(paths):
+    """Yield (source label, file path or (zip path, member)) for every XML file in the given directories, files and zips"""
+    for path in paths:
+        if zipfile.is_zipfile(path):
+            with zipfile.ZipFile(path) as zf:
+                for member in zf.namelist():
+                    if member.lower().endswith(".xml"):
+                        yield os.path.basename(path), (path, member)
+        elif os.path.isdir(path):
+            for root, _, files in os.walk(path):
+                for name in sorted(files):
+                    if name.lower().endswith(".xml"):
+                        yield path, os.path.join(root, name)
+        elif path.lower().endswith(".xml"):
+            yield os.path.dirname(path), path
+
+
+def _flush(conn, rows, ingested):
+    with conn:
+        if rows:
+            upsert(conn, FILINGS_TABLE, pd.DataFrame(rows, columns=FILING_COLUMNS),
+                   ['ein', 'tax_period_end'], "WHERE tax_period_end != ''")
+        conn.executemany("INSERT OR REPLACE INTO ingested_filings (object_id, ein, tax_period_end, source, ingested_at) "
+                         "VALUES (?, ?, ?, ?, ?)", ingested)
+
+
+def ingest(paths, db_path=DB_PATH, workers=DEFAULT_WORKERS, batch_size=BATCH_SIZE):
+    """Load Form 990 XML returns from directories or zip archives into tax_form_basic_data.
+
+    Returns whose object id is already in ingested_filings are skipped without
+    being opened, so re-running over a folder that gained a new year of filings
+    only parses the new ones. Parsing runs in a process pool, CHUNK_SIZE returns of
+    one archive per task, and rows are written with executemany, ``batch_size``
+    returns per transaction; derived metrics are recomputed once at the end.
+    Returns that are not a Form 990 are recorded as rejected; malformed XML and
+    unreadable returns are only counted as failed and retried on the next run. Returns
+    {'parsed': n, 'skipped': n, 'rejected': n, 'failed': n}.
+    """
+    dedupe_filings(db_path)
+    migrate(db_path)
+    conn = sqlite3.connect(db_path)
+    counts = {'parsed': 0, 'skipped': 0, 'rejected': 0, 'failed': 0}
+    try:
+        done = {row[0] for row in conn.execute("SELECT object_id FROM ingested_filings")}
+        pending, labels = [], {}
+        for label, source in discover(paths):
+            oid = object_id(source[1] if isinstance(source, tuple) else source)
+            if oid in done or oid in labels:
+                counts['skipped'] += 1
+                continue
+            labels[oid] = label
+            pending.append(source)
+
+        rows, ingested = [], []
+        now = datetime.now().isoformat(timespec="seconds")
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for results in pool.map(parse_chunk, chunk_sources(pending)):
+                for oid, row, error in results:
+                    if error is not None:
+                        counts['failed'] += 1
+                        print(f"Could not parse {oid} from {labels[oid]}: {error}")
+                        continue
+                    if row is None:
+                        counts['rejected'] += 1
+                        ingested.append((oid, None, None, labels[oid], now))
+                    else:
+                        counts['parsed'] += 1
+                        rows.append(row)
+                        ingested.append((oid, row['ein'], row['tax_period_end'], labels[oid], now))
+                if len(ingested) >= batch_size:
+                    _flush(conn, rows, ingested)
+                    rows, ingested = [], []
+        _flush(conn, rows, ingested)
+    finally:
+        conn.close()
+    if counts['parsed']:
+        refresh_metrics(db_path)
+        refresh_peer_stats(db_path)
+    return counts
+
+
+if __name__ == "__main__":
+    import argparse
+
+    # python utils_ingest.py ~/irs/2023/ ~/irs/download990xml_2024_1.zip
+    parser = argparse.ArgumentParser(description="Load IRS Form 990 XML returns into tax_form_basic_data")
+    parser.add_argument("paths", nargs="+", help="directories, zip archives or XML files")
+    parser.add_argument("--db", default=DB_PATH)
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS)
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    args = parser.parse_args()
+
+    counts = ingest(args.paths, db_path=args.db, workers=args.workers, batch_size=args.batch_size)
+    print(f"{counts['parsed']} returns loaded, {counts['skipped']} already ingested, "
+          f"{counts['rejected']} not a Form 990, {counts['failed']} could not be parsed (retried next run)")
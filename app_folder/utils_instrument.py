@@ -0,0 +1,200 @@
+import contextvars
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+
+SPANS_PATH = os.getenv("ANALYZER_SPANS_DB") or os.path.join(os.path.dirname(os.path.abspath(__file__)), "spans.db")
+# Set to also append every span as a JSON line, e.g. for shipping to a log collector
+SPANS_JSONL_ENV = "ANALYZER_SPANS_JSONL"
+MAX_SPANS = 100_000
+PRUNE_EVERY = 1000
+
+SPAN_FIELDS = ('input_tokens', 'output_tokens', 'prompt_chars', 'rows', 'cache_hit', 'path', 'model',
+               'cache_read_input_tokens', 'cache_creation_input_tokens')
+
+_trace = contextvars.ContextVar("analyzer_trace", default=None)
+
+
+def current_trace():
+    return _trace.get()
+
+
+async def in_trace(trace_id, coroutine):
+    """Await ``coroutine`` with ``trace_id`` as the current trace, e.g. on the engine's event loop thread"""
+    token = _trace.set(trace_id)
+    try:
+        return await coroutine
+    finally:
+        _trace.reset(token)
+
+
+class Span:
+    """One timed operation; ``set`` attaches token counts, sizes and other attributes"""
+
+    def __init__(self, sink, name, attrs):
+        self.sink = sink
+        self.name = name
+        self.attrs = dict(attrs)
+        self.trace_id = _trace.get()
+        self._token = None
+        if self.trace_id is None:
+            self.trace_id = uuid.uuid4().hex[:16]
+            self._token = _trace.set(self.trace_id)
+        self.started_at = datetime.now().isoformat(timespec="milliseconds")
+        self._start = time.perf_counter()
+        self.outcome = "ok"
+        self.error = None
+        self._finished = False
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+        return self
+
+    def fail(self, error):
+        self.outcome = "error"
+        self.error = f"{type(error).__name__}: {error}"
+        return self
+
+    def finish(self):
+        if self._finished:
+            return
+        self._finished = True
+        duration_ms = (time.perf_counter() - self._start) * 1000
+        if self._token is not None:
+            try:
+                _trace.reset(self._token)
+            except ValueError:
+                # Finished from another context (e.g. a generator closed elsewhere)
+                pass
+        self.sink.record(self, duration_ms)
+
+
+class Instrumentation:
+    """Span recorder backed by a local SQLite file (and optionally a JSONL file).
+
+    Spans are queued and written by a background thread in batches, so timing an
+    operation adds microseconds, not a disk write. Spans opened while another span
+    of the same thread or task is active share its trace id, which ties the data
+    load, context build and model call of one question together. The table is
+    pruned to the newest ``MAX_SPANS`` rows.
+    """
+
+    def __init__(self, path=SPANS_PATH, jsonl_path=None):
+        self.path = path
+        self.jsonl_path = jsonl_path if jsonl_path is not None else os.getenv(SPANS_JSONL_ENV)
+        self._queue = queue.Queue()
+        self._written = 0
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS spans (
+                    id INTEGER PRIMARY KEY, trace_id TEXT, name TEXT, started_at TEXT,
+                    duration_ms REAL, outcome TEXT, error TEXT,
+                    input_tokens INTEGER, output_tokens INTEGER, prompt_chars INTEGER, rows INTEGER,
+                    cache_hit INTEGER, path TEXT, model TEXT, attrs TEXT,
+                    cache_read_input_tokens INTEGER, cache_creation_input_tokens INTEGER
+                )
+            """)
+            # Span files written before a field was added get its column appended
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(spans)")}
+            for field in SPAN_FIELDS:
+                if field not in columns:
+                    conn.execute(f"ALTER TABLE spans ADD COLUMN {field}")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_spans_name_started ON spans (name, started_at)")
+        threading.Thread(target=self._writer, name="span-writer", daemon=True).start()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def start(self, name, **attrs):
+        """Open a span; call ``finish()`` on it (``fail(e)`` first on errors)"""
+        return Span(self, name, attrs)
+
+    @contextmanager
+    def span(self, name, **attrs):
+        span = self.start(name, **attrs)
+        try:
+            yield span
+        except BaseException as e:
+            span.fail(e)
+            raise
+        finally:
+            span.finish()
+
+    def record(self, span, duration_ms):
+        known = {field: span.attrs.get(field) for field in SPAN_FIELDS}
+        if isinstance(known['cache_hit'], bool):
+            known['cache_hit'] = int(known['cache_hit'])
+        extra = {key: value for key, value in span.attrs.items() if key not in SPAN_FIELDS}
+        self._queue.put((span.trace_id, span.name, span.started_at, round(duration_ms, 3), span.outcome, span.error,
+                         *known.values(), json.dumps(extra, default=str) if extra else None))
+
+    def flush(self, timeout=5.0):
+        """Block until queued spans are written (for scripts and benchmarks)"""
+        deadline = time.monotonic() + timeout
+        while not self._queue.empty() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        time.sleep(0.05)
+
+    def _writer(self):
+        conn = self._connect()
+        columns = ('trace_id', 'name', 'started_at', 'duration_ms', 'outcome', 'error') + SPAN_FIELDS + ('attrs',)
+        sql = f"INSERT INTO spans ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+        while True:
+            rows = [self._queue.get()]
+            while len(rows) < 500:
+                try:
+                    rows.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                with conn:
+                    conn.executemany(sql, rows)
+                self._written += len(rows)
+                if self._written >= PRUNE_EVERY:
+                    self._written = 0
+                    with conn:
+                        conn.execute("DELETE FROM spans WHERE id <= (SELECT MAX(id) FROM spans) - ?", (MAX_SPANS,))
+                if self.jsonl_path:
+                    with open(self.jsonl_path, "a", encoding="utf-8") as f:
+                        for row in rows:
+                            f.write(json.dumps(dict(zip(columns, row)), default=str) + "\n")
+            except (sqlite3.Error, OSError) as e:
+                print(f"Span sink error: {e}")
+
+
+_instrumentation = None
+_instrumentation_lock = threading.Lock()
+
+
+def get_instrumentation():
+    """Return the span recorder shared by every session in this process"""
+    global _instrumentation
+    with _instrumentation_lock:
+        if _instrumentation is None:
+            _instrumentation = Instrumentation()
+        return _instrumentation
+
+
+def load_spans(since=None, path=SPANS_PATH):
+    """Recorded spans as a DataFrame, newest first, optionally only those started at/after ``since``"""
+    import pandas as pd
+
+    if not os.path.exists(path):
+        return pd.DataFrame()
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        query, params = "SELECT * FROM spans", []
+        if since is not None:
+            query += " WHERE started_at >= ?"
+            params.append(since)
+        return pd.read_sql_query(query + " ORDER BY id DESC", conn, params=params)
+    finally:
+        conn.close()
@@ -0,0 +1,98 @@
+import re
+
+import pandas as pd
+from utils_db import DB_PATH, LINE_ITEM_GROUPS, LINE_ITEMS_TABLE, get_db_data
+
+LINE_ITEM_FIELDS = ['ein', 'tax_year', 'line_group', 'seq', 'field', 'description', 'amount']
+# "ProgramServiceRevenueGrp_7_Desc": any line number, so no filer is cut off at a fixed width
+LINE_ITEM_COLUMN = re.compile(rf"^(?P<group>{'|'.join(LINE_ITEM_GROUPS)})_(?P<seq>\d+)_(?P<field>\w+)$")
+
+
+def is_line_item_column(column):
+    return LINE_ITEM_COLUMN.match(column) is not None
+
+
+def _column_order(column):
+    """Sort key keeping each line's columns together: group, line number, description first"""
+    match = LINE_ITEM_COLUMN.match(column)
+    description, amounts = LINE_ITEM_GROUPS[match['group']]
+    fields = [description, *amounts]
+    position = fields.index(match['field']) if match['field'] in fields else len(fields)
+    return list(LINE_ITEM_GROUPS).index(match['group']), int(match['seq']), position
+
+
+def split_line_items(df):
+    """Split a wide revenue export into (revenue rows without the repeating groups, their line items).
+
+    Every ``{group}_{seq}_{field}`` column becomes rows of LINE_ITEM_FIELDS, one per
+    line and amount field; lines with neither a description nor an amount are dropped.
+    ``df`` must carry ``ein`` and ``tax_year``.
+    """
+    matches = {col: LINE_ITEM_COLUMN.match(col) for col in df.columns}
+    matches = {col: match for col, match in matches.items() if match is not None}
+    lines = sorted({(match['group'], int(match['seq'])) for match in matches.values()},
+                   key=lambda line: (list(LINE_ITEM_GROUPS).index(line[0]), line[1]))
+
+    frames = []
+    for group, seq in lines:
+        description_field, amount_fields = LINE_ITEM_GROUPS[group]
+        description = df.get(f"{group}_{seq}_{description_field}") if description_field else None
+        if description is not None:
+            description = description.where(description.astype(str).str.strip().ne(''))
+        for field in amount_fields:
+            amount = df.get(f"{group}_{seq}_{field}")
+            frames.append(pd.DataFrame({
+                'ein': df['ein'], 'tax_year': df['tax_year'], 'line_group': group, 'seq': seq, 'field': field,
+                'description': description,
+                'amount': pd.to_numeric(amount, errors='coerce') if amount is not None else float('nan'),
+            }))
+
+    items = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=LINE_ITEM_FIELDS)
+    items = items[items['description'].notna() | items['amount'].notna()]
+    return df.drop(columns=list(matches)), items[LINE_ITEM_FIELDS]
+
+
+def pivot_line_items(items, keys=('ein', 'tax_year')):
+    """Wide ``{group}_{seq}_{field}`` columns per filing ``keys``, only as many lines as ``items`` has"""
+    keys = list(keys)
+    if items.empty:
+        return pd.DataFrame(columns=keys)
+    # Pivot on the (group, seq, field) keys and name only the resulting columns, not every row
+    amounts = items.pivot(index=keys, columns=['line_group', 'seq', 'field'], values='amount')
+    amounts.columns = [f"{group}_{seq}_{field}" for group, seq, field in amounts.columns]
+    described = items[items['description'].notna()].drop_duplicates(keys + ['line_group', 'seq'])
+    descriptions = described.pivot(index=keys, columns=['line_group', 'seq'], values='description')
+    descriptions.columns = [f"{group}_{seq}_{LINE_ITEM_GROUPS[group][0]}" for group, seq in descriptions.columns]
+
+    wide = amounts.join(descriptions, how='outer')
+    return wide[sorted(wide.columns, key=_column_order)].reset_index()
+
+
+def load_line_items(eins=None, years=None, db_path=DB_PATH):
+    """Stored line items, restricted to ``eins`` and ``years`` when given (served by the primary key)"""
+    query = f"SELECT {', '.join(LINE_ITEM_FIELDS)} FROM {LINE_ITEMS_TABLE}"
+    conditions, params = [], []
+    if eins is not None:
+        conditions.append(f"ein IN ({', '.join('?' * len(eins))})")
+        params += [str(ein) for ein in eins]
+    if years is not None:
+        conditions.append(f"tax_year IN ({', '.join('?' * len(years))})")
+        params += [int(year) for year in years]
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    return get_db_data(query + " ORDER BY ein, tax_year, line_group, seq", params or None, db_path=db_path)
+
+
+def replace_line_items(conn, revenue, items):
+    """Replace the stored lines of every (ein, tax_year) in ``revenue`` with ``items``, inside ``conn``'s transaction.
+
+    A filing's lines are rewritten as a whole, so a filing that now reports fewer
+    lines does not keep stale ones.
+    """
+    keys = revenue[['ein', 'tax_year']].drop_duplicates()
+    conn.executemany(f"DELETE FROM {LINE_ITEMS_TABLE} WHERE ein = ? AND tax_year = ?",
+                     keys.astype(object).itertuples(index=False, name=None))
+    rows = items.astype(object).where(items.notna(), None).itertuples(index=False, name=None)
+    conn.executemany(f"INSERT INTO {LINE_ITEMS_TABLE} ({', '.join(LINE_ITEM_FIELDS)}) "
+                     f"VALUES ({', '.join('?' * len(LINE_ITEM_FIELDS))})", rows)
+    return len(items)
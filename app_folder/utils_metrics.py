@@ -0,0 +1,170 @@
+import sqlite3
+
+import numpy as np
+import pandas as pd
+from utils_db import DB_PATH, FILINGS_TABLE, REVENUE_TABLE, get_db_data, migrate
+
+FILING_METRICS = [
+    'program_spending_ratio', 'admin_ratio', 'fundraising_ratio', 'fundraising_cost_per_dollar',
+    'operating_margin', 'revenue_growth', 'expense_growth', 'net_assets_growth',
+    'liabilities_to_assets', 'months_of_reserves',
+]
+
+REVENUE_METRICS = [
+    'revenue_hhi', 'largest_source', 'largest_source_share', 'government_share',
+    'contributions_share', 'program_revenue_share', 'investment_share', 'revenue_growth',
+]
+
+# Part VIII revenue sources that add up to total revenue; whatever total_revenue leaves
+# unexplained (e.g. sample_rag.csv rows only carry contributions) counts as one more source
+REVENUE_SOURCES = {
+    'membership_dues': 'membership_dues',
+    'fundraising_amt': 'fundraising_events',
+    'government_grants': 'government_grants',
+    'other_contributions': 'other_contributions',
+    'total_program_service_revenue': 'program_services',
+    'InvestmentIncomeGrp_1_TotalRevenueColumnAmt': 'investment_income',
+    'IncmFromInvestBondProceedsGrp_1_TotalRevenueColumnAmt': 'bond_proceeds',
+    'RoyaltiesRevenueGrp_1_TotalRevenueColumnAmt': 'royalties',
+    'NetRentalIncomeOrLossGrp_1_TotalRevenueColumnAmt': 'rental_income',
+    'NetGainOrLossInvestmentsGrp_1_TotalRevenueColumnAmt': 'asset_sales',
+    'NetIncmFromFundraisingEvtGrp_1_TotalRevenueColumnAmt': 'fundraising_events_net',
+    'NetIncomeFromGamingGrp_1_TotalRevenueColumnAmt': 'gaming',
+    'other_revenue_total': 'other_revenue',
+}
+UNATTRIBUTED_SOURCE = 'unattributed'
+
+METRIC_DIGITS = 4
+
+
+def _numeric(df, columns):
+    return df.reindex(columns=columns).apply(pd.to_numeric, errors='coerce')
+
+
+def _divide(numerator, denominator):
+    """Element-wise ratio with zero or missing denominators giving NaN instead of inf"""
+    return numerator / denominator.where(denominator != 0)
+
+
+def _growth(values, keys):
+    """Change against the same organization's previous period, as a fraction of the previous value"""
+    previous = values.groupby(keys).shift()
+    return _divide(values - previous, previous.abs())
+
+
+def compute_filing_metrics(df):
+    """Efficiency, growth and balance-sheet ratios for every filing in one vectorized pass"""
+    df = df.sort_values(['ein', 'tax_period_end'])
+    num = _numeric(df, [
+        'total_revenue', 'total_expenses', 'program_services_expenses', 'management_and_general_expenses',
+        'fundraising_expenses', 'total_contributions', 'net_assets_eoy', 'total_assets_eoy',
+        'total_liabilities_eoy',
+    ])
+    expenses = num['total_expenses']
+
+    metrics = df[['ein', 'tax_period_end']].copy()
+    metrics['program_spending_ratio'] = _divide(num['program_services_expenses'], expenses)
+    metrics['admin_ratio'] = _divide(num['management_and_general_expenses'], expenses)
+    metrics['fundraising_ratio'] = _divide(num['fundraising_expenses'], expenses)
+    metrics['fundraising_cost_per_dollar'] = _divide(num['fundraising_expenses'], num['total_contributions'])
+    metrics['operating_margin'] = _divide(num['total_revenue'] - expenses, num['total_revenue'])
+    metrics['revenue_growth'] = _growth(num['total_revenue'], df['ein'])
+    metrics['expense_growth'] = _growth(expenses, df['ein'])
+    metrics['net_assets_growth'] = _growth(num['net_assets_eoy'], df['ein'])
+    metrics['liabilities_to_assets'] = _divide(num['total_liabilities_eoy'], num['total_assets_eoy'])
+    metrics['months_of_reserves'] = _divide(num['net_assets_eoy'] * 12, expenses)
+    return metrics.replace([np.inf, -np.inf], np.nan)
+
+
+def compute_revenue_metrics(df):
+    """Revenue mix, concentration (HHI) and growth for every revenue row in one vectorized pass"""
+    df = df.sort_values(['ein', 'tax_year'])
+    sources = _numeric(df, list(REVENUE_SOURCES)).rename(columns=REVENUE_SOURCES).clip(lower=0)
+    total_revenue = pd.to_numeric(df['total_revenue'], errors='coerce')
+    sources[UNATTRIBUTED_SOURCE] = (total_revenue - sources.sum(axis=1)).clip(lower=0)
+
+    total = sources.sum(axis=1)
+    shares = sources.div(total.where(total > 0), axis=0)
+    has_mix = shares.notna().any(axis=1)
+
+    metrics = df[['ein', 'tax_year']].copy()
+    metrics['revenue_hhi'] = (shares ** 2).sum(axis=1, min_count=1)
+    metrics['largest_source'] = shares.fillna(0).idxmax(axis=1).where(has_mix)
+    metrics['largest_source_share'] = shares.max(axis=1)
+    metrics['government_share'] = shares['government_grants']
+    metrics['contributions_share'] = shares[['membership_dues', 'fundraising_events', 'government_grants',
+                                             'other_contributions']].sum(axis=1, min_count=1)
+    metrics['program_revenue_share'] = shares['program_services']
+    metrics['investment_share'] = shares[['investment_income', 'bond_proceeds', 'royalties',
+                                          'asset_sales']].sum(axis=1, min_count=1)
+    metrics['revenue_growth'] = _growth(total_revenue, df['ein'])
+    return metrics.replace([np.inf, -np.inf], np.nan)
+
+
+def _replace_rows(conn, table, metrics):
+    conn.execute(f"DELETE FROM {table}")
+    metrics = metrics.astype(object).where(metrics.notna(), None)
+    conn.executemany(
+        f"INSERT OR REPLACE INTO {table} ({', '.join(metrics.columns)}) "
+        f"VALUES ({', '.join('?' * len(metrics.columns))})",
+        metrics.itertuples(index=False, name=None))
+
+
+def refresh_metrics(db_path=DB_PATH):
+    """Recompute filing_metrics and revenue_metrics from the stored filings.
+
+    Called after every load (pipeline and XML ingest). Growth rates depend on the
+    neighbouring periods, so the tables are rebuilt as a whole; both are a single
+    vectorized pass and one transaction. Returns the number of rows written to each.
+    """
+    migrate(db_path)
+    conn = sqlite3.connect(db_path)
+    try:
+        filings = pd.read_sql_query(f"SELECT * FROM {FILINGS_TABLE} WHERE tax_period_end != ''", conn)
+        revenue = pd.read_sql_query(f"SELECT * FROM {REVENUE_TABLE}", conn)
+        filing_metrics = compute_filing_metrics(filings)
+        revenue_metrics = compute_revenue_metrics(revenue)
+        with conn:
+            _replace_rows(conn, 'filing_metrics', filing_metrics)
+            _replace_rows(conn, 'revenue_metrics', revenue_metrics)
+    finally:
+        conn.close()
+    return {'filing_metrics': len(filing_metrics), 'revenue_metrics': len(revenue_metrics)}
+
+
+def _load(table, period_column, eins, db_path):
+    query = f"SELECT * FROM {table}"
+    params = None
+    if eins is not None:
+        eins = [str(ein) for ein in eins]
+        if not eins:
+            return pd.DataFrame()
+        query += f" WHERE ein IN ({', '.join('?' * len(eins))})"
+        params = eins
+    return get_db_data(query + f" ORDER BY ein, {period_column} DESC", params, db_path=db_path)
+
+
+def get_filing_metrics(eins=None, db_path=DB_PATH):
+    """Stored filing metrics, newest period first per EIN"""
+    return _load('filing_metrics', 'tax_period_end', eins, db_path)
+
+
+def get_revenue_metrics(eins=None, db_path=DB_PATH):
+    """Stored revenue metrics, newest tax year first per EIN"""
+    return _load('revenue_metrics', 'tax_year', eins, db_path)
+
+
+def format_metrics(metrics, max_rows=None):
+    """Compact CSV block of stored metrics for a prompt, empty columns dropped"""
+    if metrics.empty:
+        return ""
+    metrics = metrics.dropna(axis=1, how='all')
+    if max_rows is not None:
+        metrics = metrics.head(max_rows)
+    return metrics.round(METRIC_DIGITS).to_csv(index=False)
+
+
+if __name__ == "__main__":
+    # python utils_metrics.py  -> rebuild the stored metrics from tax_data.db
+    for table, rows in refresh_metrics().items():
+        print(f"{table}: {rows} rows")
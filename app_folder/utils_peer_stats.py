@@ -0,0 +1,144 @@
+import os
+import sqlite3
+import threading
+import pandas as pd
+from utils_cache import get_data_cache
+from utils_db import DB_PATH, FILINGS_TABLE, get_db_data, migrate
+from utils_summary import SummaryEngine
+
+PEER_METRICS = [
+    'total_revenue', 'total_expenses', 'program_services_expenses',
+    'management_and_general_expenses', 'fundraising_expenses', 'total_assets_eoy',
+    'total_liabilities_eoy', 'net_assets_eoy'
+]
+
+PEER_STATS = ('count', 'mean', 'median', 'std', 'p25', 'p75', 'p90')
+
+ALL_SIZES = "all"
+
+# (bucket name, lower bound inclusive, upper bound exclusive) on total_revenue
+REVENUE_BUCKETS = [
+    ("under_1m", float("-inf"), 1_000_000),
+    ("1m_10m", 1_000_000, 10_000_000),
+    ("10m_100m", 10_000_000, 100_000_000),
+    ("100m_plus", 100_000_000, float("inf")),
+]
+
+_YEAR = "substr(tax_period_end, 1, 4)"
+# Per-year totals of every aggregated metric, as one string: any amended amount changes it
+_METRIC_TOTALS = " || ':' || ".join(f"TOTAL({metric})" for metric in PEER_METRICS)
+
+_lookup = {}
+_lookup_lock = threading.Lock()
+
+
+def revenue_bucket(total_revenue):
+    """Name of the revenue size bucket ``total_revenue`` falls into, or None if unknown"""
+    value = pd.to_numeric(total_revenue, errors='coerce')
+    if pd.isnull(value):
+        return None
+    for name, low, high in REVENUE_BUCKETS:
+        if low <= value < high:
+            return name
+    return None
+
+
+def _aggregate(frame, db_path):
+    """Peer statistics for every metric in one year's filings, per size bucket and overall"""
+    engine = SummaryEngine(PEER_METRICS, stats=PEER_STATS, db_path=db_path)
+    buckets = pd.to_numeric(frame['total_revenue'], errors='coerce').map(revenue_bucket)
+
+    overall = engine.summarize(frame)
+    overall.insert(0, 'size_bucket', ALL_SIZES)
+
+    # One grouped pass covers every bucket; reshape (bucket x (metric, stat)) to rows
+    by_bucket = engine.summarize(frame.assign(size_bucket=buckets), group_by='size_bucket')
+    by_bucket = by_bucket.stack(level=0, future_stack=True).rename_axis(['size_bucket', 'metric'])
+
+    overall = overall.rename_axis('metric').reset_index()
+    return pd.concat([overall, by_bucket.reset_index()[overall.columns]], ignore_index=True)
+
+
+def refresh_peer_stats(db_path=DB_PATH):
+    """Recompute the peer_stats rows of every tax year whose filings changed.
+
+    Run after every load (see utils_pipeline and utils_ingest). A year is
+    fingerprinted by its filing count, highest rowid and the total of every
+    metric in PEER_METRICS, so adding or amending a year of filings only
+    rebuilds that year. Returns the list of years that were rebuilt.
+    """
+    migrate(db_path)
+    conn = sqlite3.connect(db_path)
+    try:
+        current = pd.read_sql_query(f"""
+            SELECT {_YEAR} AS year, COUNT(*) AS filings, MAX(rowid) AS max_rowid,
+                   TOTAL(total_revenue) AS revenue_total, {_METRIC_TOTALS} AS metric_totals
+            FROM {FILINGS_TABLE}
+            WHERE tax_period_end != ''
+            GROUP BY year
+        """, conn)
+        stored = pd.read_sql_query("SELECT * FROM peer_stats_state", conn)
+
+        merged = current.merge(stored, on='year', how='outer', suffixes=('', '_stored'), indicator=True)
+        changed = merged[
+            (merged['_merge'] != 'both')
+            | (merged['filings'] != merged['filings_stored'])
+            | (merged['max_rowid'] != merged['max_rowid_stored'])
+            | (merged['revenue_total'] != merged['revenue_total_stored'])
+            | (merged['metric_totals'] != merged['metric_totals_stored'])
+        ]['year'].tolist()
+
+        with conn:
+            for year in changed:
+                conn.execute("DELETE FROM peer_stats WHERE year = ?", (year,))
+                conn.execute("DELETE FROM peer_stats_state WHERE year = ?", (year,))
+
+                filings = pd.read_sql_query(
+                    f"SELECT {', '.join(PEER_METRICS)} FROM {FILINGS_TABLE} "
+                    "WHERE tax_period_end >= ? AND tax_period_end < ?",
+                    conn, params=(f"{year}-", f"{int(year) + 1}-"))
+                if filings.empty:
+                    continue
+
+                stats = _aggregate(filings, db_path)
+                stats.insert(0, 'year', year)
+                stats.to_sql('peer_stats', conn, if_exists='append', index=False)
+
+                state = current[current['year'] == year].iloc[0]
+                conn.execute(
+                    "INSERT INTO peer_stats_state (year, filings, max_rowid, revenue_total, metric_totals) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (year, int(state['filings']), int(state['max_rowid']), float(state['revenue_total']),
+                     state['metric_totals']))
+        return changed
+    finally:
+        conn.close()
+
+
+def _load_lookup(db_path):
+    db_path = os.path.abspath(db_path)
+    signature = get_data_cache().db_signature(db_path)
+    with _lookup_lock:
+        cached = _lookup.get(db_path)
+        if cached is not None and cached[0] == signature:
+            return cached[1]
+
+        # Read-only: peer_stats is rebuilt by the pipeline and ingest loads, never on a lookup
+        index = {}
+        df = get_db_data("SELECT * FROM peer_stats", db_path=db_path)
+        for row in df.to_dict('records'):
+            metrics = index.setdefault((row.pop('year'), row.pop('size_bucket')), {})
+            metrics[row.pop('metric')] = row
+        _lookup[db_path] = (signature, index)
+        return index
+
+
+def get_peer_stats(year, size_bucket=ALL_SIZES, db_path=DB_PATH):
+    """Precomputed {metric: {stat: value}} for one tax year and revenue bucket ({} if none)"""
+    return _load_lookup(db_path).get((str(year), size_bucket), {})
+
+
+def latest_stats_year(db_path=DB_PATH):
+    """Most recent tax year that has peer statistics"""
+    years = [year for year, bucket in _load_lookup(db_path) if bucket == ALL_SIZES]
+    return max(years) if years else None
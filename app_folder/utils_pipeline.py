@@ -0,0 +1,184 @@
+import os
+import sqlite3
+from datetime import datetime
+
+import pandas as pd
+from utils_db import (DB_PATH, FILINGS_TABLE, REVENUE_AMOUNT_COLUMNS, REVENUE_DATE_COLUMNS, REVENUE_TABLE,
+                      REVENUE_TEXT_COLUMNS, migrate, table_columns)
+from utils_descriptions import refresh_descriptions
+from utils_line_items import is_line_item_column, replace_line_items, split_line_items
+from utils_metrics import refresh_metrics
+from utils_peer_stats import refresh_peer_stats
+from utils_response_cache import file_fingerprint
+from utils_trends import refresh_trends
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Sources loaded into the canonical store, in order; later sources win on conflicting keys
+DEFAULT_SOURCES = [
+    os.path.join(os.path.dirname(BASE_DIR), "sample_rag.csv"),
+    os.path.join(BASE_DIR, "parsed_results.csv"),
+]
+
+# sample_rag.csv uses the e-file element names; map them onto the canonical revenue columns
+RAG_COLUMN_MAP = {
+    'MembershipDuesAmt': 'membership_dues',
+    'FundraisingAmt': 'fundraising_amt',
+    'GovernmentGrantsAmt': 'government_grants',
+    'NoncashContributionsAmt': 'non_cash_contributions',
+    'AllOtherContributionsAmt': 'other_contributions',
+    'TotalContributionsAmt': 'total_contributions',
+    'TotalRevenueAmt': 'total_revenue',
+    'tax_prd_yr': 'tax_year',
+}
+
+REVENUE_COLUMNS = ['ein', 'tax_year'] + REVENUE_TEXT_COLUMNS[1:] + REVENUE_DATE_COLUMNS + REVENUE_AMOUNT_COLUMNS
+
+
+def normalize_revenue(df):
+    """Rename a revenue export to the canonical columns and key every row on (ein, tax_year).
+
+    Repeating-group columns (``ProgramServiceRevenueGrp_5_Desc``, ...) are kept, however
+    many lines there are, for ``split_line_items``.
+    """
+    df = df.rename(columns=RAG_COLUMN_MAP)
+    df = df[[col for col in REVENUE_COLUMNS if col in df.columns]
+            + [col for col in df.columns if is_line_item_column(col)]].copy()
+    df['ein'] = df['ein'].astype(str).str.strip()
+    if 'tax_period_end' in df.columns:
+        periods = pd.to_datetime(df['tax_period_end'], errors='coerce')
+        for col in REVENUE_DATE_COLUMNS:
+            if col in df.columns:
+                df[col] = pd.to_datetime(df[col], errors='coerce').dt.strftime('%Y-%m-%d')
+        if 'tax_year' not in df.columns:
+            df['tax_year'] = periods.dt.year
+    for col in REVENUE_AMOUNT_COLUMNS:
+        if col in df.columns:
+            df[col] = pd.to_numeric(df[col], errors='coerce')
+
+    # Placeholder rows without a period cannot be keyed
+    df['tax_year'] = pd.to_numeric(df.get('tax_year'), errors='coerce')
+    df = df[df['tax_year'].notna()]
+    df['tax_year'] = df['tax_year'].astype(int)
+    return df.drop_duplicates(['ein', 'tax_year'], keep='last')
+
+
+def normalize_filings(df, columns):
+    """Keep the canonical filing columns and one row per (ein, tax_period_end)"""
+    df = df[[col for col in columns if col in df.columns]].copy()
+    df['ein'] = df['ein'].astype(str).str.strip()
+    df = df[df['tax_period_end'].notna() & df['tax_period_end'].astype(str).str.strip().ne('')]
+    return df.drop_duplicates(['ein', 'tax_period_end'], keep='last')
+
+
+def dedupe_filings(db_path=DB_PATH):
+    """Delete all but the latest row of every duplicated (ein, tax_period_end) filing; returns the number deleted.
+
+    Migration 3 puts a unique index on that key and fails while duplicates remain,
+    so the load commands run this first. Every deleted row is printed.
+    """
+    if not os.path.exists(db_path):
+        return 0
+    conn = sqlite3.connect(db_path)
+    try:
+        with conn:
+            duplicates = conn.execute(f"""
+                SELECT f.rowid, f.ein, f.tax_period_end, latest.rowid FROM {FILINGS_TABLE} f
+                JOIN (SELECT ein, tax_period_end, MAX(rowid) AS rowid FROM {FILINGS_TABLE}
+                      WHERE tax_period_end != '' GROUP BY ein, tax_period_end HAVING COUNT(*) > 1) latest
+                  ON f.ein = latest.ein AND f.tax_period_end = latest.tax_period_end AND f.rowid != latest.rowid
+            """).fetchall()
+            for rowid, ein, period, kept in duplicates:
+                print(f"Removing duplicate filing {ein} {period} (row {rowid}, keeping row {kept})")
+            conn.executemany(f"DELETE FROM {FILINGS_TABLE} WHERE rowid = ?", [(row[0],) for row in duplicates])
+        return len(duplicates)
+    finally:
+        conn.close()
+
+
+def upsert(conn, table, df, key, conflict_where=""):
+    """Insert rows of ``df`` into ``table``, updating the columns it carries when ``key`` already exists"""
+    if df.empty:
+        return 0
+    columns = list(df.columns)
+    updates = ", ".join(f"{col} = excluded.{col}" for col in columns if col not in key)
+    sql = (f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))}) "
+           f"ON CONFLICT ({', '.join(key)}) {conflict_where} DO UPDATE SET {updates}")
+    rows = df.astype(object).where(df.notna(), None).itertuples(index=False, name=None)
+    conn.executemany(sql, rows)
+    return len(df)
+
+
+def read_source(path, db_path=DB_PATH):
+    """Return (table, key, conflict_where, frame, line_items) for a filings database or a revenue CSV.
+
+    ``line_items`` is None when the source carries no repeating revenue groups, so
+    loading it leaves the stored lines alone.
+    """
+    if path.endswith(".db"):
+        conn = sqlite3.connect(f"file:{os.path.abspath(path)}?mode=ro", uri=True)
+        try:
+            df = pd.read_sql_query(f"SELECT * FROM {FILINGS_TABLE}", conn)
+        finally:
+            conn.close()
+        columns = table_columns(FILINGS_TABLE, db_path=db_path)
+        return (FILINGS_TABLE, ['ein', 'tax_period_end'], "WHERE tax_period_end != ''",
+                normalize_filings(df, columns), None)
+    df = normalize_revenue(pd.read_csv(path, dtype={'ein': str}))
+    items = None
+    if any(is_line_item_column(col) for col in df.columns):
+        df, items = split_line_items(df)
+    return REVENUE_TABLE, ['ein', 'tax_year'], "", df, items
+
+
+def run_pipeline(sources=None, db_path=DB_PATH, force=False):
+    """Load every source into the canonical store, skipping sources unchanged since their last load.
+
+    Returns {source path: rows upserted}. Each source is written in one transaction
+    together with its new fingerprint, so an interrupted run never records a
+    partial load. Derived metrics and the revenue description index are rebuilt
+    whenever anything was loaded.
+    """
+    dedupe_filings(db_path)
+    migrate(db_path)
+    loaded = {}
+    conn = sqlite3.connect(db_path)
+    try:
+        for path in sources or DEFAULT_SOURCES:
+            # Recorded relative to this folder so the load state travels with the database
+            source = os.path.relpath(os.path.abspath(path), BASE_DIR)
+            fingerprint = file_fingerprint(path)
+            if not fingerprint:
+                print(f"Pipeline source missing: {path}")
+                continue
+            previous = conn.execute("SELECT fingerprint FROM pipeline_sources WHERE source = ?",
+                                    (source,)).fetchone()
+            if not force and previous is not None and previous[0] == fingerprint:
+                loaded[path] = 0
+                continue
+
+            table, key, conflict_where, df, items = read_source(path, db_path)
+            with conn:
+                loaded[path] = upsert(conn, table, df, key, conflict_where)
+                if items is not None:
+                    replace_line_items(conn, df, items)
+                conn.execute("INSERT OR REPLACE INTO pipeline_sources (source, fingerprint, rows, loaded_at) "
+                             "VALUES (?, ?, ?, ?)",
+                             (source, fingerprint, loaded[path], datetime.now().isoformat(timespec="seconds")))
+    finally:
+        conn.close()
+    if any(loaded.values()):
+        refresh_metrics(db_path)
+        refresh_descriptions(db_path)
+        refresh_peer_stats(db_path)
+        refresh_trends(db_path)
+    return loaded
+
+
+if __name__ == "__main__":
+    import sys
+
+    # python utils_pipeline.py                      -> reload changed default sources
+    # python utils_pipeline.py ../tax_data.db x.csv  -> load specific filings databases / revenue CSVs
+    for path, rows in run_pipeline(sys.argv[1:] or None).items():
+        print(f"{path}: {rows} rows upserted")
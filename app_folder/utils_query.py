@@ -0,0 +1,61 @@
+from typing import List, Optional, Sequence
+
+import pandas as pd
+from utils_db import DB_PATH, FILINGS_TABLE, get_db_data, table_columns
+from utils_frame import compact_frame
+
+
+def _projection(columns: Optional[Sequence[str]], db_path: str) -> str:
+    if not columns:
+        return "*"
+    known = set(table_columns(db_path=db_path))
+    unknown = [col for col in columns if col not in known]
+    if unknown:
+        raise ValueError(f"Unknown {FILINGS_TABLE} columns: {', '.join(unknown)}")
+    return ", ".join(f'"{col}"' for col in columns)
+
+
+def fetch_filings(ein: Optional[str] = None,
+                  period: Optional[str] = None,
+                  columns: Optional[Sequence[str]] = None,
+                  complete_only: bool = False,
+                  db_path: str = DB_PATH) -> pd.DataFrame:
+    """Filings filtered by EIN and/or tax_period_end inside SQLite, newest first.
+
+    ``columns`` restricts the projection to the named columns; ``complete_only``
+    drops placeholder rows that have no tax period. Frames are typed by
+    ``compact_frame`` and shared with every other caller: filter or select from
+    them rather than copying, and ``.copy()`` before writing values in place.
+    Read-only: the schema is migrated by the app and the load commands, not here.
+    """
+    conditions, params = [], []
+    if ein is not None:
+        conditions.append("ein = ?")
+        params.append(str(ein))
+    if period is not None:
+        conditions.append("tax_period_end = ?")
+        params.append(period)
+    if complete_only:
+        conditions.append("tax_period_begin != ''")
+
+    query = f"SELECT {_projection(columns, db_path)} FROM {FILINGS_TABLE}"
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    query += " ORDER BY tax_period_end DESC"
+    return get_db_data(query, params, db_path=db_path, transform=compact_frame)
+
+
+def fetch_eins(complete_only: bool = False, db_path: str = DB_PATH) -> List[str]:
+    """Distinct EINs, answered from the (ein, tax_period_end) index"""
+    query = f"SELECT DISTINCT ein FROM {FILINGS_TABLE}"
+    if complete_only:
+        query += " WHERE tax_period_begin != ''"
+    df = get_db_data(query + " ORDER BY ein", db_path=db_path)
+    return df['ein'].tolist() if not df.empty else []
+
+
+def latest_period(db_path: str = DB_PATH) -> Optional[str]:
+    """Most recent tax_period_end in the table"""
+    df = get_db_data(f"SELECT MAX(tax_period_end) AS period FROM {FILINGS_TABLE}", db_path=db_path)
+    return df['period'].iloc[0] if not df.empty else None
+
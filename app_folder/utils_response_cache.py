@@ -0,0 +1,121 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+RESPONSE_CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "response_cache.db")
+DEFAULT_TTL_SECONDS = 7 * 24 * 3600
+DEFAULT_MAX_ENTRIES = 5000
+
+
+def normalize_query(query):
+    """Lower-case, collapse whitespace and drop trailing punctuation so trivial variants share an entry"""
+    return re.sub(r"\s+", " ", query.strip().lower()).rstrip("?.! ")
+
+
+def file_fingerprint(path):
+    """Stable (across processes) version string of a data file, '' if it is missing"""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return ""
+    return f"{stat.st_mtime_ns}:{stat.st_size}"
+
+
+class ResponseCache:
+    """On-disk cache of LLM answers.
+
+    Keys hash the model, system prompt, normalized query and the data context built
+    for it. The conversation history is deliberately left out of the key: it differs
+    on every turn, so a repeated question would never hit. Every entry also records the
+    source it was built from and that source's data version; storing a newer
+    version purges the stale ones. Entries expire after ``ttl`` seconds and the
+    least recently used are evicted beyond ``max_entries``.
+    """
+
+    def __init__(self, path=RESPONSE_CACHE_PATH, ttl=DEFAULT_TTL_SECONDS, max_entries=DEFAULT_MAX_ENTRIES):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    source TEXT,
+                    data_version TEXT,
+                    answer TEXT,
+                    created_at REAL,
+                    last_used REAL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_last_used ON responses (last_used)")
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=10)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    @staticmethod
+    def make_key(model, system, query, context, history=""):
+        # A follow-up ("why?") means something else after every conversation, so the history is part of the key
+        parts = [model, system, normalize_query(query), context]
+        if history:
+            parts.append(history)
+        payload = json.dumps(parts)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key, source, data_version):
+        """Cached answer for ``key`` if it is fresh and built from the current data, else None"""
+        now = time.time()
+        with self._lock, self._connect() as conn:
+            row = conn.execute(
+                "SELECT answer FROM responses WHERE key = ? AND source = ? AND data_version = ? AND created_at > ?",
+                (key, source, data_version, now - self.ttl)).fetchone()
+            if row is None:
+                return None
+            conn.execute("UPDATE responses SET last_used = ? WHERE key = ?", (now, key))
+            return row[0]
+
+    def put(self, key, source, data_version, answer):
+        now = time.time()
+        with self._lock, self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO responses (key, source, data_version, answer, created_at, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (key, source, data_version, answer, now, now))
+            conn.execute("DELETE FROM responses WHERE source = ? AND data_version != ?", (source, data_version))
+            conn.execute("DELETE FROM responses WHERE created_at <= ?", (now - self.ttl,))
+            conn.execute("""
+                DELETE FROM responses WHERE key IN (
+                    SELECT key FROM responses ORDER BY last_used DESC LIMIT -1 OFFSET ?
+                )
+            """, (self.max_entries,))
+
+    def clear(self, source=None):
+        with self._lock, self._connect() as conn:
+            if source is None:
+                conn.execute("DELETE FROM responses")
+            else:
+                conn.execute("DELETE FROM responses WHERE source = ?", (source,))
+
+
+_response_cache = None
+_response_cache_lock = threading.Lock()
+
+
+def get_response_cache():
+    """Return the response cache shared by every session in this process"""
+    global _response_cache
+    with _response_cache_lock:
+        if _response_cache is None:
+            _response_cache = ResponseCache()
+        return _response_cache
@@ -0,0 +1,189 @@
+import json
+import os
+import re
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+import pandas as pd
+
+RETRIEVAL_INDEX_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "retrieval_index.db")
+DEFAULT_TOP_K = 20
+
+PERIOD_COLUMNS = ('tax_period_end', 'tax_prd_yr')
+
+STOPWORDS = {
+    'a', 'about', 'all', 'an', 'and', 'any', 'are', 'as', 'at', 'be', 'by', 'can', 'did', 'do', 'does',
+    'for', 'from', 'give', 'has', 'have', 'how', 'i', 'in', 'is', 'it', 'its', 'me', 'much', 'of', 'on',
+    'or', 'show', 'tell', 'that', 'the', 'their', 'there', 'this', 'to', 'was', 'we', 'were', 'what',
+    'when', 'which', 'who', 'with', 'would', 'you', 'your',
+}
+
+
+def _humanize(column):
+    """'GovernmentGrantsAmt' / 'government_grants' -> 'government grants amt'"""
+    column = re.sub(r"([a-z])([A-Z])", r"\1 \2", column)
+    return re.sub(r"[_\W]+", " ", column).strip().lower()
+
+
+def match_expression(query):
+    """FTS5 MATCH expression OR-ing the meaningful words of a natural-language question"""
+    words = [word for word in re.findall(r"[a-z0-9]+", query.lower()) if word not in STOPWORDS]
+    return " OR ".join(f'"{word}"' for word in dict.fromkeys(words))
+
+
+def filing_keys(df):
+    """'ein|period' of every row of ``df`` (just the EIN when it has no period column)"""
+    period = next((col for col in PERIOD_COLUMNS if col in df.columns), None)
+    keys = df['ein'].fillna('').astype(str)
+    if period is not None:
+        keys = keys + "|" + df[period].fillna('').astype(str)
+    return keys
+
+
+class FilingIndex:
+    """On-disk BM25 index with one chunk per filing.
+
+    Uses SQLite FTS5, whose bm25() ranking runs inside the index, so a search
+    touches only matching postings no matter how many filings are stored. Each
+    chunk keeps its original record as JSON, letting callers rebuild a DataFrame
+    of the top hits without reloading the source. Sources are indexed
+    incrementally: rows are keyed on (ein, period) and only new or changed rows
+    are written. Rows of the source that a frame does not contain are left alone,
+    so indexing one organization's filings keeps every other organization's,
+    unless the frame is the whole source (``replace=True``), which deletes them.
+    """
+
+    def __init__(self, path=RETRIEVAL_INDEX_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE VIRTUAL TABLE IF NOT EXISTS chunks USING fts5(
+                    body, source UNINDEXED, ein UNINDEXED, record UNINDEXED,
+                    tokenize = 'porter unicode61'
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS chunk_keys (
+                    source TEXT, row_key TEXT, row_hash TEXT, chunk_id INTEGER,
+                    PRIMARY KEY (source, row_key)
+                )
+            """)
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _chunk_text(record):
+        return " ".join(f"{_humanize(col)} {value}" for col, value in record.items()
+                        if value is not None and value != "")
+
+    def index_frame(self, source, df, replace=False):
+        """Add or refresh the rows of ``df`` under ``source``; returns the number of rows written.
+
+        Only the chunks of keys in ``df`` whose content changed are replaced. With
+        ``replace``, ``df`` is the whole source and chunks of keys it lacks are deleted,
+        so the index does not keep filings that are gone.
+        """
+        if 'ein' not in df.columns:
+            return 0
+
+        keys = filing_keys(df)
+        keys = keys + "|" + keys.groupby(keys).cumcount().astype(str)
+        hashes = pd.util.hash_pandas_object(df.astype(str), index=False).astype(str)
+        incoming = dict(zip(keys, hashes))
+
+        with self._lock, self._connect() as conn:
+            existing = dict(conn.execute(
+                "SELECT row_key, row_hash FROM chunk_keys WHERE source = ?", (source,)).fetchall())
+            stale = [key for key, row_hash in incoming.items() if key in existing and existing[key] != row_hash]
+            if replace:
+                stale += [key for key in existing if key not in incoming]
+            fresh = [i for i, key in enumerate(keys) if existing.get(key) != incoming[key]]
+
+            for key in stale:
+                conn.execute("""
+                    DELETE FROM chunks WHERE rowid = (
+                        SELECT chunk_id FROM chunk_keys WHERE source = ? AND row_key = ?
+                    )
+                """, (source, key))
+                conn.execute("DELETE FROM chunk_keys WHERE source = ? AND row_key = ?", (source, key))
+
+            records = df.iloc[fresh].astype(object).where(df.iloc[fresh].notna(), None).to_dict('records')
+            for position, record in zip(fresh, records):
+                cursor = conn.execute(
+                    "INSERT INTO chunks (body, source, ein, record) VALUES (?, ?, ?, ?)",
+                    (self._chunk_text(record), source, str(record['ein']), json.dumps(record, default=str)))
+                conn.execute(
+                    "INSERT INTO chunk_keys (source, row_key, row_hash, chunk_id) VALUES (?, ?, ?, ?)",
+                    (source, keys.iloc[position], hashes.iloc[position], cursor.lastrowid))
+        return len(fresh)
+
+    def search(self, query, k=DEFAULT_TOP_K, source=None, ein=None, within=None):
+        """Top ``k`` records for ``query`` by BM25, best first, as a DataFrame with a ``score`` column.
+
+        ``within`` is a frame of filings; hits whose (ein, period) it does not contain are dropped.
+        """
+        expression = match_expression(query)
+        if not expression:
+            return pd.DataFrame()
+
+        sql = "SELECT record, bm25(chunks) AS score FROM chunks WHERE chunks MATCH ?"
+        params = [expression]
+        if source is not None:
+            sql += " AND source = ?"
+            params.append(source)
+        if ein is not None:
+            sql += " AND ein = ?"
+            params.append(str(ein))
+        sql += " ORDER BY score LIMIT ?"
+        params.append(k)
+
+        with self._connect() as conn:
+            rows = conn.execute(sql, params).fetchall()
+        if not rows:
+            return pd.DataFrame()
+        records = pd.DataFrame([json.loads(record) for record, _ in rows])
+        # bm25() is negative with lower meaning better; flip it so higher is better
+        records['score'] = [-score for _, score in rows]
+        if within is not None:
+            records = records[filing_keys(records).isin(set(filing_keys(within)))].reset_index(drop=True)
+        return records
+
+
+_filing_index = None
+_filing_index_lock = threading.Lock()
+
+
+def get_filing_index():
+    """Return the retrieval index shared by every session in this process"""
+    global _filing_index
+    with _filing_index_lock:
+        if _filing_index is None:
+            _filing_index = FilingIndex()
+        return _filing_index
+
+
+def load_source(path):
+    """Filings from a SQLite database (tax_form_basic_data) or a CSV export"""
+    if path.endswith(".db"):
+        from utils_db import get_db_data
+        return get_db_data(db_path=path)
+    return pd.read_csv(path, dtype={'ein': str})
+
+
+if __name__ == "__main__":
+    import sys
+
+    # python utils_retrieval.py tax_data.db parsed_results.csv ../sample_rag.csv
+    index = get_filing_index()
+    for path in sys.argv[1:]:
+        written = index.index_frame(os.path.basename(path), load_source(path), replace=True)
+        print(f"{path}: {written} chunks written")
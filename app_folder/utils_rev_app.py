@@ -1,62 +1,183 @@
-import os
-import sqlite3
-import streamlit as st
 import pandas as pd
-import numpy as np
 from dotenv import load_dotenv
-from anthropic import Anthropic
-from datetime import datetime
+from utils_context import ContextBuilder
+from utils_engine import MODEL, build_request, get_engine
+from utils_instrument import get_instrumentation
+from utils_metrics import format_metrics, get_revenue_metrics
+from utils_stream import clean_stream
+from utils_response_cache import file_fingerprint, get_response_cache
+from utils_db import DB_PATH
+from utils_router import CACHE_PATH, FAST_PATH, GENERAL_CONTEXT, LLM_PATH, QueryRouter
+from utils_trends import concentration_risk, format_trends, get_revenue_trends
 
 load_dotenv()
 
+# Formatting fixes applied to every answer, also while it streams
+ANSWER_CLEANUPS = [("$ ,", "$ "), ("  ", " "), (" .", ".")]
+CACHE_SOURCE = "revenue_reliability"
+# Derived metric rows shown: every year of one organization, or the latest year of many
+METRIC_ROWS = 30
+# Trend rows shown: every series of one organization, or total revenue of the largest ones
+TREND_ROWS = 30
+
+# System message focused on revenue reliability analysis
+SYSTEM_MESSAGE = """You are analyzing nonprofit tax records with a focus on revenue reliability. For each analysis:
+                1. Assess consistency and trends in revenue streams (e.g., government grants, fundraising, memberships).
+                2. Identify dependencies on single revenue sources and potential risks.
+                3. Compare against peer organizations when relevant.
+                4. Provide data-backed insights and highlight opportunities to diversify revenue.
+                5. Keep responses concise and focused on reliability and sustainability metrics.
+                6. Revenue concentration (HHI), source shares and growth are given under Derived Revenue Metrics; interpret them rather than recomputing them.
+                7. Growth (CAGR), volatility (coefficient of variation), linear and Holt forecasts with 95% intervals and concentration risk are given under Revenue Trends and Concentration Risk. Base any prediction or forecast on them and state the interval, rather than extrapolating from the rows yourself. If no Revenue Trends are given, say that no forecast is available for this data instead of making one."""
+
 
 class RevenueReliabilityAnalyzer:
-    def __init__(self):
-        self.client = Anthropic(api_key=os.getenv("ANTHROPIC_API_KEY"))
+    def __init__(self, conversation=None):
+        self._engine = None
+        # A stored Conversation (see utils_conversation) survives reruns; without one,
+        # history is kept on this instance
+        self.conversation = conversation
         self.conversation_history = []
+        # Which path served the latest answer: FAST_PATH, CACHE_PATH or LLM_PATH
+        self.last_path = None
+        # Whether the latest answer was kept in the history; errors are not
+        self.last_stored = False
+        self.router = QueryRouter()
+        self.response_cache = get_response_cache()
+        self.context_builder = ContextBuilder()
+        self.instrumentation = get_instrumentation()
 
-    def analyze(self, df: pd.DataFrame, query: str) -> str:
-        try:
-            # Ensure numeric columns and handle NaN
-            df = df.fillna(0)
+    @property
+    def engine(self):
+        # Built on first model call, so answers from the router or the caches never load the API client
+        if self._engine is None:
+            self._engine = get_engine()
+        return self._engine
 
-            # Prepare context with the full dataset
-            context = "Full Dataset Provided:\n\n"
-            context += df.to_string(index=False)
+    @engine.setter
+    def engine(self, engine):
+        self._engine = engine
 
-            # Add only the last 2 relevant conversation items
-            if self.conversation_history:
-                context += "\n\nRecent Conversation Context:\n"
-                for q, a in self.conversation_history[-2:]:
-                    context += f"\nQ: {q}\nA: {a}\n"
+    @staticmethod
+    def _metrics_context(df: pd.DataFrame) -> str:
+        """Stored revenue mix and concentration metrics for the organizations in ``df``"""
+        if 'ein' not in df.columns:
+            return ""
+        eins = df['ein'].dropna().unique().tolist()
+        metrics = get_revenue_metrics(eins)
+        if len(eins) > 1 and not metrics.empty:
+            metrics = metrics.groupby('ein').head(1)
+        metrics_text = format_metrics(metrics, max_rows=METRIC_ROWS)
+        if not metrics_text:
+            return ""
+        return f"\n\nDerived Revenue Metrics (shares and HHI as fractions, newest first):\n{metrics_text}"
 
-            # System message focused on revenue reliability analysis
-            system_message = """You are analyzing nonprofit tax records with a focus on revenue reliability. For each analysis:
-                1. Assess consistency and trends in revenue streams (e.g., government grants, fundraising, memberships).
-                2. Identify dependencies on single revenue sources and potential risks.
-                3. Compare against peer organizations when relevant.
-                4. Provide data-backed insights and highlight opportunities to diversify revenue.
-                5. Keep responses concise and focused on reliability and sustainability metrics.
-                6. Where queries involve predicting or forecasting a value, do not simply return the value of an attribute named 'forecast' or 'predict'. Instead, use the present trend in the dataset to generate a data-driven estimate."""
+    @staticmethod
+    def _trends_context(df: pd.DataFrame) -> str:
+        """Precomputed growth, volatility, forecasts and concentration risk for the organizations in ``df``"""
+        if 'ein' not in df.columns:
+            return ""
+        eins = df['ein'].dropna().unique().tolist()
+        trends = get_revenue_trends(eins)
+        context = ""
+        if not trends.empty:
+            if trends['ein'].nunique() > 1:
+                trends = trends[trends['series'] == 'total_revenue'].sort_values('last_value', ascending=False)
+            context += ("\n\nRevenue Trends (CAGR and cv as fractions, forecasts with 95% intervals, "
+                        f"linear and Holt smoothing):\n{format_trends(trends, max_rows=TREND_ROWS)}")
+
+        risk = concentration_risk(get_revenue_metrics(eins))
+        if not risk.empty:
+            risk = risk.sort_values('revenue_hhi', ascending=False)
+            context += f"\n\nConcentration Risk (latest HHI, change since first year):\n{format_metrics(risk, max_rows=TREND_ROWS)}"
+        return context
+
+    def _history_context(self):
+        """Earlier exchanges for the prompt: the stored conversation's summary and latest turns"""
+        if self.conversation is not None:
+            return self.conversation.context()
+
+        # Add only the last 2 relevant conversation items
+        context = ""
+        if self.conversation_history:
+            context += "\nRecent Conversation Context:\n"
+            for q, a in self.conversation_history[-2:]:
+                context += f"\nQ: {q}\nA: {a}\n"
+        return context
+
+    def _remember(self, query, answer):
+        self.last_stored = True
+        if self.conversation is not None:
+            self.conversation.append(query, answer, self.last_path)
+            return
+        self.conversation_history.append((query, answer))
+        if len(self.conversation_history) > 10:
+            self.conversation_history.pop(0)
+
+    @staticmethod
+    def _request(context: str, query: str, history: str = "") -> dict:
+        # Same prompt layout as TaxAnalyzer._request: system prompt and data are one prefix, cached if long enough
+        return build_request(SYSTEM_MESSAGE, f"Based on the following tax records:\n\n{context}", query, history)
+
+    def analyze(self, df: pd.DataFrame, query: str, ein_selected: str = GENERAL_CONTEXT) -> str:
+        """Run the analysis and return the complete answer"""
+        return "".join(self.analyze_stream(df, query, ein_selected))
+
+    def analyze_stream(self, df: pd.DataFrame, query: str, ein_selected: str = GENERAL_CONTEXT):
+        """Yield the analysis as cleaned text deltas while the model is still generating it"""
+        self.last_stored = False
+        span = self.instrumentation.start("revenue_analyzer.analyze", ein=ein_selected, rows=len(df),
+                                          query_chars=len(query))
+        try:
+            # "Which orgs earn revenue from parking?" is answered from the description index, without a model call
+            answer = self.router.revenue_sources(query, ein_selected)
+            if answer is not None:
+                self.last_path = FAST_PATH
+                span.set(path=FAST_PATH)
+                yield answer
+                self._remember(query, answer)
+                return
 
-            response = self.client.messages.create(
-                model="claude-3-sonnet-20240229",
-                system=system_message,
-                messages=[{
-                    "role": "user",
-                    "content": f"Based on the following tax records:\n\n{context}\n\nQuestion: {query}"
-                }],
-                max_tokens=1500
-            )
+            with self.instrumentation.span("revenue_analyzer.build_context") as context_span:
+                # Trends and forecasts are precomputed; only each organization's latest filing goes in as rows.
+                # Columns are not narrowed to the query, so follow-up questions share the same cacheable block
+                latest = df.groupby('ein', sort=False, observed=True).head(1) if 'ein' in df.columns else df
+                context = "Latest Filing per Organization:\n\n"
+                context += self.context_builder.build(latest)
+                context += self._trends_context(df)
+                context += self._metrics_context(df)
+                context_span.set(prompt_chars=len(context))
+            history = self._history_context()
+            span.set(prompt_chars=len(context) + len(history))
 
-            answer = response.content[0].text if response.content else "Unable to generate analysis"
-            answer = answer.replace("$ ,", "$ ").replace("  ", " ").replace(" .", ".")
+            # The same question about the same data after the same conversation is answered from the response cache
+            cache_key = self.response_cache.make_key(MODEL, SYSTEM_MESSAGE, query, context, history)
+            data_version = file_fingerprint(DB_PATH)
+            answer = self.response_cache.get(cache_key, CACHE_SOURCE, data_version)
+            if answer is not None:
+                self.last_path = CACHE_PATH
+                span.set(path=CACHE_PATH)
+                yield answer
+            else:
+                self.last_path = LLM_PATH
+                span.set(path=LLM_PATH)
+                parts = []
+                deltas = self.engine.stream_text(**self._request(context, query, history))
+                for delta in clean_stream(deltas, ANSWER_CLEANUPS):
+                    parts.append(delta)
+                    yield delta
 
-            self.conversation_history.append((query, answer))
-            if len(self.conversation_history) > 10:
-                self.conversation_history.pop(0)
+                answer = "".join(parts)
+                if answer:
+                    self.response_cache.put(cache_key, CACHE_SOURCE, data_version, answer)
+                else:
+                    answer = "Unable to generate analysis"
+                    yield answer
 
-            return answer
+            self._remember(query, answer)
 
         except Exception as e:
-            return f"Error analyzing records: {str(e)}"
+            span.fail(e)
+            yield f"Error analyzing records: {str(e)}"
+        finally:
+            span.finish()
@@ -0,0 +1,235 @@
+import re
+
+import pandas as pd
+from utils_db import DB_PATH
+from utils_descriptions import description_terms, line_label, search_descriptions
+from utils_frame import format_date
+from utils_retrieval import STOPWORDS
+
+FAST_PATH = "fast"
+CACHE_PATH = "cache"
+LLM_PATH = "llm"
+
+PATH_LABELS = {
+    FAST_PATH: "⚡ answered directly from the filings",
+    CACHE_PATH: "♻️ cached model answer",
+    LLM_PATH: "🤖 model analysis",
+}
+
+# (pattern, column, label, kind) in matching order: more specific phrases first, and a
+# matched phrase is blanked out so "program service revenue" does not also hit "revenue"
+FIELD_PATTERNS = [
+    (r"\b(business|organi[sz]ation'?s?|org'?s?|legal)\s+name\b|\bcalled\b", 'business_name', "Business name", 'text'),
+    (r"\bvolunteers?\b", 'total_volunteers', "Total volunteers", 'count'),
+    (r"\bemployees?\b|\bstaff\b|\bheadcount\b", 'total_employees', "Total employees", 'count'),
+    (r"\bvoting members?\b|\bboard size\b", 'voting_members_governing_body', "Voting members of the governing body",
+     'count'),
+    (r"\bexecutive comp\w*", 'executive_compensation', "Executive compensation", 'money'),
+    (r"\bprogram service revenue\b", 'program_service_revenue', "Program service revenue", 'money'),
+    (r"\b(total )?contributions?\b|\bdonations?\b", 'total_contributions', "Total contributions", 'money'),
+    (r"\b(total )?revenue\b", 'total_revenue', "Total revenue", 'money'),
+    (r"\bprogram (service )?(expenses?|spending)\b", 'program_services_expenses', "Program service expenses",
+     'money'),
+    (r"\bfundraising expenses?\b", 'fundraising_expenses', "Fundraising expenses", 'money'),
+    (r"\b(management|administrative|admin)( and general)? expenses?\b", 'management_and_general_expenses',
+     "Management and general expenses", 'money'),
+    (r"\b(total )?expenses?\b|\bspending\b", 'total_expenses', "Total expenses", 'money'),
+    (r"\bnet assets\b", 'net_assets_eoy', "Net assets (end of year)", 'money'),
+    (r"\b(total )?assets\b", 'total_assets_eoy', "Total assets (end of year)", 'money'),
+    (r"\b(total )?liabilities\b|\bdebt\b", 'total_liabilities_eoy', "Total liabilities (end of year)", 'money'),
+    (r"\bwebsite\b|\burl\b", 'website', "Website", 'text'),
+    (r"\bformation year\b|\bformed\b|\bfounded\b", 'formation_year', "Formation year", 'year'),
+]
+
+# Questions asking for judgement, explanation, comparison or change always go to the model
+INTERPRETIVE = re.compile(
+    r"\b(why|how (efficient|well|healthy|stable|sustainable|reliable)|analy[sz]\w*|assess\w*|evaluat\w*|"
+    r"compar\w*|peers?|trends?|forecast\w*|predict\w*|project\w*|recommend\w*|should|improv\w*|explain\w*|"
+    r"risks?|efficien\w*|ratios?|health\w*|insights?|better|worse|good|bad|summar\w*|overview|"
+    r"chang\w*|between|vs|versus|from (19|20)\d{2} to|grow\w*|increas\w*|decreas\w*|declin\w*|"
+    r"(go|goes|went|gone) (up|down)|ris(e|es|en|ing)|rose|fall\w*|fell|drop\w*|percent\w*|proportion\w*|"
+    r"shares?|fractions?|breakdown)\b|%")
+
+AGGREGATES = [
+    (re.compile(r"\b(average|mean|typical)\b"), 'mean', "Average"),
+    (re.compile(r"\bmedian\b"), 'median', "Median"),
+    (re.compile(r"\b(sum of|combined|altogether|in total|overall total)\b"), 'sum', "Combined"),
+    (re.compile(r"\b(highest|largest|biggest|most(?! recent)|maximum|max)\b"), 'max', "Highest"),
+    (re.compile(r"\b(lowest|smallest|least|minimum|min)\b"), 'min', "Lowest"),
+]
+COUNT_ORGANIZATIONS = re.compile(r"\b(how many|number of|count of) (organi[sz]ations|orgs|nonprofits|charities|eins)\b")
+YEAR = re.compile(r"\b(19|20)\d{2}\b")
+# Words a direct question may carry besides its fields, year and aggregate. Any other word
+# ("net", "government", "per") means the question asks for more than a lookup can answer
+FILLER_WORDS = STOPWORDS | {
+    'across', 'amount', 'ein', 'eins', 'figure', 'file', 'filed', 'filing', 'filings', 'find', 'fiscal', 'get',
+    'had', 'latest', 'list', 'many', 'most', 'my', 'nonprofit', 'nonprofits', 'number', 'one', 'org',
+    'organisation', 'organisations', 'organization', 'organizations', 'orgs', 'our', 'period', 'please',
+    'recent', 'report', 'reported', 'reports', 's', 'tax', 'they', 'us', 'value', 'whats', 'year',
+}
+
+GENERAL_CONTEXT = "General Context"
+# Organizations listed in a revenue-source answer, best matches first
+REVENUE_SOURCE_ORGS = 10
+
+
+def split_fields(query):
+    """(fields, rest): (column, label, kind) for every field the query names, in pattern order, and
+    the lower-cased query with those phrases blanked out"""
+    text = query.lower()
+    fields = []
+    for pattern, column, label, kind in FIELD_PATTERNS:
+        if re.search(pattern, text):
+            fields.append((column, label, kind))
+            text = re.sub(pattern, " ", text)
+    return fields, text
+
+
+def match_fields(query):
+    return split_fields(query)[0]
+
+
+def fully_consumed(rest, *patterns):
+    """True if ``rest`` has nothing left but FILLER_WORDS once years and ``patterns`` are blanked out"""
+    for pattern in (YEAR, *patterns):
+        rest = pattern.sub(" ", rest)
+    return all(word in FILLER_WORDS for word in re.findall(r"[a-z0-9]+", rest))
+
+
+def format_value(value, kind):
+    if value is None or (not isinstance(value, str) and pd.isnull(value)) or value == '':
+        return "not reported"
+    if kind == 'text':
+        return str(value)
+    number = pd.to_numeric(value, errors='coerce')
+    if pd.isnull(number):
+        return str(value)
+    if kind == 'money':
+        return f"${number:,.2f}"
+    if kind == 'year':
+        return f"{int(number)}"
+    return f"{number:,.0f}"
+
+
+class QueryRouter:
+    """Answers factual questions straight from the filings, without a model call.
+
+    Field lookups ("How many volunteers and employees are there?") for a selected
+    organization read its latest filing, or the filing of a year named in the
+    question. Simple aggregates across all organizations ("average total
+    revenue", "how many organizations") use each organization's latest filing.
+    Revenue-source questions ("which orgs earn revenue from parking?") are looked
+    up in the revenue description index. A lookup or aggregate is only used when
+    every word of the question is accounted for by its fields, its one year and
+    its aggregate; anything interpretive, naming several years, or asking for
+    more than that returns None and is left to the model.
+    """
+
+    def __init__(self, db_path=DB_PATH):
+        self.db_path = db_path
+
+    def route(self, query, df, df_x, ein_selected):
+        """Return the answer text, or None if the question needs the model"""
+        if INTERPRETIVE.search(query.lower()):
+            return None
+        years = {match.group(0) for match in YEAR.finditer(query)}
+        if len(years) > 1:
+            return None
+        year = years.pop() if years else None
+
+        answer = self.revenue_sources(query, ein_selected)
+        if answer is not None:
+            return answer
+        if ein_selected != GENERAL_CONTEXT:
+            return self.lookup(query, df, year)
+        return self.aggregate(query, df_x, year)
+
+    @staticmethod
+    def _filings_for_year(df, year):
+        if df.empty or 'tax_period_end' not in df.columns:
+            return df
+        # Parsed dates print as YYYY-MM-DD; missing ones (NaT or '') are dropped
+        periods = df['tax_period_end'].astype(str).where(df['tax_period_end'].notna(), '')
+        keep = periods.str.strip().ne('')
+        if year is not None:
+            keep &= periods.str.startswith(year)
+        return df[keep]
+
+    def revenue_sources(self, query, ein_selected=GENERAL_CONTEXT):
+        """Organizations with program-service or other revenue lines described by the question's subject"""
+        terms = description_terms(query)
+        if not terms or INTERPRETIVE.search(query.lower()):
+            return None
+        year = YEAR.search(query)
+        year = year.group(0) if year else None
+        eins = None if ein_selected == GENERAL_CONTEXT else [ein_selected]
+        lines = search_descriptions(terms, eins=eins, year=year, db_path=self.db_path)
+        if lines.empty:
+            return None
+
+        # Each organization's lines from its latest matching year, organizations by their best match
+        lines = lines[lines['tax_year'] == lines.groupby('ein')['tax_year'].transform('max')]
+        organizations = lines.groupby('ein', sort=False)
+        scope = f"periods ending in {year}" if year else "latest matching year"
+        subject = " or ".join(f"*{term}*" for term in terms)
+        answer = [f"Organizations with revenue lines matching {subject} ({scope}):"]
+        for ein, rows in list(organizations)[:REVENUE_SOURCE_ORGS]:
+            name = rows['business_name'].dropna()
+            items = "; ".join(f"{row.description} ({line_label(row.line_group)}): {format_value(row.amount, 'money')}"
+                              for row in rows.itertuples(index=False))
+            answer.append(f"- **{name.iloc[0] if not name.empty else ein}** ({ein}), period ending "
+                          f"{format_date(rows['tax_period_end'].iloc[0])}: {items}")
+        if organizations.ngroups > REVENUE_SOURCE_ORGS:
+            answer.append(f"- …and {organizations.ngroups - REVENUE_SOURCE_ORGS:,} more organizations")
+        return "\n".join(answer)
+
+    def lookup(self, query, df, year=None):
+        fields, rest = split_fields(query)
+        if not fully_consumed(rest):
+            return None
+        fields = [field for field in fields if field[0] in df.columns]
+        if not fields:
+            return None
+        filings = self._filings_for_year(df, year)
+        if filings.empty:
+            return None
+
+        record = filings.sort_values('tax_period_end', ascending=False).iloc[0]
+        lines = [f"**{record.get('business_name', '')}**, filing for the period ending {format_date(record['tax_period_end'])}:"]
+        for column, label, kind in fields:
+            lines.append(f"- {label}: {format_value(record[column], kind)}")
+        return "\n".join(lines)
+
+    def aggregate(self, query, df_x, year=None):
+        text = query.lower()
+        filings = self._filings_for_year(df_x, year)
+        if filings.empty or 'ein' not in filings.columns:
+            return None
+        scope = f"periods ending in {year}" if year else "each organization's most recent filing"
+        latest = filings.sort_values('tax_period_end').groupby('ein').tail(1)
+
+        fields, rest = split_fields(query)
+        if COUNT_ORGANIZATIONS.search(text):
+            # "How many organizations have revenue over $1M?" is not a plain count
+            if fields or not fully_consumed(rest, COUNT_ORGANIZATIONS):
+                return None
+            return f"There are {latest['ein'].nunique():,} organizations with filings ({scope})."
+
+        aggregate = next(((pattern, how, label) for pattern, how, label in AGGREGATES if pattern.search(text)), None)
+        fields = [field for field in fields if field[0] in latest.columns and field[2] != 'text']
+        if aggregate is None or len(fields) != 1 or not fully_consumed(rest, aggregate[0]):
+            return None
+
+        _, how, label = aggregate
+        column, field_label, kind = fields[0]
+        values = pd.to_numeric(latest[column], errors='coerce')
+        if values.notna().sum() == 0:
+            return None
+        if how in ('max', 'min'):
+            position = values.idxmax() if how == 'max' else values.idxmin()
+            record = latest.loc[position]
+            return (f"{label} {field_label.lower()} ({scope}): **{record.get('business_name', record['ein'])}** "
+                    f"with {format_value(values[position], kind)} for the period ending {format_date(record['tax_period_end'])}.")
+        value = getattr(values, how)()
+        return (f"{label} {field_label.lower()} across {values.notna().sum():,} organizations ({scope}): "
+                f"{format_value(value, kind)}.")
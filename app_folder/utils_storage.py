@@ -0,0 +1,265 @@
+import os
+import shutil
+import threading
+import time
+from collections import OrderedDict
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+from utils_db import (DB_PATH, LINE_ITEMS_TABLE, REVENUE_AMOUNT_COLUMNS as AMOUNT_COLUMNS,
+                      REVENUE_DATE_COLUMNS as DATE_COLUMNS, REVENUE_TABLE, REVENUE_TEXT_COLUMNS as TEXT_COLUMNS,
+                      get_db_data)
+from utils_frame import compact_frame
+from utils_line_items import is_line_item_column, load_line_items, pivot_line_items
+
+REVENUE_STORE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "revenue_store")
+
+# Names the live version directory; replaced atomically once a new version is fully written
+POINTER = "CURRENT"
+VERSION_PREFIX = "v"
+# Written next to the partitions; pyarrow skips files starting with "_" when reading
+SOURCE_MARKER = "_source"
+LINE_ITEMS_DIR = "_line_items"
+MAX_CACHED_FRAMES = 16
+
+# Fixed schema for the revenue data, so nothing is inferred at read time
+REVENUE_SCHEMA = pa.schema(
+    [pa.field(col, pa.string()) for col in TEXT_COLUMNS]
+    + [pa.field(col, pa.date32()) for col in DATE_COLUMNS]
+    + [pa.field(col, pa.float64()) for col in AMOUNT_COLUMNS]
+    + [pa.field('year', pa.int16())]
+)
+PARTITIONING = ds.partitioning(pa.schema([pa.field('year', pa.int16())]), flavor="hive")
+# revenue_line_items, long format, partitioned the same way
+LINE_ITEM_SCHEMA = pa.schema(
+    [pa.field(col, pa.string()) for col in ('ein', 'line_group')]
+    + [pa.field('seq', pa.int16()), pa.field('field', pa.string()), pa.field('description', pa.string()),
+       pa.field('amount', pa.float64()), pa.field('year', pa.int16())]
+)
+
+
+def to_revenue_table(df):
+    """Coerce a parsed revenue DataFrame to REVENUE_SCHEMA, sorted by year and EIN.
+
+    Rows are partitioned on ``tax_year``. Sorting by EIN inside each year keeps row
+    groups narrow, so EIN filters can skip most of them.
+    """
+    df = df.rename(columns={'tax_year': 'year'})
+    for col in REVENUE_SCHEMA.names:
+        if col not in df.columns:
+            df[col] = None
+    for col in TEXT_COLUMNS:
+        df[col] = df[col].map(lambda value: None if pd.isna(value) else str(value)).astype(object)
+    for col in DATE_COLUMNS:
+        df[col] = pd.to_datetime(df[col], errors='coerce').dt.date
+    for col in AMOUNT_COLUMNS:
+        df[col] = pd.to_numeric(df[col], errors='coerce')
+
+    df['year'] = pd.to_numeric(df['year'], errors='coerce')
+    df = df[df['year'].notna()].sort_values(['year', 'ein', 'tax_period_end'])
+    return pa.Table.from_pandas(df[REVENUE_SCHEMA.names], schema=REVENUE_SCHEMA, preserve_index=False)
+
+
+def revenue_fingerprint(db_path=DB_PATH):
+    """Version string of the revenue tables in ``db_path``, '' if there are none.
+
+    Each table contributes the version its triggers bump on every insert, update and
+    delete (see migration 10), plus its row count and highest rowid, which tell
+    apart databases whose counters happen to match. Writes to the filings tables
+    do not force a rebuild.
+    """
+    if not os.path.exists(db_path):
+        return ""
+    state = get_db_data(f"""
+        SELECT (SELECT version FROM table_versions WHERE name = '{REVENUE_TABLE}'),
+               (SELECT COUNT(*) FROM {REVENUE_TABLE}), (SELECT MAX(rowid) FROM {REVENUE_TABLE}),
+               (SELECT version FROM table_versions WHERE name = '{LINE_ITEMS_TABLE}'),
+               (SELECT COUNT(*) FROM {LINE_ITEMS_TABLE}), (SELECT MAX(rowid) FROM {LINE_ITEMS_TABLE})
+    """, db_path=db_path)
+    if state.empty:
+        return ""
+    return ":".join(str(value) for value in state.iloc[0].tolist())
+
+
+def to_line_item_table(items):
+    """Coerce stored line items to LINE_ITEM_SCHEMA, sorted by year and EIN"""
+    if items.empty:
+        return LINE_ITEM_SCHEMA.empty_table()
+    items = items.rename(columns={'tax_year': 'year'}).astype({'ein': str}).sort_values(['year', 'ein'])
+    return pa.Table.from_pandas(items[LINE_ITEM_SCHEMA.names], schema=LINE_ITEM_SCHEMA, preserve_index=False)
+
+
+class RevenueStore:
+    """Columnar copy of the canonical revenue table.
+
+    tax_form_revenue_data is exported once into Parquet partitioned by tax year
+    (``revenue_store/v<stamp>/year=2023/...``) with an explicit schema, and re-exported
+    only when the revenue tables change. Each export goes to a new version directory and
+    goes live when the ``CURRENT`` pointer file is replaced, so readers see either the
+    old store or the new one. Reads go through pyarrow.dataset, so only the requested
+    columns are decoded and year/EIN filters prune partitions and row groups
+    before any data is read. Loaded frames are kept in a small LRU until the store
+    is rebuilt. Repeating revenue groups are kept in long format under ``_line_items``
+    (from revenue_line_items) and pivoted for the rows loaded, as wide as those
+    filers need.
+    """
+
+    def __init__(self, path=REVENUE_STORE_PATH, source=DB_PATH):
+        self.path = path
+        self.source = source
+        self._lock = threading.Lock()
+        self._dataset = None
+        self._line_items = None
+        self._version = None
+        self._frames = OrderedDict()
+
+    def _live_dir(self):
+        """Name of the version directory the pointer names, None before the first build"""
+        try:
+            with open(os.path.join(self.path, POINTER), encoding="utf-8") as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def _stored_version(self, live):
+        try:
+            with open(os.path.join(self.path, live, SOURCE_MARKER), encoding="utf-8") as f:
+                return f.read().strip()
+        except (FileNotFoundError, TypeError):
+            return None
+
+    def _prune(self, keep):
+        """Remove versions older than ``keep``, and anything left from the unversioned layout"""
+        for name in os.listdir(self.path):
+            if name.startswith(POINTER) or (name.startswith(VERSION_PREFIX) and name >= keep):
+                continue
+            target = os.path.join(self.path, name)
+            if os.path.isdir(target):
+                shutil.rmtree(target, ignore_errors=True)
+            else:
+                os.remove(target)
+
+    def build(self):
+        """Rewrite the store from the revenue table"""
+        version = revenue_fingerprint(self.source)
+        table = to_revenue_table(get_db_data(f"SELECT * FROM {REVENUE_TABLE}", db_path=self.source))
+        line_items = to_line_item_table(load_line_items(db_path=self.source))
+
+        # Each build writes a fresh directory; stamps sort by age, so pruning never touches a newer build
+        name = f"{VERSION_PREFIX}{time.time_ns():020d}-{os.getpid()}"
+        target = os.path.join(self.path, name)
+        for data, path in ((table, target), (line_items, os.path.join(target, LINE_ITEMS_DIR))):
+            ds.write_dataset(data, path, format="parquet", partitioning=PARTITIONING,
+                             basename_template="part-{i}.parquet", existing_data_behavior="overwrite_or_ignore")
+        # An empty table writes no files; the directory must still exist to be opened
+        os.makedirs(os.path.join(target, LINE_ITEMS_DIR), exist_ok=True)
+        with open(os.path.join(target, SOURCE_MARKER), "w", encoding="utf-8") as f:
+            f.write(version)
+
+        # os.replace of a file is atomic: readers find the old pointer or the new one, never neither
+        previous = self._live_dir()
+        staging = os.path.join(self.path, f"{POINTER}.{os.getpid()}.tmp")
+        with open(staging, "w", encoding="utf-8") as f:
+            f.write(name)
+        os.replace(staging, os.path.join(self.path, POINTER))
+        # The replaced version stays for readers that opened it before the swap
+        self._prune(min(previous, name) if previous and previous.startswith(VERSION_PREFIX) else name)
+        return version
+
+    def _open(self):
+        """Open the dataset, building or rebuilding it first if the database has changed"""
+        live = self._live_dir()
+        version = self._stored_version(live)
+        if os.path.exists(self.source) and version != revenue_fingerprint(self.source):
+            version = self.build()
+            live = self._live_dir()
+        if self._dataset is None or (live, version) != self._version:
+            path = os.path.join(self.path, live)
+            self._dataset = ds.dataset(path, schema=REVENUE_SCHEMA, format="parquet", partitioning=PARTITIONING)
+            self._line_items = ds.dataset(os.path.join(path, LINE_ITEMS_DIR), schema=LINE_ITEM_SCHEMA,
+                                          format="parquet", partitioning=PARTITIONING)
+            self._version = (live, version)
+            self._frames.clear()
+        return self._dataset
+
+    def _with_line_items(self, df, condition, columns=None):
+        """``df`` with the pivoted line items of its filers (only ``columns`` of them when given)"""
+        items = pivot_line_items(self._line_items.to_table(filter=condition).to_pandas(), keys=('ein', 'year'))
+        if columns is not None:
+            items = items[['ein', 'year'] + [col for col in columns if col in items.columns]]
+        return df.merge(items.astype({'ein': str, 'year': df['year'].dtype}), on=['ein', 'year'], how='left')
+
+    def load(self, columns=None, eins=None, years=None):
+        """Revenue rows as a DataFrame, restricted to ``columns``, ``eins`` and ``years`` when given.
+
+        Line-item columns (``ProgramServiceRevenueGrp_5_Desc``, ...) come with every full
+        load, or when named in ``columns``. The frame is a shallow copy of the cached
+        one, as with ``DataCache``: ``.copy()`` it before writing values in place.
+        """
+        line_columns = []
+        if columns is not None:
+            line_columns = [col for col in columns if is_line_item_column(col)]
+            unknown = [col for col in columns if col not in REVENUE_SCHEMA.names and col not in line_columns]
+            if unknown:
+                raise ValueError(f"Unknown revenue columns: {', '.join(unknown)}")
+            columns = list(dict.fromkeys(columns))
+
+        key = (tuple(columns or ()), tuple(sorted(map(str, eins or ()))), tuple(sorted(years or ())))
+        with self._lock:
+            dataset = self._open()
+            if key in self._frames:
+                self._frames.move_to_end(key)
+                return self._frames[key].copy(deep=False)
+
+            condition = None
+            if eins:
+                condition = ds.field('ein').isin([str(ein) for ein in eins])
+            if years:
+                year_condition = ds.field('year').isin([int(year) for year in years])
+                condition = year_condition if condition is None else condition & year_condition
+            with_lines = columns is None or bool(line_columns)
+            read = columns
+            if columns is not None:
+                # Line items are joined on (ein, year), which are dropped again unless requested
+                read = [col for col in columns if col not in line_columns]
+                read += [col for col in ('ein', 'year') if with_lines and col not in read]
+            table = dataset.to_table(columns=read, filter=condition)
+            # Partitions come back oldest year first; callers expect each EIN's latest filing first
+            order = [(col, direction) for col, direction in (('ein', 'ascending'), ('tax_period_end', 'descending'))
+                     if col in table.column_names]
+            if order:
+                table = table.sort_by(order)
+            df = table.to_pandas(split_blocks=True, self_destruct=True, date_as_object=False)
+            if with_lines:
+                df = self._with_line_items(df, condition, line_columns or None)
+            if columns is not None:
+                df = df.reindex(columns=columns)
+            df = compact_frame(df)
+
+            self._frames[key] = df
+            while len(self._frames) > MAX_CACHED_FRAMES:
+                self._frames.popitem(last=False)
+            return df.copy(deep=False)
+
+    def eins(self):
+        return self.load(columns=['ein'])['ein'].drop_duplicates().tolist()
+
+
+_revenue_store = None
+_revenue_store_lock = threading.Lock()
+
+
+def get_revenue_store():
+    """Return the revenue store shared by every session in this process"""
+    global _revenue_store
+    with _revenue_store_lock:
+        if _revenue_store is None:
+            _revenue_store = RevenueStore()
+        return _revenue_store
+
+
+if __name__ == "__main__":
+    # python utils_storage.py  -> write a new revenue_store/ version from tax_form_revenue_data
+    store = get_revenue_store()
+    print(f"Revenue store written to {store.path} ({store.build()})")
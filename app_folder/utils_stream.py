@@ -0,0 +1,44 @@
+class IncrementalReplacer:
+    """Apply a chain of ``str.replace`` cleanups to text that arrives in pieces.
+
+    Text is only released up to the last character that cannot take part in any
+    replacement, so no pattern is ever split across two releases and the joined
+    output equals running the same replacements over the complete text.
+    """
+
+    def __init__(self, replacements):
+        self.replacements = list(replacements)
+        self._unsafe = set("".join(old + new for old, new in self.replacements))
+        self._pending = ""
+
+    def feed(self, delta):
+        """Add a delta and return whatever cleaned text is safe to show now"""
+        self._pending += delta
+        cut = len(self._pending)
+        while cut and self._pending[cut - 1] in self._unsafe:
+            cut -= 1
+        ready, self._pending = self._pending[:cut], self._pending[cut:]
+        return clean_text(ready, self.replacements)
+
+    def flush(self):
+        """Return the cleaned remainder once the stream has ended"""
+        ready, self._pending = self._pending, ""
+        return clean_text(ready, self.replacements)
+
+
+def clean_text(text, cleanups):
+    for old, new in cleanups:
+        text = text.replace(old, new)
+    return text
+
+
+def clean_stream(deltas, cleanups):
+    """Yield cleaned text from an iterable of raw text deltas"""
+    replacer = IncrementalReplacer(cleanups)
+    for delta in deltas:
+        text = replacer.feed(delta)
+        if text:
+            yield text
+    text = replacer.flush()
+    if text:
+        yield text
@@ -0,0 +1,221 @@
+import argparse
+import hashlib
+import itertools
+import json
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from utils_engine import MIN_CACHE_TOKENS
+
+
+def _stub_answer(request):
+    """Deterministic answer words and input token count for a Messages request"""
+    prompt_chars = len(json.dumps(request.get("system", ""))) + len(json.dumps(request.get("messages", [])))
+    words = f"Stub analysis of a {prompt_chars:,} character prompt for {request.get('model')}.".split(" ")
+    return words, prompt_chars // 4 + 1
+
+
+def _blocks(content):
+    return [{"type": "text", "text": content}] if isinstance(content, str) else content
+
+
+def _cache_usage(request, prompt_cache, input_tokens):
+    """Split ``input_tokens`` the way the API reports prompt caching, updating ``prompt_cache``.
+
+    Each cache_control breakpoint ends a prefix (system blocks first, then message
+    content in order). The longest prefix seen before is read from the cache, longer
+    ones are written to it, and only the rest counts as input_tokens.
+    """
+    blocks = _blocks(request.get("system") or []) + [block for message in request.get("messages", [])
+                                                    for block in _blocks(message.get("content", ""))]
+    digest, chars, prefixes = hashlib.sha256(), 0, []
+    for block in blocks:
+        text = json.dumps(block.get("text", ""))
+        digest.update(text.encode("utf-8"))
+        chars += len(text)
+        if block.get("cache_control") and chars // 4 >= MIN_CACHE_TOKENS:
+            prefixes.append((digest.hexdigest(), chars // 4))
+    read = max((tokens for key, tokens in prefixes if key in prompt_cache), default=0)
+    cached = prefixes[-1][1] if prefixes else 0
+    prompt_cache.update(key for key, _ in prefixes)
+    return {"input_tokens": max(1, input_tokens - cached),
+            "cache_read_input_tokens": read, "cache_creation_input_tokens": cached - read}
+
+
+def _stub_message(request, prompt_cache):
+    words, input_tokens = _stub_answer(request)
+    usage = _cache_usage(request, prompt_cache, input_tokens)
+    return {
+        "id": "msg_stub", "type": "message", "role": "assistant", "model": request.get("model"),
+        "content": [{"type": "text", "text": " ".join(words)}], "stop_reason": "end_turn",
+        "stop_sequence": None, "usage": dict(usage, output_tokens=len(words)),
+    }
+
+
+class StubMessagesHandler(BaseHTTPRequestHandler):
+    """Minimal stand-in for the Messages API: POST /v1/messages, plain or streamed.
+
+    Answers are deterministic and derived from the prompt size, so runs against the
+    stub are repeatable. The server's ``latency``, ``chunk_delay``, ``rate_limit_every``
+    and ``overloaded_every`` attributes simulate slow generation and 429 / 529
+    responses (with ``retry_after`` as their retry-after header); ``peak_in_flight``
+    records the most Messages requests served at once. Prompt caching is simulated too, so usage reports cache reads and writes for
+    requests with cache_control breakpoints.
+    Message Batches are answered immediately: a created batch has already ended
+    and its results can be fetched straight away.
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_event(self, event, data):
+        self.wfile.write(f"event: {event}\ndata: {json.dumps(data)}\n\n".encode("utf-8"))
+        self.wfile.flush()
+
+    def _not_found(self):
+        self._send_json(404, {"type": "error", "error": {"type": "not_found_error", "message": self.path}})
+
+    def _batch(self, batch_id):
+        now = datetime.now(timezone.utc).isoformat()
+        return {
+            "id": batch_id, "type": "message_batch", "processing_status": "ended",
+            "request_counts": {"processing": 0, "succeeded": len(self.server.batches[batch_id]),
+                               "errored": 0, "canceled": 0, "expired": 0},
+            "created_at": now, "ended_at": now, "expires_at": now,
+            "archived_at": None, "cancel_initiated_at": None,
+            "results_url": f"/v1/messages/batches/{batch_id}/results",
+        }
+
+    def do_GET(self):
+        parts = self.path.split("?")[0].strip("/").split("/")
+        if parts[:3] != ["v1", "messages", "batches"] or len(parts) < 4 or parts[3] not in self.server.batches:
+            self._not_found()
+            return
+        batch_id = parts[3]
+        if len(parts) == 4:
+            self._send_json(200, self._batch(batch_id))
+            return
+
+        body = "".join(json.dumps({"custom_id": custom_id, "result": {"type": "succeeded", "message": message}}) + "\n"
+                       for custom_id, message in self.server.batches[batch_id]).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/binary")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        path = self.path.split("?")[0]
+        if path == "/v1/messages/batches":
+            batch_id = f"msgbatch_stub_{uuid.uuid4().hex[:12]}"
+            self.server.batches[batch_id] = [(item["custom_id"], _stub_message(item["params"], self.server.prompt_cache))
+                                             for item in request.get("requests", [])]
+            self._send_json(200, self._batch(batch_id))
+            return
+        if path != "/v1/messages":
+            self._not_found()
+            return
+
+        server = self.server
+        count = next(server.request_counter)
+        for every, status, error in ((server.rate_limit_every, 429, "rate_limit_error"),
+                                     (server.overloaded_every, 529, "overloaded_error")):
+            if every and count % every == 0:
+                self._send_json(status, {"type": "error", "error": {"type": error, "message": "stub"}},
+                                headers={"retry-after": server.retry_after})
+                return
+
+        with server.in_flight_lock:
+            server.in_flight += 1
+            server.peak_in_flight = max(server.peak_in_flight, server.in_flight)
+        try:
+            self._answer(request)
+        finally:
+            with server.in_flight_lock:
+                server.in_flight -= 1
+
+    def _answer(self, request):
+        server = self.server
+        message = _stub_message(request, server.prompt_cache)
+        output_tokens = message["usage"]["output_tokens"]
+        words = message["content"][0]["text"].split(" ")
+        time.sleep(server.latency)
+
+        if not request.get("stream"):
+            self._send_json(200, message)
+            return
+        message["usage"] = dict(message["usage"], output_tokens=0)
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self._send_event("message_start", {"type": "message_start",
+                                           "message": dict(message, content=[], stop_reason=None)})
+        self._send_event("content_block_start", {"type": "content_block_start", "index": 0,
+                                                 "content_block": {"type": "text", "text": ""}})
+        for i, word in enumerate(words):
+            time.sleep(server.chunk_delay)
+            self._send_event("content_block_delta", {"type": "content_block_delta", "index": 0,
+                                                     "delta": {"type": "text_delta",
+                                                               "text": word if i == 0 else " " + word}})
+        self._send_event("content_block_stop", {"type": "content_block_stop", "index": 0})
+        self._send_event("message_delta", {"type": "message_delta",
+                                           "delta": {"stop_reason": "end_turn", "stop_sequence": None},
+                                           "usage": {"output_tokens": output_tokens}})
+        self._send_event("message_stop", {"type": "message_stop"})
+        self.close_connection = True
+
+
+def start_stub_server(port=0, latency=0.0, chunk_delay=0.0, rate_limit_every=0, overloaded_every=0, retry_after="0"):
+    """Serve the stub on a background thread; returns (server, base_url)"""
+    server = ThreadingHTTPServer(("127.0.0.1", port), StubMessagesHandler)
+    server.daemon_threads = True
+    server.latency = latency
+    server.chunk_delay = chunk_delay
+    server.rate_limit_every = rate_limit_every
+    server.overloaded_every = overloaded_every
+    server.retry_after = retry_after
+    server.in_flight = server.peak_in_flight = 0
+    server.in_flight_lock = threading.Lock()
+    server.request_counter = itertools.count(1)
+    server.batches = {}
+    server.prompt_cache = set()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+if __name__ == "__main__":
+    # ANTHROPIC_BASE_URL=http://127.0.0.1:8765 streamlit run app.py
+    parser = argparse.ArgumentParser(description="Local stub of the Anthropic Messages API")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds before the first token")
+    parser.add_argument("--chunk-delay", type=float, default=0.0, help="seconds between streamed words")
+    parser.add_argument("--rate-limit-every", type=int, default=0, help="answer every Nth request with a 429")
+    parser.add_argument("--overloaded-every", type=int, default=0, help="answer every Nth request with a 529")
+    args = parser.parse_args()
+
+    server, base_url = start_stub_server(args.port, args.latency, args.chunk_delay, args.rate_limit_every,
+                                         args.overloaded_every)
+    print(f"Stub Messages API listening on {base_url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,88 @@
+import difflib
+import pandas as pd
+from utils_db import DB_PATH, FILINGS_TABLE, table_columns
+
+DEFAULT_STATS = ('mean', 'median', 'std')
+
+# Percentile statistics are named pNN and computed with a single quantile() call
+_PERCENTILE_PREFIX = 'p'
+
+GROUPINGS = {
+    'year': lambda df: df['tax_period_end'].astype(str).str[:4].rename('year'),
+    'ein': lambda df: df['ein'],
+}
+
+
+def _is_percentile(stat):
+    return stat.startswith(_PERCENTILE_PREFIX) and stat[1:].isdigit()
+
+
+class SummaryEngine:
+    """Vectorized summary statistics over columns of the filings table.
+
+    Column names are checked against the ``tax_form_basic_data`` schema when the
+    engine is built, so a typo raises instead of silently dropping the metric.
+    ``stats`` accepts any pandas aggregation name (count, mean, median, std, min,
+    max, sum, ...) plus percentiles written as p25, p75, p90 and so on.
+    """
+
+    def __init__(self, columns, stats=DEFAULT_STATS, table=FILINGS_TABLE, db_path=DB_PATH):
+        schema = table_columns(table, db_path=db_path)
+        if not schema:
+            raise ValueError(f"Table {table} not found in {db_path}")
+
+        unknown = [col for col in columns if col not in schema]
+        if unknown:
+            hints = []
+            for col in unknown:
+                match = difflib.get_close_matches(col, schema, n=1)
+                hints.append(f"{col} (did you mean {match[0]}?)" if match else col)
+            raise ValueError(f"Unknown {table} columns: {', '.join(hints)}")
+
+        self.columns = list(columns)
+        self.stats = list(stats)
+        self._aggregations = [stat for stat in self.stats if not _is_percentile(stat)]
+        self._percentiles = {stat: int(stat[1:]) / 100 for stat in self.stats if _is_percentile(stat)}
+
+    def summarize(self, df, group_by=None):
+        """Statistics for every column in one pass.
+
+        Without ``group_by`` the result has one row per column and one column per
+        statistic. With ``group_by='year'``, ``'ein'`` or the name of another column
+        of ``df`` the rows are the groups and the columns a (column, statistic)
+        MultiIndex.
+        """
+        numeric = df[self.columns].apply(pd.to_numeric, errors='coerce')
+
+        if group_by is None:
+            parts = []
+            if self._aggregations:
+                parts.append(numeric.agg(self._aggregations).T)
+            if self._percentiles:
+                quantiles = numeric.quantile(list(self._percentiles.values())).T
+                quantiles.columns = list(self._percentiles)
+                parts.append(quantiles)
+            return pd.concat(parts, axis=1)[self.stats]
+
+        if group_by in GROUPINGS:
+            keys = GROUPINGS[group_by](df)
+        elif group_by in df.columns:
+            keys = df[group_by]
+        else:
+            raise ValueError(f"group_by must be one of {', '.join(GROUPINGS)} or a column of the frame")
+        grouped = numeric.groupby(keys, observed=True)
+
+        parts = []
+        if self._aggregations:
+            parts.append(grouped.agg(self._aggregations))
+        if self._percentiles:
+            quantiles = grouped.quantile(list(self._percentiles.values())).unstack()
+            names = {q: stat for stat, q in self._percentiles.items()}
+            quantiles.columns = pd.MultiIndex.from_tuples([(col, names[q]) for col, q in quantiles.columns])
+            parts.append(quantiles)
+        result = pd.concat(parts, axis=1)
+        return result[pd.MultiIndex.from_product([self.columns, self.stats])]
+
+    def to_dict(self, df):
+        """Ungrouped summary as {column: {statistic: value}}"""
+        return self.summarize(df).to_dict('index')
@@ -0,0 +1,346 @@
+import sqlite3
+
+import numpy as np
+import pandas as pd
+from utils_db import DB_PATH, FILINGS_TABLE, REVENUE_TABLE, get_db_data, migrate
+from utils_metrics import METRIC_DIGITS, REVENUE_SOURCES
+
+FORECAST_HORIZON = 1
+# Series need this many years for a forecast, and two for CAGR and volatility
+MIN_FORECAST_POINTS = 3
+
+# Two-sided 95% Student t critical values by degrees of freedom; beyond 30 the normal value is used
+T_975 = {1: 12.706, 2: 4.303, 3: 3.182, 4: 2.776, 5: 2.571, 6: 2.447, 7: 2.365, 8: 2.306, 9: 2.262,
+         10: 2.228, 11: 2.201, 12: 2.179, 13: 2.160, 14: 2.145, 15: 2.131, 16: 2.120, 17: 2.110,
+         18: 2.101, 19: 2.093, 20: 2.086, 25: 2.060, 30: 2.042}
+Z_975 = 1.96
+# Smoothing parameters tried for Holt's method; each series keeps the pair with the lowest one-step error
+HOLT_GRID = (0.2, 0.4, 0.6, 0.8)
+
+# Series column -> name, for revenue rows (tax_form_revenue_data / parsed_results.csv) and filings
+REVENUE_SERIES = {'total_revenue': 'total_revenue', **REVENUE_SOURCES}
+FILING_SERIES = {
+    'total_revenue': 'total_revenue',
+    'total_contributions': 'contributions',
+    'program_service_revenue': 'program_services',
+    'investment_income': 'investment_income',
+    'total_expenses': 'total_expenses',
+}
+
+# Herfindahl-Hirschman index of the revenue mix (shares as fractions)
+CONCENTRATION_LEVELS = [(0.5, 'high'), (0.25, 'moderate'), (0.0, 'low')]
+
+
+def _t_critical(dof):
+    """95% two-sided t value for each entry of ``dof`` (NaN below 1)"""
+    keys = np.array(sorted(T_975))
+    values = np.array([T_975[key] for key in keys])
+    dof = np.asarray(dof, dtype=float)
+    # Unlisted degrees of freedom use the next smaller listed one, which is slightly conservative
+    index = np.clip(np.searchsorted(keys, dof, side='right') - 1, 0, len(keys) - 1)
+    return np.where(dof < 1, np.nan, np.where(dof > keys[-1], Z_975, values[index]))
+
+
+def yearly_matrices(df, columns, year_column):
+    """(EINs, years, values) where values[s, i, t] is column s of EIN i in year t, NaN where missing.
+
+    Built with one scatter into a preallocated array rather than a pivot per
+    column; a later row for the same EIN and year overwrites an earlier one.
+    """
+    year = pd.to_numeric(df[year_column], errors='coerce').to_numpy(dtype=float)
+    keep = ~np.isnan(year)
+    if not keep.any():
+        return np.array([], dtype=object), np.array([], dtype=int), np.empty((len(columns), 0, 0))
+    codes, eins = pd.factorize(df['ein'].astype(str).to_numpy()[keep])
+    year = year[keep].astype(int)
+    years = np.arange(year.min(), year.max() + 1)
+
+    values = np.full((len(columns), len(eins), len(years)), np.nan)
+    for s, column in enumerate(columns):
+        values[s, codes, year - years[0]] = pd.to_numeric(df[column], errors='coerce').to_numpy(dtype=float)[keep]
+    return np.asarray(eins), years, values
+
+
+def _ends(observed):
+    """Column index of each row's first and last observation (0 for rows with none)"""
+    first = observed.argmax(axis=1)
+    last = observed.shape[1] - 1 - observed[:, ::-1].argmax(axis=1)
+    return first, last
+
+
+def cagr(values, years):
+    """Compound annual growth between each row's first and last observation; NaN unless both are positive"""
+    observed = ~np.isnan(values)
+    first, last = _ends(observed)
+    rows = np.arange(len(values))
+    start, end = values[rows, first], values[rows, last]
+    span = (years[last] - years[first]).astype(float)
+    valid = observed.any(axis=1) & (start > 0) & (end > 0) & (span > 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        growth = np.power(end / start, 1 / np.where(span > 0, span, 1)) - 1
+    return np.where(valid, growth, np.nan)
+
+
+def coefficient_of_variation(values):
+    """Sample standard deviation over the absolute mean of each row's observations"""
+    observed = ~np.isnan(values)
+    n = observed.sum(axis=1)
+    filled = np.where(observed, values, 0.0)
+    mean = filled.sum(axis=1) / np.maximum(n, 1)
+    squares = np.where(observed, (values - mean[:, None]) ** 2, 0.0).sum(axis=1)
+    std = np.sqrt(squares / np.maximum(n - 1, 1))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cv = std / np.abs(mean)
+    return np.where((n >= 2) & (mean != 0), cv, np.nan)
+
+
+def linear_forecast(values, years, horizon=FORECAST_HORIZON):
+    """Least-squares trend per row: (slope per year, forecast, low, high) ``horizon`` years past its last observation.
+
+    The interval is the 95% prediction interval of the fitted line.
+    """
+    observed = ~np.isnan(values)
+    n = observed.sum(axis=1).astype(float)
+    x = np.broadcast_to(years.astype(float), values.shape)
+    y = np.where(observed, values, 0.0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        x_mean = np.where(observed, x, 0.0).sum(axis=1) / n
+        y_mean = y.sum(axis=1) / n
+        dx = np.where(observed, x - x_mean[:, None], 0.0)
+        sxx = (dx ** 2).sum(axis=1)
+        slope = (dx * (y - y_mean[:, None])).sum(axis=1) / sxx
+        intercept = y_mean - slope * x_mean
+
+        _, last = _ends(observed)
+        target = years[last] + horizon
+        forecast = intercept + slope * target
+        residuals = np.where(observed, y - (intercept[:, None] + slope[:, None] * x), 0.0)
+        s = np.sqrt((residuals ** 2).sum(axis=1) / (n - 2))
+        margin = _t_critical(n - 2) * s * np.sqrt(1 + 1 / n + (target - x_mean) ** 2 / sxx)
+
+    valid = n >= MIN_FORECAST_POINTS
+    nan = np.full(len(values), np.nan)
+    return (np.where(n >= 2, slope, nan), np.where(valid, forecast, nan),
+            np.where(valid, forecast - margin, nan), np.where(valid, forecast + margin, nan))
+
+
+def _holt_pass(values, observed, last, alpha, beta):
+    """One run of Holt's linear smoothing over every row; returns (level, trend, squared errors, errors)"""
+    rows = len(values)
+    level, trend = np.full(rows, np.nan), np.zeros(rows)
+    seen = np.zeros(rows, dtype=int)
+    gap = np.zeros(rows)
+    sse, errors = np.zeros(rows), np.zeros(rows)
+    for t in range(values.shape[1]):
+        y = values[:, t]
+        obs = observed[:, t]
+        active = t <= last
+        gap = np.where(seen > 0, gap + 1, gap)
+
+        start = obs & (seen == 0)
+        second = obs & (seen == 1)
+        smooth = obs & (seen >= 2)
+        # Years missing between two filings carry the level forward along the trend
+        carry = ~obs & active & (seen >= 2)
+
+        predicted = level + trend
+        error = y - predicted
+        new_level = alpha * y + (1 - alpha) * predicted
+        new_trend = beta * (new_level - level) + (1 - beta) * trend
+        with np.errstate(invalid='ignore', divide='ignore'):
+            initial_trend = (y - level) / np.maximum(gap, 1)
+
+        sse = np.where(smooth, sse + error ** 2, sse)
+        errors = np.where(smooth, errors + 1, errors)
+        trend = np.where(smooth, new_trend, np.where(second, initial_trend, trend))
+        level = np.where(smooth, new_level, np.where(start | second, y, np.where(carry, predicted, level)))
+        gap = np.where(obs, 0, gap)
+        seen = seen + obs
+    return level, trend, sse, errors
+
+
+def holt_forecast(values, horizon=FORECAST_HORIZON):
+    """Holt's linear exponential smoothing per row: (forecast, low, high) ``horizon`` years past its last observation.
+
+    Smoothing parameters are picked per row from HOLT_GRID by one-step-ahead
+    squared error; the 95% interval uses the one-step error spread, widened for
+    longer horizons.
+    """
+    observed = ~np.isnan(values)
+    _, last = _ends(observed)
+    n = observed.sum(axis=1)
+
+    best_sse = np.full(len(values), np.inf)
+    forecast, margin = np.full(len(values), np.nan), np.full(len(values), np.nan)
+    for alpha in HOLT_GRID:
+        for beta in HOLT_GRID:
+            level, trend, sse, errors = _holt_pass(values, observed, last, alpha, beta)
+            better = sse < best_sse
+            best_sse = np.where(better, sse, best_sse)
+            spread = 1 + sum((alpha * (1 + j * beta)) ** 2 for j in range(1, horizon))
+            with np.errstate(invalid='ignore', divide='ignore'):
+                s = np.sqrt(sse / errors)
+            forecast = np.where(better, level + horizon * trend, forecast)
+            margin = np.where(better, Z_975 * s * np.sqrt(spread), margin)
+
+    valid = n >= MIN_FORECAST_POINTS
+    nan = np.full(len(values), np.nan)
+    return np.where(valid, forecast, nan), np.where(valid, forecast - margin, nan), np.where(valid, forecast + margin, nan)
+
+
+def compute_trends(df, series=None, year_column='tax_year', horizon=FORECAST_HORIZON):
+    """Growth, volatility and forecasts of every series for every EIN in ``df``, one vectorized pass per series.
+
+    Returns one row per (EIN, series) that has at least two yearly values, with
+    CAGR, coefficient of variation, the linear trend and both forecasts with
+    their 95% intervals for ``horizon`` years after the series' last year.
+    """
+    if series is None:
+        series = REVENUE_SERIES
+    if year_column not in df.columns and 'tax_period_end' in df.columns:
+        df = df.assign(**{year_column: df['tax_period_end'].astype(str).str[:4]})
+
+    columns = [column for column in series if column in df.columns]
+    if not columns or df.empty:
+        return pd.DataFrame()
+    eins, years, values = yearly_matrices(df, columns, year_column)
+
+    # Every (series, EIN) pair becomes one row, so each statistic below is a single pass over all of them
+    names = np.repeat([series[column] for column in columns], len(eins))
+    eins = np.tile(eins, len(columns))
+    values = values.reshape(len(names), len(years))
+    points = (~np.isnan(values)).sum(axis=1)
+    keep = (points >= 2) & (np.nan_to_num(np.abs(values)).sum(axis=1) > 0)
+    if not keep.any():
+        return pd.DataFrame()
+    values, eins, names, points = values[keep], eins[keep], names[keep], points[keep]
+    first, last = _ends(~np.isnan(values))
+
+    slope, linear, linear_low, linear_high = linear_forecast(values, years, horizon)
+    holt, holt_low, holt_high = holt_forecast(values, horizon)
+    return pd.DataFrame({
+        'ein': eins, 'series': names, 'years': points,
+        'first_year': years[first], 'last_year': years[last], 'last_value': values[np.arange(len(values)), last],
+        'cagr': cagr(values, years), 'cv': coefficient_of_variation(values), 'slope': slope,
+        'forecast_year': years[last] + horizon,
+        'linear_forecast': linear, 'linear_low': linear_low, 'linear_high': linear_high,
+        'holt_forecast': holt, 'holt_low': holt_low, 'holt_high': holt_high,
+    })
+
+
+def filing_trends(eins=None, db_path=DB_PATH, horizon=FORECAST_HORIZON):
+    """compute_trends over the yearly filings in tax_form_basic_data"""
+    query = f"SELECT ein, tax_period_end, {', '.join(FILING_SERIES)} FROM {FILINGS_TABLE} WHERE tax_period_end != ''"
+    params = None
+    if eins is not None:
+        eins = [str(ein) for ein in eins]
+        if not eins:
+            return pd.DataFrame()
+        query += f" AND ein IN ({', '.join('?' * len(eins))})"
+        params = eins
+    df = get_db_data(query, params, db_path=db_path)
+    if df.empty:
+        return df
+    return compute_trends(df, FILING_SERIES, year_column='year', horizon=horizon)
+
+
+def refresh_trends(db_path=DB_PATH):
+    """Recompute revenue_trends from the stored revenue rows.
+
+    Called after every load (pipeline and benchmark data generation), so answering
+    a question only reads the stored rows. Every series is one vectorized pass
+    and the table is replaced in one transaction, together with the revenue table
+    version it was computed from. Returns the number of rows written.
+    """
+    migrate(db_path)
+    conn = sqlite3.connect(db_path)
+    try:
+        # Read before the rows: a load landing in between leaves the trends marked stale, not current
+        version = _revenue_version(conn)
+        columns = ', '.join(['ein', 'tax_year'] + list(REVENUE_SERIES))
+        trends = compute_trends(pd.read_sql_query(f"SELECT {columns} FROM {REVENUE_TABLE}", conn))
+        with conn:
+            conn.execute("DELETE FROM revenue_trends")
+            if not trends.empty:
+                trends.to_sql('revenue_trends', conn, if_exists='append', index=False)
+            conn.execute("DELETE FROM revenue_trends_state")
+            conn.execute("INSERT INTO revenue_trends_state (revenue_version) VALUES (?)", (version,))
+    finally:
+        conn.close()
+    return len(trends)
+
+
+def _revenue_version(conn):
+    """The trigger-maintained version of the revenue table (see migration 10)"""
+    return conn.execute("SELECT version FROM table_versions WHERE name = ?", (REVENUE_TABLE,)).fetchone()[0]
+
+
+def ensure_trends(db_path=DB_PATH):
+    """Refresh revenue_trends if the revenue rows changed since it was computed, or it never was.
+
+    Run at startup by the pages that read trends, so a fresh checkout or a
+    database written outside the pipeline still has forecasts. Costs one query
+    when the trends are current. Returns the number of rows written, or None
+    when nothing was refreshed.
+    """
+    migrate(db_path)
+    conn = sqlite3.connect(db_path)
+    try:
+        stored = conn.execute("SELECT revenue_version FROM revenue_trends_state").fetchone()
+        current = stored is not None and stored[0] == _revenue_version(conn)
+    finally:
+        conn.close()
+    return None if current else refresh_trends(db_path)
+
+
+def get_revenue_trends(eins=None, db_path=DB_PATH):
+    """Stored revenue trends, one row per (EIN, series)"""
+    query = "SELECT * FROM revenue_trends"
+    params = None
+    if eins is not None:
+        eins = [str(ein) for ein in eins]
+        if not eins:
+            return pd.DataFrame()
+        query += f" WHERE ein IN ({', '.join('?' * len(eins))})"
+        params = eins
+    return get_db_data(query + " ORDER BY ein, series", params, db_path=db_path)
+
+
+def concentration_risk(revenue_metrics):
+    """Latest revenue concentration per EIN from stored revenue metrics, with its change and a risk level"""
+    metrics = revenue_metrics.dropna(subset=['revenue_hhi'])
+    if metrics.empty:
+        return pd.DataFrame()
+    metrics = metrics.sort_values(['ein', 'tax_year'])
+    grouped = metrics.groupby('ein')
+    latest = grouped.tail(1).set_index('ein')
+    risk = pd.DataFrame({
+        'tax_year': latest['tax_year'],
+        'revenue_hhi': latest['revenue_hhi'],
+        'hhi_change': latest['revenue_hhi'] - grouped['revenue_hhi'].first(),
+        'largest_source': latest['largest_source'],
+        'largest_source_share': latest['largest_source_share'],
+    })
+    risk['risk'] = 'low'
+    for threshold, level in reversed(CONCENTRATION_LEVELS):
+        risk.loc[risk['revenue_hhi'] >= threshold, 'risk'] = level
+    return risk.reset_index()
+
+
+def format_trends(trends, max_rows=None):
+    """Compact CSV block of trend rows for a prompt: amounts in whole dollars, rates as fractions"""
+    if trends.empty:
+        return ""
+    trends = trends.dropna(axis=1, how='all')
+    if max_rows is not None:
+        trends = trends.head(max_rows)
+    amounts = [col for col in trends.columns if col.startswith(('last_value', 'slope', 'linear_', 'holt_'))]
+    trends = trends.round({col: 0 for col in amounts}).round(METRIC_DIGITS)
+    return trends.to_csv(index=False)
+
+
+if __name__ == "__main__":
+    # python utils_trends.py  -> trends and forecasts of every organization's filings
+    trends = filing_trends()
+    print(f"{len(trends)} series for {trends['ein'].nunique() if not trends.empty else 0} organizations")
+    print(format_trends(trends[trends['series'] == 'total_revenue'], max_rows=20))
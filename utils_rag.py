@@ -1,47 +1,71 @@
-import streamlit as st
+import os
+import sys
 import pandas as pd
 from dotenv import load_dotenv
-from anthropic import Anthropic
+
+# The context builder, engine and request layout live with the multipage app
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'app_folder'))
+
+from utils_context import ContextBuilder
+from utils_engine import build_request, get_engine
+from utils_retrieval import get_filing_index
+
 load_dotenv()
 
+RAG_SOURCE = "rag_records"
+TOP_K = 20
+
+SYSTEM_MESSAGE = ("You are analyzing tax records. Look at the provided data carefully and answer questions directly "
+                  "based on the records shown. If you see the information in the data, report it exactly as shown. "
+                  "Do not try to calculate or estimate values - only report what you directly observe in the records.")
+
 
 class TaxAnalyzer:
     def __init__(self):
-        self.client = Anthropic(api_key=st.secrets("ANTHROPIC_API_KEY"))
+        self._engine = None
+        self.context_builder = ContextBuilder()
+        self.index = get_filing_index()
+        self._indexed = None
+
+    @property
+    def engine(self):
+        # The shared, pooled engine of the app_folder analyzers, built on the first model call
+        if self._engine is None:
+            self._engine = get_engine()
+        return self._engine
 
     def analyze(self, df: pd.DataFrame, query: str) -> str:
         """
         Simply provide the data context and let Claude analyze it directly
         """
-        # Create context with full relevant data
+        # The frame is the whole source: index its new or changed rows once, dropping rows it no longer has,
+        # then retrieve only the best matching records that are in it
+        if self._indexed != (id(df), df.shape):
+            self.index.index_frame(RAG_SOURCE, df, replace=True)
+            self._indexed = (id(df), df.shape)
+        records = self.index.search(query, k=TOP_K, source=RAG_SOURCE, within=df)
+        if records.empty:
+            available = "No filings match the terms of the question."
+        else:
+            records = records.drop(columns='score')
+            # Create context with the retrieved records, trimmed to the token budget
+            available = self.context_builder.build(records, query)
+
         context = f"""
         Available Records:
-        {df.to_string()}
+        {available}
 
         Data Summary:
-        - Total Records: {len(df)}
+        - Total Records: {len(df)} ({len(records)} shown)
         - Unique Organizations: {df['business_name'].nunique()}
         - Available Columns: {', '.join(df.columns.tolist())}
         """
 
-        # Get analysis from Claude with minimal processing
-        response = self.client.messages.create(
-            model="claude-3-sonnet-20240229",
-            system="You are analyzing tax records. Look at the provided data carefully and answer questions directly "
-                   "based on the records shown. If you see the information in the data, report it exactly as shown. "
-                   "Do not try to calculate or estimate values - only report what you directly observe in the records.",
-            messages=[
-                {"role": "user", "content": f"""
-                Here are the tax records:
-
-                {context}
-
-                Question: {query}
-
-                Look at the records carefully and answer based on what you see in the data."""}
-            ],
-            max_tokens=1000
-        )
+        # Get analysis from Claude with minimal processing; system prompt and records are one cacheable prefix
+        response = self.engine.create(**build_request(
+            SYSTEM_MESSAGE, f"Here are the tax records:\n\n{context}",
+            f"{query}\n\nLook at the records carefully and answer based on what you see in the data.",
+            max_tokens=1000))
 
         formatted_response = ""
         for item in response.content: